@@ -0,0 +1,74 @@
+import time
+from collections.abc import Callable
+
+from attrs import define, field
+from httpx import HTTPStatusError, TimeoutException
+
+
+def is_retryable_error(exc: Exception) -> bool:
+    """
+    Server errors and timeouts may be caused by asking for too much at once,
+    so they're worth retrying with a smaller page.
+    """
+    if isinstance(exc, HTTPStatusError):
+        return exc.response.is_server_error
+    return isinstance(exc, TimeoutException)
+
+
+@define
+class AdaptivePageSizer:
+    """
+    Choose export page sizes (`limit` values) to keep each page request close
+    to a target duration, within configured bounds.
+
+    After each page, the limit is scaled by how far the page's duration was
+    from the target (never by more than `max_growth` at once). If a page is
+    larger than `max_page_bytes`, the limit is also scaled down to fit. After
+    a server error or timeout, the limit is cut by `backoff_factor` and the
+    page is retried, up to `max_retries` consecutive times.
+    """
+
+    min_limit: int = 100
+    max_limit: int = 10000
+    target_seconds: float = 2.0
+    initial_limit: int = 1000
+    max_page_bytes: int | None = None
+    max_growth: float = 2.0
+    backoff_factor: float = 0.5
+    max_retries: int = 3
+    clock: Callable[[], float] = field(default=time.monotonic, repr=False)
+
+    limit: int = field(init=False)
+    failures: int = field(init=False, default=0)
+
+    def __attrs_post_init__(self):
+        if not 0 < self.min_limit <= self.max_limit:
+            raise ValueError("Page size bounds must satisfy 0 < min <= max")
+        self.limit = self._clamp(self.initial_limit)
+
+    def _clamp(self, limit: float) -> int:
+        return max(self.min_limit, min(self.max_limit, round(limit)))
+
+    def record_page(self, elapsed: float, nbytes: int):
+        """
+        Adjust the limit based on how long the last page took and how big it
+        was.
+        """
+        self.failures = 0
+        # Guard against a zero duration from a very coarse clock.
+        ratio = self.target_seconds / max(elapsed, 1e-6)
+        factor = max(1 / self.max_growth, min(self.max_growth, ratio))
+        if self.max_page_bytes is not None and nbytes > self.max_page_bytes:
+            factor = min(factor, self.max_page_bytes / nbytes)
+        self.limit = self._clamp(self.limit * factor)
+
+    def record_failure(self, exc: Exception) -> bool:
+        """
+        Shrink the limit after a failed page request. Return True if the page
+        should be retried, or False if the error should be raised.
+        """
+        if not is_retryable_error(exc):
+            return False
+        self.failures += 1
+        self.limit = self._clamp(self.limit * self.backoff_factor)
+        return self.failures <= self.max_retries
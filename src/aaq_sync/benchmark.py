@@ -0,0 +1,285 @@
+"""
+A benchmark harness for the sync pipeline, using synthetic export data.
+
+Run it with `python -m aaq_sync.benchmark --help`.
+"""
+
+import json
+import math
+import random
+import string
+import subprocess
+import sys
+import time
+from collections.abc import Generator, Iterator, Sequence
+from contextlib import contextmanager
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import IO, Any
+
+import click
+from httpx import MockTransport, Request, Response
+from sqlalchemy import URL as DbURL
+from sqlalchemy import Engine, create_engine
+from sqlalchemy.orm import Session
+
+from .cli import DbURLParam
+from .core_sync import core_sync_model_items
+from .data_export_client import ExportClient
+from .data_models import Base, FAQModel
+from .sync import (
+    InsertMethod,
+    fetch_existing,
+    filter_existing,
+    insert_new,
+    sync_model_items,
+)
+
+JSONDict = dict[str, Any]
+
+EXPORT_URL = "https://export.benchmark.invalid/"
+# 2022-04-07, roughly when the real data starts.
+_BASE_TIMESTAMP_MS = 1_649_337_561_000
+_TEXT_CHARS = string.ascii_letters + string.digits + "     \n"
+
+
+def synthetic_faqs(
+    rows: int, text_size: int = 500, array_len: int = 5, seed: int = 0
+) -> list[JSONDict]:
+    """
+    Generate export API JSON for `rows` FAQs, ordered by pkey. `text_size` is
+    the length of the main text field, and `array_len` is the length of each
+    array field. The same seed always generates the same data.
+    """
+    rng = random.Random(seed)  # noqa: S311 (This isn't for crypto.)
+    # Slicing a big random string is much faster than generating lots of small
+    # ones, and still gives every row different text.
+    pool = "".join(rng.choices(_TEXT_CHARS, k=max(4 * text_size, 4096)))
+
+    def text(size: int) -> str:
+        start = rng.randrange(len(pool) - size + 1)
+        return pool[start : start + size]
+
+    faqs = []
+    for faq_id in range(1, rows + 1):
+        added = _BASE_TIMESTAMP_MS + faq_id * 60_000
+        faqs.append({
+            "faq_id": faq_id,
+            "faq_added_utc": added,
+            "faq_updated_utc": added + rng.randrange(86_400_000),
+            "faq_author": text(16),
+            "faq_title": text(64),
+            "faq_content_to_send": text(text_size),
+            "faq_tags": [text(12) for _ in range(array_len)],
+            "faq_questions": [text(64) for _ in range(array_len)],
+            "faq_contexts": None,
+            "faq_thresholds": [round(rng.random(), 3) for _ in range(array_len)],
+            "faq_weight": rng.randrange(10),
+        })
+    return faqs
+
+
+def export_transport(items: Sequence[JSONDict], page_size: int) -> MockTransport:
+    """
+    Build a transport that serves the given items from any data export API
+    path, so that the HTTP stage measures our client rather than a server.
+    Pages of `page_size` items are serialised up front; other pages are
+    serialised on demand.
+    """
+
+    def render(offset: int, limit: int) -> bytes:
+        page = list(items[offset : offset + limit])
+        meta = {"size": len(page), "offset": offset, "limit": limit}
+        return json.dumps({"metadata": meta, "result": page}).encode()
+
+    rendered = {
+        (offset, page_size): render(offset, page_size)
+        for offset in range(0, len(items) + 1, page_size)
+    }
+
+    def handle(request: Request) -> Response:
+        key = (int(request.url.params["offset"]), int(request.url.params["limit"]))
+        body = rendered.get(key) or render(*key)
+        return Response(status_code=200, content=body)
+
+    return MockTransport(handle)
+
+
+@contextmanager
+def _timed(timings: dict[str, float], stage: str) -> Iterator[None]:
+    start = time.perf_counter()
+    yield
+    timings[stage] = time.perf_counter() - start
+
+
+def _fetch_page_bodies(
+    exporter: ExportClient, rows: int, page_size: int
+) -> Generator[bytes, None, None]:
+    """
+    Fetch raw page bodies without parsing them. We know how many rows there
+    are, so we don't need to look at the page metadata to find the end.
+    """
+    for offset in range(0, rows + 1, page_size):
+        yield exporter.get_page_body(FAQModel.__tablename__, page_size, offset)
+
+
+def run_benchmark(
+    engine: Engine,
+    items: Sequence[JSONDict],
+    page_size: int = 1000,
+    insert_method: InsertMethod = "orm",
+) -> JSONDict:
+    """
+    Sync the given items into an empty database one stage at a time, timing
+    each stage separately. Then time end-to-end syncs where nothing has
+    changed, with both the ORM and the core sync engines. Each stage runs to
+    completion before the next starts, so the timings don't include any
+    overlap between stages.
+
+    WARNING: This drops and recreates the AAQ tables in the database.
+    """
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    timings: dict[str, float] = {}
+    transport = export_transport(items, page_size)
+    with ExportClient(EXPORT_URL, "token", transport=transport) as exporter:
+        with _timed(timings, "http"):
+            bodies = list(_fetch_page_bodies(exporter, len(items), page_size))
+        with _timed(timings, "json_decode"):
+            pages = [json.loads(body)["result"] for body in bodies]
+        with _timed(timings, "from_json"):
+            models = [m for page in pages for m in FAQModel.from_json_many(page)]
+
+        with Session(engine) as session:
+            with _timed(timings, "filter_existing"):
+                olds = fetch_existing(FAQModel, session)
+                news = list(filter_existing(olds, models))
+            with _timed(timings, "store_new"):
+                insert_new(FAQModel, session, news, insert_method)
+                session.flush()
+            with _timed(timings, "commit"):
+                session.commit()
+
+        with Session(engine) as session, _timed(timings, "resync_unchanged"):
+            sync_model_items(FAQModel, exporter, session, insert_method=insert_method)
+        with Session(engine) as session, _timed(timings, "resync_unchanged_core"):
+            core_sync_model_items(FAQModel, exporter, session)
+
+    initial_sync = sum(
+        v for k, v in timings.items() if not k.startswith("resync_unchanged")
+    )
+    return {
+        "db": engine.dialect.name,
+        "stages": timings,
+        "initial_sync_seconds": initial_sync,
+        "rows_per_second": len(items) / initial_sync if initial_sync else None,
+    }
+
+
+def time_cli_startup(runs: int = 5) -> float:
+    """
+    Return the best wall-clock time of several runs of `aaq-sync --help`, each
+    in a fresh interpreter. This is dominated by imports, and is what every
+    short-lived run of the CLI pays before it does any work.
+    """
+    cmd = [sys.executable, "-c", "from aaq_sync.cli import main; main()", "--help"]
+    best = math.inf
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(cmd, check=True, capture_output=True)  # noqa: S603
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+@click.command()
+@DbURLParam.option(
+    "db_urls",
+    "--db-url",
+    multiple=True,
+    required=False,
+    help=(
+        "Database to benchmark against. (Multiple allowed.) WARNING: The AAQ"
+        " tables in it are dropped and recreated. Defaults to a temporary"
+        " SQLite database."
+    ),
+)
+@click.option("--rows", type=click.IntRange(min=0), default=10000, show_default=True)
+@click.option(
+    "--page-size", type=click.IntRange(min=1), default=1000, show_default=True
+)
+@click.option(
+    "--text-size",
+    type=click.IntRange(min=0),
+    default=500,
+    show_default=True,
+    help="Length of each FAQ's main text field.",
+)
+@click.option(
+    "--array-len",
+    type=click.IntRange(min=0),
+    default=5,
+    show_default=True,
+    help="Length of each FAQ's array fields.",
+)
+@click.option(
+    "--insert-method",
+    type=click.Choice(["orm", "executemany", "copy"]),
+    default="orm",
+    show_default=True,
+)
+@click.option("--seed", type=int, default=0, show_default=True)
+@click.option(
+    "--startup-runs",
+    type=click.IntRange(min=0),
+    default=5,
+    show_default=True,
+    help="Number of times to time CLI startup, keeping the best. 0 to skip.",
+)
+@click.option(
+    "--output",
+    type=click.File("w"),
+    default="-",
+    help="File to write JSON results to. Defaults to stdout.",
+)
+def main(
+    db_urls: tuple[DbURL, ...],
+    rows: int,
+    page_size: int,
+    text_size: int,
+    array_len: int,
+    insert_method: InsertMethod,
+    seed: int,
+    startup_runs: int,
+    output: IO[str],
+):
+    """
+    Benchmark each stage of the sync pipeline with synthetic FAQs and write the
+    timings as JSON, along with the time the CLI takes to start up.
+    """
+    params = {
+        "rows": rows,
+        "page_size": page_size,
+        "text_size": text_size,
+        "array_len": array_len,
+        "insert_method": insert_method,
+        "seed": seed,
+    }
+    items = synthetic_faqs(rows, text_size, array_len, seed)
+    results = []
+    with TemporaryDirectory() as tmpdir:
+        urls = db_urls or [f"sqlite:///{Path(tmpdir) / 'benchmark.db'}"]
+        for url in urls:
+            engine = create_engine(url, echo=False)
+            try:
+                results.append(run_benchmark(engine, items, page_size, insert_method))
+            finally:
+                engine.dispose()
+    report: JSONDict = {"params": params, "results": results}
+    if startup_runs:
+        report["cli_startup_seconds"] = time_cli_startup(startup_runs)
+    json.dump(report, output, indent=2)
+    output.write("\n")
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
@@ -1,15 +1,45 @@
+"""
+The aaq-sync command line interface.
+
+This is imported every time the CLI runs, including for `--help` and usage
+errors, so it only imports click and the standard library up front. The
+heavier modules (SQLAlchemy, httpx and our models and sync engines) are
+imported by the commands that use them.
+"""
+
+from __future__ import annotations
+
+import signal
+from collections.abc import Callable, Sequence
+from contextlib import ExitStack
+from functools import cache, partial, wraps
+from typing import TYPE_CHECKING, Any
+
 import click
-from httpx import URL as HttpURL
-from sqlalchemy import URL as DbURL
-from sqlalchemy import create_engine
-from sqlalchemy.engine import make_url as make_db_url
-from sqlalchemy.orm import Session
 
-from .data_export_client import ExportClient
-from .data_models import Base, get_models
-from .sync import sync_model_items
+if TYPE_CHECKING:
+    from httpx import URL as HttpURL
+    from sqlalchemy import URL as DbURL
+    from sqlalchemy import Engine
+
+    from .data_export_client import ExportClient
+    from .data_models import Base
+    from .metrics import SyncMetrics
+    from .scheduler import Scheduler
+    from .sync import InsertMethod, OnConflict
+    from .transport import HTTPOptions
 
-MODEL_MAPPING = {m.__tablename__: m for m in get_models()}
+# The names of the AAQ tables we can sync. These are listed here rather than
+# taken from the models so that building the CLI doesn't import them, and a
+# test checks that they match.
+TABLE_NAMES = ("faqmatches",)
+
+
+@cache
+def model_mapping() -> dict[str, type[Base]]:
+    from .data_models import get_models
+
+    return {m.__tablename__: m for m in get_models()}
 
 
 class OptMixin:
@@ -24,6 +54,8 @@ class DbURLParam(click.ParamType, OptMixin):
     name = "db_url"
 
     def convert(self, value, param, ctx):
+        from sqlalchemy.engine import make_url as make_db_url
+
         url = make_db_url(value)
         if url.drivername == "postgresql":
             url = url.set(drivername="postgresql+psycopg")
@@ -34,6 +66,8 @@ class HttpURLParam(click.ParamType, OptMixin):
     name = "http_url"
 
     def convert(self, value, param, ctx):
+        from httpx import URL as HttpURL
+
         return HttpURL(value)
 
 
@@ -42,35 +76,873 @@ class TableChoiceParam(click.Choice, OptMixin):
     envvar_list_splitter = ","
 
     def __init__(self):
-        super().__init__(choices=sorted(MODEL_MAPPING.keys()))
+        super().__init__(choices=sorted(TABLE_NAMES))
 
     def convert(self, value, param, ctx):
-        return MODEL_MAPPING[super().convert(value, param, ctx)]
+        # Check the choice before importing the models to look it up.
+        name = super().convert(value, param, ctx)
+        return model_mapping()[name]
 
 
-@click.command(context_settings={"auto_envvar_prefix": "AAQ_SYNC"})
-@DbURLParam.option("--db-url", help="Database URL.")
+class DefaultGroup(click.Group):
+    """
+    A command group that runs its default command if the first arg isn't the
+    name of another command, so that `aaq-sync --table ...` still syncs.
+    """
+
+    def __init__(self, *args, default_command: str, **kw):
+        super().__init__(*args, **kw)
+        self.default_command = default_command
+
+    def parse_args(self, ctx, args):
+        if not args or (args[0] not in self.commands and args[0] != "--help"):
+            args = [self.default_command, *args]
+        return super().parse_args(ctx, args)
+
+
+# Subcommands set their own envvar prefix, because click would otherwise add
+# the subcommand name to the group's.
+CONTEXT_SETTINGS = {"auto_envvar_prefix": "AAQ_SYNC"}
+
+
+def http_options(func):
+    """
+    Add options for the export API's HTTP client to a command, which receives
+    them as a single `http` argument.
+    """
+    options = [
+        click.option(
+            "--http2",
+            is_flag=True,
+            help=(
+                "Use HTTP/2 if the server supports it, so that prefetched pages"
+                " share a single connection. Needs the h2 package."
+            ),
+        ),
+        click.option(
+            "--max-connections",
+            type=click.IntRange(min=1),
+            default=100,
+            show_default=True,
+            help="Maximum number of connections to the export API.",
+        ),
+        click.option(
+            "--max-keepalive-connections",
+            type=click.IntRange(min=0),
+            default=20,
+            show_default=True,
+            help="Maximum number of idle connections to keep open for reuse.",
+        ),
+        click.option(
+            "--keepalive-expiry",
+            type=click.FloatRange(min=0),
+            default=5.0,
+            show_default=True,
+            help="Close idle connections after this many seconds.",
+        ),
+        click.option(
+            "--http-timeout",
+            type=click.FloatRange(min=0.1),
+            default=5.0,
+            show_default=True,
+            help="Timeout in seconds for connecting and for each network read.",
+        ),
+        click.option(
+            "--compression/--no-compression",
+            default=True,
+            show_default=True,
+            help=(
+                "Ask for compressed responses, using the best encoding that both"
+                " the server and httpx support."
+            ),
+        ),
+        click.option(
+            "--retries",
+            type=click.IntRange(min=0),
+            default=0,
+            show_default=True,
+            help=(
+                "Retry requests that fail with a connection error or a 429, 500,"
+                " 502, 503 or 504 status up to this many times, honouring"
+                " Retry-After."
+            ),
+        ),
+        click.option(
+            "--retry-backoff",
+            type=click.FloatRange(min=0),
+            default=0.5,
+            show_default=True,
+            help="Seconds to wait before the first retry, doubling for each retry.",
+        ),
+    ]
+
+    @wraps(func)
+    def wrapper(
+        *args,
+        http2: bool,
+        max_connections: int,
+        max_keepalive_connections: int,
+        keepalive_expiry: float,
+        http_timeout: float,
+        compression: bool,
+        retries: int,
+        retry_backoff: float,
+        **kw,
+    ):
+        from .transport import HTTPOptions, http2_available, supported_encodings
+
+        if http2 and not http2_available():
+            raise click.UsageError(
+                "--http2 needs the h2 package, which can be installed with"
+                " `pip install aaq-sync[http2]`"
+            )
+        http = HTTPOptions(
+            http2=http2,
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+            timeout=http_timeout,
+            encodings=supported_encodings() if compression else [],
+            retries=retries,
+            backoff=retry_backoff,
+        )
+        return func(*args, http=http, **kw)
+
+    for option in reversed(options):
+        wrapper = option(wrapper)
+    return wrapper
+
+
+@click.command(context_settings=CONTEXT_SETTINGS)
+@DbURLParam.option(
+    "db_urls",
+    "--db-url",
+    envvar="AAQ_SYNC_DB_URL",
+    multiple=True,
+    help="Database URL. (Multiple allowed, to sync to several databases.)",
+)
 @HttpURLParam.option("--export-url", help="Data export API URL.")
 @click.option("--export-token", type=str, required=True, help="Export API auth token.")
 @TableChoiceParam.option(
     "tables", "--table", multiple=True, help="Table to sync. (Multiple allowed.)"
 )
+@click.option(
+    "--prefetch-pages",
+    type=click.IntRange(min=0),
+    default=0,
+    show_default=True,
+    help="Number of export pages to fetch concurrently ahead of processing.",
+)
+@http_options
+@click.option(
+    "--stream",
+    is_flag=True,
+    help="Parse export pages as they arrive instead of buffering them.",
+)
+@click.option(
+    "--adaptive-paging",
+    is_flag=True,
+    help="Adjust the export page size to keep page requests near a target time.",
+)
+@click.option(
+    "--target-page-seconds",
+    type=click.FloatRange(min=0.1),
+    default=2.0,
+    show_default=True,
+    help="Target time per export page request when using adaptive paging.",
+)
+@click.option(
+    "--page-cache",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Cache export pages in this SQLite file, revalidating them with ETags.",
+)
+@click.option(
+    "--page-cache-size",
+    type=click.IntRange(min=1),
+    default=512,
+    show_default=True,
+    help="Maximum size of the page cache in MiB.",
+)
+@click.option(
+    "--page-cache-max-age",
+    type=click.FloatRange(min=0),
+    default=0,
+    show_default=True,
+    help="Use cached pages younger than this many seconds without revalidating.",
+)
+@click.option(
+    "use_async",
+    "--async",
+    is_flag=True,
+    help="Use asyncio to overlap fetching pages with storing items.",
+)
+@click.option(
+    "--parallel-tables",
+    is_flag=True,
+    help="Sync each table concurrently, each in its own transaction.",
+)
+@click.option(
+    "--merge-join",
+    is_flag=True,
+    help=(
+        "Stream existing items in primary key order instead of loading them all."
+        " Best when the export API returns items in primary key order."
+    ),
+)
+@click.option(
+    "--lookup-batch-size",
+    type=click.IntRange(min=1),
+    default=None,
+    help=(
+        "Process new items in batches of this size, only fetching existing items"
+        " with matching primary keys for each batch."
+    ),
+)
+@click.option(
+    "--incremental",
+    is_flag=True,
+    help="Only sync items updated since the last incremental sync.",
+)
+@click.option(
+    "--watermark-param",
+    type=str,
+    default=None,
+    help=(
+        "Export API query param to send the last incremental sync's watermark"
+        " in, if the API supports filtering on it."
+    ),
+)
+@click.option(
+    "--commit-every",
+    type=click.IntRange(min=1),
+    help=(
+        "Commit after this many items and record a checkpoint, so that an"
+        " interrupted sync can resume where it left off."
+    ),
+)
+@click.option(
+    "--prune",
+    is_flag=True,
+    help=(
+        "Delete items that are no longer in the export, after all items have"
+        " been fetched and stored."
+    ),
+)
+@click.option(
+    "--quarantine",
+    is_flag=True,
+    help=(
+        "Validate each export page as a whole and store invalid items with"
+        " their errors in the aaq_sync_quarantine table, instead of failing"
+        " the sync."
+    ),
+)
+@click.option(
+    "--insert-method",
+    type=click.Choice(["orm", "executemany", "copy"]),
+    default="orm",
+    show_default=True,
+    help=(
+        "How to insert new items. 'executemany' and 'copy' bypass the ORM, and"
+        " 'copy' uses PostgreSQL's COPY."
+    ),
+)
+@click.option(
+    "--on-conflict",
+    type=click.Choice(["error", "update"]),
+    default="error",
+    show_default=True,
+    help=(
+        "What to do when an existing item has changed. 'update' upserts all"
+        " items in bulk instead of comparing them with existing items."
+    ),
+)
+@click.option(
+    "--use-digests",
+    is_flag=True,
+    help=(
+        "Compare new items against content digests stored by previous syncs"
+        " instead of loading existing items."
+    ),
+)
+@click.option(
+    "--core",
+    is_flag=True,
+    help=(
+        "Sync with compact row tuples and SQLAlchemy Core instead of ORM"
+        " instances. Uses less memory and CPU for big tables, but doesn't support"
+        " most other sync options."
+    ),
+)
+@click.option(
+    "--interval",
+    type=click.FloatRange(min=0.1),
+    help=(
+        "Keep running and sync each table every this many seconds, until"
+        " stopped with SIGTERM or SIGINT."
+    ),
+)
+@click.option(
+    "--jitter",
+    type=click.FloatRange(min=0, max=1),
+    default=0.1,
+    show_default=True,
+    help="Randomly vary each --interval by up to this fraction of it.",
+)
+@click.option(
+    "--metrics-json",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Write per-stage timings and other sync metrics to this file as JSON.",
+)
+@click.option(
+    "--metrics-prometheus",
+    type=click.Path(dir_okay=False, writable=True),
+    help=(
+        "Write sync metrics to this file in the Prometheus text format, for the"
+        " node exporter's textfile collector."
+    ),
+)
 def aaq_sync(
-    db_url: DbURL,
+    db_urls: tuple[DbURL, ...],
     export_url: HttpURL,
     export_token: str,
     tables: list[type[Base]],
+    prefetch_pages: int,
+    http: HTTPOptions,
+    stream: bool,
+    adaptive_paging: bool,
+    target_page_seconds: float,
+    page_cache: str | None,
+    page_cache_size: int,
+    page_cache_max_age: float,
+    use_async: bool,
+    parallel_tables: bool,
+    merge_join: bool,
+    lookup_batch_size: int | None,
+    incremental: bool,
+    watermark_param: str | None,
+    commit_every: int | None,
+    prune: bool,
+    quarantine: bool,
+    insert_method: InsertMethod,
+    on_conflict: OnConflict,
+    use_digests: bool,
+    core: bool,
+    interval: float | None,
+    jitter: float,
+    metrics_json: str | None,
+    metrics_prometheus: str | None,
 ):
     """
     Sync one or more AAQ tables from the given data export API endpoint to the
     given database.
     """
-    dbengine = create_engine(db_url, echo=False)
-    with (
-        Session(dbengine) as session,
-        ExportClient(export_url, export_token) as exporter,
+    [db_url, *other_db_urls] = db_urls
+    if other_db_urls and (
+        use_async or parallel_tables or commit_every or prune or quarantine
     ):
+        raise click.UsageError(
+            "--async, --parallel-tables, --commit-every, --prune and --quarantine"
+            " can't be used with multiple --db-url"
+        )
+    if prune and (use_async or incremental or commit_every):
+        raise click.UsageError(
+            "--prune can't be used with --async, --incremental or --commit-every"
+        )
+    if quarantine and (use_async or commit_every or prune):
+        raise click.UsageError(
+            "--quarantine can't be used with --async, --commit-every or --prune"
+        )
+    if sum([merge_join, lookup_batch_size is not None, use_digests]) > 1:
+        raise click.UsageError(
+            "Only one of --merge-join, --lookup-batch-size and --use-digests can"
+            " be used"
+        )
+    if stream and prefetch_pages:
+        raise click.UsageError("--stream can't be used with --prefetch-pages")
+    if adaptive_paging and (stream or prefetch_pages):
+        raise click.UsageError(
+            "--adaptive-paging can't be used with --stream or --prefetch-pages"
+        )
+    if page_cache is not None and stream:
+        raise click.UsageError("--page-cache can't be used with --stream")
+    if interval is not None and (use_async or parallel_tables):
+        raise click.UsageError(
+            "--async and --parallel-tables can't be used with --interval"
+        )
+    if use_async and (metrics_json or metrics_prometheus):
+        raise click.UsageError("--async doesn't support metrics")
+    core_unsupported = {
+        "--async": use_async,
+        "--merge-join": merge_join,
+        "--incremental": incremental,
+        "--commit-every": commit_every,
+        "--prune": prune,
+        "--quarantine": quarantine,
+        "--insert-method": insert_method != "orm",
+        "--on-conflict": on_conflict != "error",
+        "--use-digests": use_digests,
+        "multiple --db-url": other_db_urls,
+    }
+    if core and any(core_unsupported.values()):
+        opts = ", ".join(opt for opt, used in core_unsupported.items() if used)
+        raise click.UsageError(f"--core can't be used with {opts}")
+    async_unsupported = {
+        "--parallel-tables": parallel_tables,
+        "--prefetch-pages": prefetch_pages,
+        "--stream": stream,
+        "--adaptive-paging": adaptive_paging,
+        "--page-cache": page_cache is not None,
+        "--merge-join": merge_join,
+        "--lookup-batch-size": lookup_batch_size is not None,
+        "--incremental": incremental,
+        "--watermark-param": watermark_param is not None,
+        "--commit-every": commit_every is not None,
+        "--insert-method": insert_method != "orm",
+        "--on-conflict": on_conflict != "error",
+        "--use-digests": use_digests,
+    }
+    if use_async and any(async_unsupported.values()):
+        opts = ", ".join(opt for opt, used in async_unsupported.items() if used)
+        raise click.UsageError(f"--async can't be used with {opts}")
+    if use_async:
+        import asyncio
+
+        asyncio.run(_aaq_sync_async(db_url, export_url, export_token, tables, http))
+        return
+
+    from sqlalchemy import create_engine
+
+    from .adaptive_paging import AdaptivePageSizer
+    from .core_sync import core_sync_model_items
+    from .data_export_client import ExportClient
+    from .metrics import SyncMetrics
+    from .page_cache import PageCache
+    from .scheduler import Scheduler
+    from .sync import sync_model_items
+
+    page_sizer = None
+    if adaptive_paging:
+        page_sizer = AdaptivePageSizer(target_seconds=target_page_seconds)
+    cache = None
+    if page_cache is not None:
+        max_bytes = page_cache_size * 1024 * 1024
+        cache = PageCache(page_cache, max_bytes, max_age=page_cache_max_age)
+        click.get_current_context().call_on_close(cache.close)
+    metrics = None
+    if metrics_json or metrics_prometheus:
+        metrics = SyncMetrics()
+    exporter = ExportClient(
+        export_url,
+        export_token,
+        prefetch_pages=prefetch_pages,
+        http=http,
+        stream=stream,
+        page_sizer=page_sizer,
+        page_cache=cache,
+        metrics=metrics,
+    )
+    sync_kw: dict[str, Any] = {
+        "merge_join": merge_join,
+        "batch_size": lookup_batch_size,
+        "incremental": incremental,
+        "watermark_param": watermark_param,
+        "insert_method": insert_method,
+        "on_conflict": on_conflict,
+        "use_digests": use_digests,
+        "metrics": metrics,
+    }
+    if commit_every is not None:
+        sync_kw["commit_every"] = commit_every
+    if prune:
+        sync_kw["prune"] = prune
+    if quarantine:
+        sync_kw["quarantine"] = quarantine
+    sync_model: Callable[..., Sequence[Any]] = sync_model_items
+    if core:
+        sync_model = core_sync_model_items
+        sync_kw = {"metrics": metrics}
+        if lookup_batch_size is not None:
+            sync_kw["batch_size"] = lookup_batch_size
+    sync_tables: Callable[[list[type[Base]]], Any]
+    if other_db_urls:
+        dbengines = [create_engine(url, echo=False) for url in db_urls]
+        sync_tables = partial(_sync_tables_fanout, dbengines, exporter, sync_kw=sync_kw)
+    elif parallel_tables:
+        # Each table gets its own connection, so make sure there are enough.
+        dbengine = create_engine(db_url, echo=False, pool_size=max(5, len(tables)))
+        sync_tables = partial(
+            _sync_tables_parallel, dbengine, exporter, sync_model, sync_kw=sync_kw
+        )
+    else:
+        dbengine = create_engine(db_url, echo=False)
+        sync_tables = partial(
+            _sync_tables, dbengine, exporter, sync_model, sync_kw=sync_kw
+        )
+
+    if metrics is not None:
+        sync_tables = _reporting_metrics(
+            sync_tables, metrics, metrics_json, metrics_prometheus
+        )
+
+    with exporter:
+        if interval is None:
+            sync_tables(tables)
+        else:
+            _serve(sync_tables, tables, Scheduler(interval, jitter=jitter))
+
+
+def _reporting_metrics(
+    sync_tables: Callable[[list[type[Base]]], Any],
+    metrics: SyncMetrics,
+    json_path: str | None,
+    prometheus_path: str | None,
+) -> Callable[[list[type[Base]]], Any]:
+    """
+    Wrap a sync function so that the metrics are written out after every
+    sync, whether it succeeds or not. In daemon mode, the metrics accumulate
+    across syncs.
+    """
+
+    def sync_and_report(tables: list[type[Base]]):
+        try:
+            sync_tables(tables)
+        finally:
+            if json_path is not None:
+                metrics.write_json(json_path)
+            if prometheus_path is not None:
+                metrics.write_prometheus(prometheus_path)
+
+    return sync_and_report
+
+
+def _serve(
+    sync_tables: Callable[[list[type[Base]]], Any],
+    tables: list[type[Base]],
+    scheduler: Scheduler,
+):
+    """
+    Sync each table on the scheduler's interval until we get SIGTERM or SIGINT,
+    reusing the same HTTP and db connection pools throughout. A sync that's
+    already running when we're asked to stop is allowed to finish.
+    """
+
+    def on_error(tablename: str, e: Exception):
+        click.echo(f"Failed to sync {tablename}: {e}", err=True)
+
+    jobs = {table.__tablename__: partial(sync_tables, [table]) for table in tables}
+    signals = [signal.SIGTERM, signal.SIGINT]
+    old_handlers = {sig: signal.signal(sig, scheduler.stop) for sig in signals}
+    try:
+        click.echo(f"Syncing every {scheduler.interval:g} seconds until stopped.")
+        scheduler.run(jobs, on_error)
+    finally:
+        for sig, handler in old_handlers.items():
+            signal.signal(sig, handler)
+    click.echo("Stopped.")
+
+
+def _sync_tables(
+    dbengine: Engine,
+    exporter: ExportClient,
+    sync_model: Callable[..., Sequence[Any]],
+    tables: list[type[Base]],
+    sync_kw: dict[str, Any],
+):
+    from sqlalchemy.orm import Session
+
+    with Session(dbengine) as session:
         for table in tables:
             click.echo(f"Syncing {table.__tablename__} ...")
-            synced = sync_model_items(table, exporter, session)
+            synced = sync_model(table, exporter, session, **sync_kw)
             click.echo(f"Synced {len(synced)} {table.__tablename__} items.")
+
+
+def _sync_tables_parallel(
+    dbengine: Engine,
+    exporter: ExportClient,
+    sync_model: Callable[..., Sequence[Any]],
+    tables: list[type[Base]],
+    sync_kw: dict[str, Any],
+):
+    """
+    Sync each table in its own worker thread with its own session, sharing the
+    engine's connection pool and the exporter's HTTP connection pool. Each
+    table's result is reported as soon as it finishes.
+    """
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    from sqlalchemy.orm import Session
+
+    def sync_table(table: type[Base]) -> int:
+        with Session(dbengine) as session:
+            return len(sync_model(table, exporter, session, **sync_kw))
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=len(tables) or 1) as pool:
+        futures = {}
+        for table in tables:
+            click.echo(f"Syncing {table.__tablename__} ...")
+            futures[pool.submit(sync_table, table)] = table.__tablename__
+        for future in as_completed(futures):
+            tablename = futures[future]
+            try:
+                click.echo(f"Synced {future.result()} {tablename} items.")
+            except Exception as e:
+                click.echo(f"Failed to sync {tablename}: {e}", err=True)
+                failed.append(tablename)
+    if failed:
+        raise click.ClickException(f"Failed to sync: {', '.join(sorted(failed))}")
+
+
+def _sync_tables_fanout(
+    dbengines: list[Engine],
+    exporter: ExportClient,
+    tables: list[type[Base]],
+    sync_kw: dict[str, Any],
+):
+    """
+    Sync each table to all the given databases, fetching it from the export API
+    only once. A failure in one database doesn't stop the others.
+    """
+    from sqlalchemy.orm import Session
+
+    from .sync import sync_model_items_fanout
+
+    db_urls = [engine.url for engine in dbengines]
+    failed = []
+    with ExitStack() as stack:
+        sessions = [stack.enter_context(Session(engine)) for engine in dbengines]
+        for table in tables:
+            tablename = table.__tablename__
+            click.echo(f"Syncing {tablename} to {len(sessions)} databases ...")
+            futures = sync_model_items_fanout(table, exporter, sessions, **sync_kw)
+            for url, future in zip(db_urls, futures, strict=True):
+                try:
+                    synced = future.result()
+                    click.echo(f"Synced {len(synced)} {tablename} items to {url}.")
+                except Exception as e:
+                    click.echo(f"Failed to sync {tablename} to {url}: {e}", err=True)
+                    failed.append(f"{tablename} to {url}")
+    if failed:
+        raise click.ClickException(f"Failed to sync: {', '.join(failed)}")
+
+
+async def _aaq_sync_async(
+    db_url: DbURL,
+    export_url: HttpURL,
+    export_token: str,
+    tables: list[type[Base]],
+    http: HTTPOptions,
+):
+    from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+    from .data_export_client import AsyncExportClient
+    from .sync import async_sync_model_items
+
+    dbengine = create_async_engine(db_url, echo=False)
+    try:
+        async with (
+            AsyncSession(dbengine) as session,
+            AsyncExportClient(export_url, export_token, http=http) as exporter,
+        ):
+            for table in tables:
+                click.echo(f"Syncing {table.__tablename__} ...")
+                synced = await async_sync_model_items(table, exporter, session)
+                click.echo(f"Synced {len(synced)} {table.__tablename__} items.")
+    finally:
+        await dbengine.dispose()
+
+
+@click.command(context_settings=CONTEXT_SETTINGS)
+@HttpURLParam.option("--export-url", help="Data export API URL.")
+@click.option("--export-token", type=str, required=True, help="Export API auth token.")
+@TableChoiceParam.option(
+    "tables", "--table", multiple=True, help="Table to dump. (Multiple allowed.)"
+)
+@click.option(
+    "--to-file",
+    type=click.Path(dir_okay=False, writable=True),
+    required=True,
+    help="Snapshot file to write.",
+)
+@click.option(
+    "--prefetch-pages",
+    type=click.IntRange(min=0),
+    default=0,
+    show_default=True,
+    help="Number of export pages to fetch concurrently ahead of processing.",
+)
+@http_options
+def dump(
+    export_url: HttpURL,
+    export_token: str,
+    tables: list[type[Base]],
+    to_file: str,
+    prefetch_pages: int,
+    http: HTTPOptions,
+):
+    """
+    Dump one or more AAQ tables from the given data export API endpoint to a
+    compressed snapshot file, which can be loaded into databases later without
+    using the API.
+    """
+    from .data_export_client import ExportClient
+    from .snapshot import write_snapshot
+
+    exporter = ExportClient(
+        export_url, export_token, prefetch_pages=prefetch_pages, http=http
+    )
+    with exporter as ec:
+        # The items are written as they were exported, and only validated when
+        # they're loaded.
+        items = (
+            (t.__tablename__, ec.get_translated_items(t.__tablename__, lambda i: i))
+            for t in tables
+        )
+        counts = write_snapshot(to_file, items)
+    for tablename, count in counts.items():
+        click.echo(f"Dumped {count} {tablename} items.")
+
+
+@click.command(context_settings=CONTEXT_SETTINGS)
+@DbURLParam.option(
+    "db_urls",
+    "--db-url",
+    envvar="AAQ_SYNC_DB_URL",
+    multiple=True,
+    help="Database URL. (Multiple allowed, to load into several databases.)",
+)
+@click.option(
+    "--from-file",
+    type=click.Path(exists=True, dir_okay=False),
+    required=True,
+    help="Snapshot file to load, written by the dump command.",
+)
+@TableChoiceParam.option(
+    "tables",
+    "--table",
+    multiple=True,
+    required=False,
+    help="Table to load. (Multiple allowed.) Defaults to all tables in the file.",
+)
+@click.option(
+    "--insert-method",
+    type=click.Choice(["orm", "executemany", "copy"]),
+    default="orm",
+    show_default=True,
+    help="How to insert new items. See the sync command.",
+)
+@click.option(
+    "--on-conflict",
+    type=click.Choice(["error", "update"]),
+    default="error",
+    show_default=True,
+    help="What to do when an existing item has changed. See the sync command.",
+)
+def load(
+    db_urls: tuple[DbURL, ...],
+    from_file: str,
+    tables: list[type[Base]],
+    insert_method: InsertMethod,
+    on_conflict: OnConflict,
+):
+    """
+    Load one or more AAQ tables from a snapshot file into the given databases,
+    storing new items the same way a sync does.
+    """
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session
+
+    from .snapshot import SnapshotReader
+    from .sync import store_new
+
+    with SnapshotReader(from_file) as reader:
+        available = reader.tables()
+        if not tables:
+            tables = [model_mapping()[name] for name in available]
+        missing = [t.__tablename__ for t in tables if t.__tablename__ not in available]
+        if missing:
+            raise click.ClickException(f"Not in {from_file}: {', '.join(missing)}")
+        for db_url in db_urls:
+            dbengine = create_engine(db_url, echo=False)
+            with Session(dbengine) as session:
+                for table in tables:
+                    tablename = table.__tablename__
+                    with session.begin():
+                        stored = store_new(
+                            reader.get_model_items(table),
+                            session,
+                            insert_method=insert_method,
+                            on_conflict=on_conflict,
+                        )
+                    click.echo(f"Loaded {len(stored)} {tablename} items into {db_url}.")
+            dbengine.dispose()
+
+
+@click.command(context_settings=CONTEXT_SETTINGS)
+@DbURLParam.option(
+    "--source-db-url", help="Database to copy from, such as a local mirror."
+)
+@DbURLParam.option("--db-url", help="Database to reconcile.")
+@TableChoiceParam.option(
+    "tables", "--table", multiple=True, help="Table to reconcile. (Multiple allowed.)"
+)
+@click.option(
+    "--fanout",
+    type=click.IntRange(min=2),
+    # This is RECONCILE_FANOUT, which we can't import without loading the
+    # models. A test checks that they match.
+    default=16,
+    show_default=True,
+    help="Number of sub-ranges to split each differing pkey range into.",
+)
+@click.option(
+    "--leaf-rows",
+    type=click.IntRange(min=1),
+    # This is RECONCILE_LEAF_ROWS. See --fanout.
+    default=1000,
+    show_default=True,
+    help="Compare ranges with at most this many rows row by row.",
+)
+def reconcile(
+    source_db_url: DbURL,
+    db_url: DbURL,
+    tables: list[type[Base]],
+    fanout: int,
+    leaf_rows: int,
+):
+    """
+    Reconcile one or more AAQ tables in the given database with a source
+    database, fetching only the primary key ranges that differ.
+    """
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session
+
+    from .reconcile import reconcile_model_items
+
+    source_engine = create_engine(source_db_url, echo=False)
+    dest_engine = create_engine(db_url, echo=False)
+    with Session(source_engine) as source, Session(dest_engine) as dest:
+        for table in tables:
+            tablename = table.__tablename__
+            click.echo(f"Reconciling {tablename} ...")
+            result = reconcile_model_items(table, source, dest, fanout, leaf_rows)
+            click.echo(
+                f"Reconciled {tablename} with {result.digest_queries} digest"
+                f" queries: {len(result.inserted)} inserted, {len(result.updated)}"
+                f" updated, {len(result.extra)} only in destination."
+            )
+
+
+@click.group(cls=DefaultGroup, default_command="sync")
+def main():
+    """
+    Sync AAQ tables between instances. Without a command, this runs `sync`.
+    """
+
+
+main.add_command(aaq_sync, "sync")
+main.add_command(dump)
+main.add_command(load)
+main.add_command(reconcile)
@@ -0,0 +1,186 @@
+"""
+An ORM-free sync engine that works on compact row tuples instead of model
+instances.
+
+Each exported item becomes a namedtuple with the model's columns (see
+`row_type`) rather than a mapped dataclass with instance state, and existing
+rows are fetched and new rows inserted with SQLAlchemy Core. Values of columns
+marked with `info={"intern": True}` (or the items of such array columns) are
+interned, so repeated strings such as authors and tags are only stored once.
+"""
+
+from collections import namedtuple
+from collections.abc import Callable, Collection, Iterable, Sequence
+from functools import cache
+from operator import itemgetter
+from sys import intern
+from typing import Any
+
+from sqlalchemy import ColumnElement, insert, select, tuple_
+from sqlalchemy.orm import Session
+
+from .data_export_client import ExportClient
+from .data_models import Base, json_field_translator, validation_error
+from .itertools import chunked
+from .metrics import SyncMetrics, stage
+from .sync import flush_and_commit, model_table, record_stored
+from .sync_state import clear_checkpoint
+
+JSONDict = dict[str, Any]
+
+# How many new rows to look up and insert at a time.
+CORE_BATCH_SIZE = 1000
+
+
+@cache
+def row_type(model: type[Base]) -> Any:
+    """
+    Return a namedtuple type with a field for each of the model's columns, in
+    column order. (The type is built at runtime, so mypy can't know anything
+    more about it.)
+    """
+    fields = [col.name for col in model.__table__.columns]
+    return namedtuple(f"{model.__name__}Row", fields)
+
+
+def _interning(col: ColumnElement, translate: Callable[[Any], Any]):
+    if col.type.python_type is str:
+        return lambda value: None if (v := translate(value)) is None else intern(v)
+    # Only arrays of strings are marked for interning.
+    return lambda value: (
+        None if (v := translate(value)) is None else [intern(item) for item in v]
+    )
+
+
+@cache
+def row_translator(model: type[Base]) -> Callable[[JSONDict], tuple]:
+    """
+    Return a function that translates an item's JSON into a row tuple (see
+    `row_type`), the same way `Base.json_translator` translates it into a model
+    instance.
+    """
+    make_row = row_type(model)._make
+    translators = []
+    for col in model.__table__.columns:
+        translate = json_field_translator(col)
+        if col.info.get("intern"):
+            translate = _interning(col, translate)
+        translators.append((col.name, translate))
+
+    def translate_row(json_dict: JSONDict) -> tuple:
+        try:
+            row = make_row(tr(json_dict[name]) for name, tr in translators)
+        except (KeyError, TypeError, ValueError):
+            raise validation_error(model, json_dict) from None
+        # Every column is present, so any difference in size means extra keys.
+        if len(json_dict) != len(row):
+            raise validation_error(model, json_dict)
+        return row
+
+    return translate_row
+
+
+@cache
+def row_pkey(model: type[Base]) -> Callable[[tuple], Any]:
+    """
+    Return a function that extracts the pkey value from a row tuple. This is a
+    plain value for single-column pkeys and a tuple for composite ones.
+    """
+    names = [col.name for col in model.__table__.columns]
+    return itemgetter(*(names.index(col.name) for col in model.__table__.primary_key))
+
+
+def fetch_existing_rows(
+    model: type[Base], session: Session, pkeys: Collection[Any]
+) -> Iterable[tuple]:
+    """
+    Fetch existing rows with the given pkey values (see `row_pkey`) from the
+    database as row tuples.
+    """
+    table = model_table(model)
+    pkey_cols = list(table.primary_key)
+    if len(pkey_cols) == 1:
+        cond = pkey_cols[0].in_(pkeys)
+    else:
+        cond = tuple_(*pkey_cols).in_(pkeys)
+    make_row = row_type(model)._make
+    return (make_row(row) for row in session.execute(select(table).where(cond)))
+
+
+def _filter_new_rows(
+    model: type[Base], session: Session, batch: list[tuple]
+) -> list[tuple]:
+    """
+    Filter existing rows out of a batch of new rows, only fetching the existing
+    rows that match the batch's pkeys. See `store_new_rows`.
+    """
+    pkey = row_pkey(model)
+    olds = fetch_existing_rows(model, session, {pkey(row) for row in batch})
+    existing = {pkey(old): old for old in olds}
+    news = []
+    for row in batch:
+        key = pkey(row)
+        if (old := existing.get(key)) is None:
+            news.append(row)
+            # Any later row with the same pkey is compared against this one.
+            existing[key] = row
+        elif old != row:
+            ostr = f"{model.__name__}{key if isinstance(key, tuple) else (key,)}"
+            raise ValueError(f"Object already exists with different value: {ostr}")
+    return news
+
+
+def store_new_rows(
+    model: type[Base],
+    session: Session,
+    rows: Iterable[tuple],
+    batch_size: int = CORE_BATCH_SIZE,
+    metrics: SyncMetrics | None = None,
+) -> list[tuple]:
+    """
+    Store new rows in the database, a batch at a time, and return the rows
+    that were stored. Existing rows are looked up by pkey for each batch, and
+    if any doesn't have the same value as a corresponding new row, raise an
+    exception.
+
+    NOTE: This is intended to be a low-level operation and thus doesn't commit
+          the transaction.
+    """
+    table = model_table(model)
+    tablename = model.__tablename__
+    names = [col.name for col in table.columns]
+    stored: list[tuple] = []
+    for batch in chunked(rows, batch_size):
+        with stage(metrics, "filter_existing", tablename):
+            news = _filter_new_rows(model, session, batch)
+        if news:
+            with stage(metrics, "store_new", tablename):
+                values = [dict(zip(names, row, strict=True)) for row in news]
+                session.execute(insert(table), values)
+        stored.extend(news)
+        record_stored(metrics, tablename, len(batch), news)
+    return stored
+
+
+def core_sync_model_items(
+    model: type[Base],
+    exporter: ExportClient,
+    session: Session,
+    batch_size: int = CORE_BATCH_SIZE,
+    metrics: SyncMetrics | None = None,
+) -> Sequence[tuple]:
+    """
+    Fetch items from the data export API as row tuples and store the new ones
+    in the database. This does the same as a basic `sync_model_items` with
+    `batch_size` set, without creating any ORM instances.
+
+    NOTE: This is intended to be a high-level operation and thus commits the
+          transaction.
+    """
+    translate = row_translator(model)
+    rows = exporter.get_translated_items(model.__tablename__, translate)
+    with session.begin():
+        stored = store_new_rows(model, session, rows, batch_size, metrics)
+        clear_checkpoint(session, model)
+        flush_and_commit(session, model, metrics)
+    return stored
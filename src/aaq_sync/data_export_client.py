@@ -1,15 +1,38 @@
-from collections.abc import Generator
-from contextlib import AbstractContextManager
-from typing import Any, Self, TypedDict, TypeVar
+import asyncio
+import json
+import threading
+import time
+from collections import deque
+from collections.abc import AsyncGenerator, Callable, Generator, Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import AbstractAsyncContextManager, AbstractContextManager
+from itertools import count
+from typing import Any, Self, TypedDict, TypeVar, cast
 
-from attrs import define, field
-from httpx import URL, Client
+from attrs import define, evolve, field
+from httpx import (
+    URL,
+    AsyncBaseTransport,
+    AsyncClient,
+    BaseTransport,
+    Client,
+    HTTPError,
+    codes,
+)
 
-from .data_models import Base
+from .adaptive_paging import AdaptivePageSizer
+from .data_models import Base, InvalidItem
+from .itertools import chunked
+from .json_stream import parse_page_stream
+from .metrics import SyncMetrics, stage
+from .page_cache import PageCache
+from .transport import HTTPOptions
 
 T = TypeVar("T")
 # Note: `TGen` on its own is equivalent to `TGen[Any]`.
 TGen = Generator[T, None, None]
+# Note: `TAGen` on its own is equivalent to `TAGen[Any]`.
+TAGen = AsyncGenerator[T, None]
 TBase = TypeVar("TBase", bound=Base)
 
 JSONDict = dict[str, Any]
@@ -26,51 +49,155 @@ class ResponseJSON(TypedDict):
     result: list[JSONDict]
 
 
+def _is_last_page(page_meta: PageMeta) -> bool:
+    return page_meta["size"] < page_meta["limit"]
+
+
+def _auth_headers(auth_token: str) -> dict[str, str]:
+    return {
+        "Accept": "application/json",
+        "Authorization": f"Bearer {auth_token}",
+    }
+
+
 @define
 class PaginatedResponse:
     client: "ExportClient"
     table: str
     page_meta: PageMeta
     items: list[JSONDict]
+    filters: dict[str, Any] = field(factory=dict, kw_only=True)
+    # The size of the response body, if known.
+    nbytes: int = field(default=0, kw_only=True)
 
     @property
     def is_last_page(self):
-        return self.page_meta["size"] < self.page_meta["limit"]
+        return _is_last_page(self.page_meta)
 
     @classmethod
     def from_json(
-        cls, client: "ExportClient", table: str, resp_json: ResponseJSON
+        cls,
+        client: "ExportClient",
+        table: str,
+        resp_json: ResponseJSON,
+        filters: dict[str, Any] | None = None,
+        nbytes: int = 0,
     ) -> Self:
-        return cls(client, table, resp_json["metadata"], resp_json["result"])
+        meta, items = resp_json["metadata"], resp_json["result"]
+        return cls(client, table, meta, items, filters=filters or {}, nbytes=nbytes)
 
     def __iter__(self) -> TGen[JSONDict]:
         yield from self.items
 
-    def iter_all(self) -> TGen[JSONDict]:
-        yield from self.items
+    def next_page(self) -> "PaginatedResponse":
+        limit = self.page_meta["limit"]
+        offset = self.page_meta["offset"] + limit
+        return self.client._get_data_export(
+            self.table, limit=limit, offset=offset, filters=self.filters
+        )
+
+    def iter_pages(self) -> TGen["PaginatedResponse"]:
+        """
+        Iterate over this page and all future pages. If the client has
+        `prefetch_pages` set, future pages are fetched concurrently in the
+        background.
+        """
+        yield self
         if self.is_last_page:
             return
+        if self.client.prefetch_pages > 0:
+            yield from self._iter_prefetched_pages()
+            return
+        page = self
+        while not page.is_last_page:
+            page = page.next_page()
+            yield page
+
+    def _iter_prefetched_pages(self) -> TGen["PaginatedResponse"]:
+        """
+        Iterate over all future pages, keeping up to `client.prefetch_pages`
+        page requests in flight at once. Pages are yielded in order.
+
+        Because we only know we've reached the end when we see a short page,
+        we may request a few pages past the end. Those will be empty and are
+        discarded.
+        """
         limit = self.page_meta["limit"]
-        offset = self.page_meta["offset"] + limit
-        nextpage = self.client._get_data_export(self.table, limit=limit, offset=offset)
-        yield from nextpage.iter_all()
+        offsets = count(self.page_meta["offset"] + limit, limit)
+        pool = ThreadPoolExecutor(
+            max_workers=self.client.prefetch_pages,
+            thread_name_prefix=f"prefetch-{self.table}",
+        )
+        inflight: deque[Future[PaginatedResponse]] = deque()
+
+        def fetch_next():
+            fetch = self.client._get_data_export
+            offset = next(offsets)
+            inflight.append(pool.submit(fetch, self.table, limit, offset, self.filters))
+
+        try:
+            for _ in range(self.client.prefetch_pages):
+                fetch_next()
+            while True:
+                page = inflight.popleft().result()
+                yield page
+                if page.is_last_page:
+                    return
+                fetch_next()
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def iter_all(self) -> TGen[JSONDict]:
+        for page in self.iter_pages():
+            yield from page.items
 
 
 @define
 class ExportClient(AbstractContextManager):
     base_url: URL = field(converter=URL)
     auth_token: str
+    prefetch_pages: int = field(default=0, kw_only=True)
+    # If set, page bodies are parsed incrementally as they arrive instead of
+    # being read into memory all at once. Pages are never prefetched.
+    stream: bool = field(default=False, kw_only=True)
+    # If set, page sizes are chosen adaptively instead of using a fixed limit.
+    # This is a template for each table's own sizer (see `page_sizer_for`).
+    # Pages are neither prefetched nor streamed.
+    page_sizer: AdaptivePageSizer | None = field(default=None, kw_only=True)
+    # If set, page bodies are cached on disk and revalidated with conditional
+    # requests. Streamed pages aren't cached.
+    page_cache: PageCache | None = field(default=None, kw_only=True)
+    # If set, requests are sent through this transport instead of the network.
+    # This is mostly useful for serving synthetic data in benchmarks.
+    transport: BaseTransport | None = field(default=None, kw_only=True)
+    # HTTP/2, connection pool, compression and retry options. Only the retry
+    # options apply to a custom `transport`.
+    http: HTTPOptions = field(factory=HTTPOptions, kw_only=True)
+    # If set, page fetching and translation are timed and counted here.
+    metrics: SyncMetrics | None = field(default=None, kw_only=True)
     _cached_client: Client | None = None
+    # The client may be shared between threads, so make sure we only create
+    # one underlying connection pool.
+    _client_lock: threading.Lock = field(
+        factory=threading.Lock, init=False, repr=False, eq=False
+    )
+    _page_sizers: dict[str, AdaptivePageSizer] = field(
+        factory=dict, init=False, repr=False, eq=False
+    )
+    _page_sizers_lock: threading.Lock = field(
+        factory=threading.Lock, init=False, repr=False, eq=False
+    )
 
     @property
     def _client(self) -> Client:
-        if self._cached_client is None:
-            headers = {
-                "Accept": "application/json",
-                "Authorization": f"Bearer {self.auth_token}",
-            }
-            self._cached_client = Client(headers=headers)
-        return self._cached_client
+        with self._client_lock:
+            if self._cached_client is None:
+                self._cached_client = Client(
+                    headers=_auth_headers(self.auth_token) | self.http.headers(),
+                    transport=self.http.transport(self.transport),
+                    timeout=self.http.timeouts(),
+                )
+            return self._cached_client
 
     def close(self):
         if self._cached_client:
@@ -83,15 +210,316 @@ class ExportClient(AbstractContextManager):
     def get_faqmatches(self, **kw) -> PaginatedResponse:
         return self._get_data_export("faqmatches", **kw)
 
-    def get_model_items(self, model: type[TBase], **kw) -> TGen[TBase]:
-        paginated_items = self._get_data_export(model.__tablename__, **kw)
-        for item in paginated_items.iter_all():
-            yield model.from_json(item)
+    def get_model_items(
+        self,
+        model: type[TBase],
+        on_invalid: Callable[[list[InvalidItem]], Any] | None = None,
+        **kw,
+    ) -> TGen[TBase]:
+        """
+        Fetch all items from the given model's table as instances of the
+        model. By default, the first invalid item raises an exception. If
+        `on_invalid` is set, each page is validated as a whole instead, and
+        any invalid items are passed to it rather than raising. Streamed items
+        are validated in batches of the page size.
+        """
+        if on_invalid is None:
+            return self.get_translated_items(
+                model.__tablename__, model.json_translator(), **kw
+            )
+        return self._get_validated_items(model, on_invalid, **kw)
+
+    def _get_validated_items(
+        self,
+        model: type[TBase],
+        on_invalid: Callable[[list[InvalidItem]], Any],
+        **kw,
+    ) -> TGen[TBase]:
+        table = model.__tablename__
+        pages: Iterator[list[JSONDict]]
+        if self.page_sizer is None and self.stream:
+            items: Iterator[JSONDict] = self._stream_data_export(table, **kw)
+            if self.metrics is not None:
+                items = self.metrics.iter_stage("http", table, items)
+            pages = chunked(items, kw.get("limit", 1000))
+        else:
+            pages = (page.items for page in self._iter_pages(table, **kw))
+        for page in pages:
+            with stage(self.metrics, "from_json", table):
+                valid, invalid = model.validate_many(page)
+            self._count_rows(table, len(page))
+            if invalid:
+                on_invalid(invalid)
+                if self.metrics is not None:
+                    self.metrics.inc("rows_invalid", table, len(invalid))
+            yield from valid
+
+    def get_translated_items(
+        self, table: str, translate: Callable[[JSONDict], T], **kw
+    ) -> TGen[T]:
+        """
+        Fetch all items from the given table, passing each item's JSON through
+        `translate`.
+        """
+        if self.page_sizer is None and self.stream:
+            yield from self._stream_translated_items(table, translate, **kw)
+            return
+        for page in self._iter_pages(table, **kw):
+            with stage(self.metrics, "from_json", table):
+                items = [translate(item) for item in page.items]
+            self._count_rows(table, len(items))
+            yield from items
+
+    def _stream_translated_items(
+        self, table: str, translate: Callable[[JSONDict], T], **kw
+    ) -> TGen[T]:
+        items: Iterator[JSONDict] = self._stream_data_export(table, **kw)
+        if self.metrics is not None:
+            # Streamed pages are parsed as they arrive, so fetching and parsing
+            # are timed together.
+            items = self.metrics.iter_stage("http", table, items)
+        for item in items:
+            with stage(self.metrics, "from_json", table):
+                translated = translate(item)
+            self._count_rows(table, 1)
+            yield translated
+
+    def _iter_pages(self, table: str, **kw) -> Iterator[PaginatedResponse]:
+        if self.page_sizer is not None:
+            return self._iter_adaptive_pages(table, **kw)
+        return self._get_data_export(table, **kw).iter_pages()
+
+    def page_sizer_for(self, table: str) -> AdaptivePageSizer:
+        """
+        Get the given table's page sizer, creating it from `page_sizer` the
+        first time. Each table has its own, because tables may have very
+        different row sizes and may be synced from different threads at once.
+        """
+        template = cast(AdaptivePageSizer, self.page_sizer)
+        with self._page_sizers_lock:
+            if table not in self._page_sizers:
+                self._page_sizers[table] = evolve(template)
+            return self._page_sizers[table]
+
+    def _count_rows(self, table: str, rows: int):
+        if self.metrics is not None:
+            self.metrics.add_rows("from_json", table, rows)
+            self.metrics.inc("rows_fetched", table, rows)
+
+    def _iter_adaptive_pages(
+        self, table: str, offset: int = 0, filters: dict[str, Any] | None = None
+    ) -> TGen[PaginatedResponse]:
+        """
+        Iterate over all pages, starting from the given offset, letting the
+        table's page sizer choose the limit for each page based on how previous
+        pages went.
+        """
+        sizer = self.page_sizer_for(table)
+        while True:
+            start = sizer.clock()
+            try:
+                page = self._get_data_export(table, sizer.limit, offset, filters)
+            except HTTPError as e:
+                if sizer.record_failure(e):
+                    continue
+                raise
+            sizer.record_page(sizer.clock() - start, page.nbytes)
+            yield page
+            if page.is_last_page:
+                return
+            offset = page.page_meta["offset"] + page.page_meta["limit"]
+
+    def _stream_data_export(
+        self,
+        table: str,
+        limit: int = 1000,
+        offset: int = 0,
+        filters: dict[str, Any] | None = None,
+    ) -> TGen[JSONDict]:
+        """
+        Iterate over all items from all pages, starting from the given offset.
+        Each item is yielded as soon as it has been parsed from the response
+        body, and the page metadata is read at the end of each page to decide
+        whether there's another page to fetch.
+        """
+        while True:
+            params = {**(filters or {}), "limit": limit, "offset": offset}
+            url = self.base_url.join(table)
+            with self._client.stream("GET", url, params=params) as resp:
+                resp.raise_for_status()
+                others = yield from parse_page_stream(resp.iter_text())
+            page_meta: PageMeta = others["metadata"]
+            if self.metrics is not None:
+                # We don't know the latency of a streamed page, because the
+                # time it takes includes whatever the caller does with it.
+                nbytes = resp.num_bytes_downloaded
+                self._record_page(self.metrics, table, nbytes, page_meta["size"])
+            if _is_last_page(page_meta):
+                return
+            limit = page_meta["limit"]
+            offset = page_meta["offset"] + limit
+
+    def get_page_body(
+        self,
+        table: str,
+        limit: int = 1000,
+        offset: int = 0,
+        filters: dict[str, Any] | None = None,
+    ) -> bytes:
+        """
+        Fetch a single page of items as the raw response body, without
+        decoding it. Any `filters` are sent as extra query params. The page
+        cache is used if there is one.
+        """
+        params = {**(filters or {}), "limit": limit, "offset": offset}
+        url = self.base_url.join(table).copy_merge_params(params)
+        if self.page_cache is not None:
+            return self._get_cached(self.page_cache, url)
+        resp = self._client.get(url)
+        resp.raise_for_status()
+        return resp.content
 
     def _get_data_export(
-        self, table: str, limit: int = 1000, offset: int = 0
+        self,
+        table: str,
+        limit: int = 1000,
+        offset: int = 0,
+        filters: dict[str, Any] | None = None,
     ) -> PaginatedResponse:
+        """
+        Fetch a single page of items. Any `filters` are sent as extra query
+        params with every page request.
+        """
+        start = time.perf_counter()
+        with stage(self.metrics, "http", table):
+            body = self.get_page_body(table, limit, offset, filters)
+        latency = time.perf_counter() - start
+        with stage(self.metrics, "json_decode", table):
+            resp_json = json.loads(body)
+        if self.metrics is not None:
+            rows = len(resp_json["result"])
+            self._record_page(self.metrics, table, len(body), rows, latency)
+        return PaginatedResponse.from_json(
+            self, table, resp_json, filters, nbytes=len(body)
+        )
+
+    def _record_page(
+        self,
+        metrics: SyncMetrics,
+        table: str,
+        nbytes: int,
+        rows: int,
+        latency: float | None = None,
+    ):
+        metrics.inc("pages_fetched", table)
+        metrics.inc("bytes_received", table, nbytes)
+        if latency is not None:
+            # Streamed pages (with no latency) have their rows counted as
+            # they're parsed.
+            metrics.add_rows("http", table, rows)
+            metrics.add_rows("json_decode", table, rows)
+            metrics.observe("page_latency_seconds", table, latency)
+
+    def _get_cached(self, cache: PageCache, url: URL) -> bytes:
+        """
+        Fetch a page body through the page cache. Fresh cached pages are used
+        as-is, and stale ones are revalidated if the server gave us a validator
+        for them.
+        """
+        key = str(url)
+        cached = cache.get(key)
+        if cached is not None and cache.is_fresh(cached):
+            return cached.body
+        headers = {} if cached is None else cached.validator_headers()
+        resp = self._client.get(url, headers=headers)
+        if cached is not None and resp.status_code == codes.NOT_MODIFIED:
+            cache.revalidated(key)
+            return cached.body
+        resp.raise_for_status()
+        etag = resp.headers.get("ETag")
+        last_modified = resp.headers.get("Last-Modified")
+        cache.put(key, resp.content, etag, last_modified)
+        return resp.content
+
+
+@define
+class AsyncExportClient(AbstractAsyncContextManager):
+    """
+    An asyncio equivalent of ExportClient. While the items from one page are
+    being consumed, the next page is already being fetched.
+    """
+
+    base_url: URL = field(converter=URL)
+    auth_token: str
+    # If set, requests are sent through this transport instead of the network.
+    transport: AsyncBaseTransport | None = field(default=None, kw_only=True)
+    # HTTP/2, connection pool, compression and retry options. Only the retry
+    # options apply to a custom `transport`.
+    http: HTTPOptions = field(factory=HTTPOptions, kw_only=True)
+    _cached_client: AsyncClient | None = None
+
+    @property
+    def _client(self) -> AsyncClient:
+        if self._cached_client is None:
+            self._cached_client = AsyncClient(
+                headers=_auth_headers(self.auth_token) | self.http.headers(),
+                transport=self.http.async_transport(self.transport),
+                timeout=self.http.timeouts(),
+            )
+        return self._cached_client
+
+    async def aclose(self):
+        if self._cached_client:
+            await self._cached_client.aclose()
+            self._cached_client = None
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.aclose()
+
+    async def get_model_items(self, model: type[TBase], **kw) -> TAGen[TBase]:
+        async for page in self.get_model_pages(model, **kw):
+            for item in page:
+                yield item
+
+    async def get_model_pages(self, model: type[TBase], **kw) -> TAGen[list[TBase]]:
+        """
+        Fetch all items for the given model a page at a time. Each page is
+        translated into a list of model instances.
+        """
+        async for resp_json in self._iter_data_export(model.__tablename__, **kw):
+            yield model.from_json_many(resp_json["result"])
+
+    async def _iter_data_export(
+        self, table: str, limit: int = 1000, offset: int = 0
+    ) -> TAGen[ResponseJSON]:
+        """
+        Iterate over all pages, starting from the given offset. The request for
+        each page is sent before the previous page is yielded, so fetching
+        overlaps with whatever the caller does with the previous page.
+        """
+        nextpage: asyncio.Future[ResponseJSON] | None = asyncio.ensure_future(
+            self._get_data_export(table, limit, offset)
+        )
+        try:
+            while nextpage is not None:
+                resp_json = await nextpage
+                nextpage = None
+                page_meta = resp_json["metadata"]
+                if not _is_last_page(page_meta):
+                    limit = page_meta["limit"]
+                    offset = page_meta["offset"] + limit
+                    nextpage = asyncio.ensure_future(
+                        self._get_data_export(table, limit, offset)
+                    )
+                yield resp_json
+        finally:
+            if nextpage is not None:
+                nextpage.cancel()
+
+    async def _get_data_export(
+        self, table: str, limit: int = 1000, offset: int = 0
+    ) -> ResponseJSON:
         params = {"limit": limit, "offset": offset}
-        resp = self._client.get(self.base_url.join(table), params=params)
+        resp = await self._client.get(self.base_url.join(table), params=params)
         resp.raise_for_status()
-        return PaginatedResponse.from_json(self, table, resp.json())
+        return resp.json()
@@ -1,60 +1,290 @@
-from collections.abc import Collection
-from datetime import datetime
-from typing import Any, Self, TypeVar
+import hashlib
+import json
+from collections import defaultdict
+from collections.abc import Callable, Collection, Iterable, Sequence
+from datetime import UTC, datetime
+from typing import Any, ClassVar, NamedTuple, Self, TypeVar
 
-from sqlalchemy import ARRAY, ColumnElement, Float, String
+from sqlalchemy import ARRAY, JSON, ColumnElement, Float, String
 from sqlalchemy.orm import DeclarativeBase, Mapped, MappedAsDataclass, mapped_column
 
 T = TypeVar("T")
+TBase = TypeVar("TBase", bound="Base")
 
+JSONDict = dict[str, Any]
 
-def _translate_json_field(col: ColumnElement, value: T) -> T | datetime | None:
+
+class InvalidItem(NamedTuple):
+    """
+    An item that failed validation, with every problem found with it.
     """
-    Translate the JSON representation of a field to a db-friendly form and do
-    basic type validation.
+
+    item: JSONDict
+    errors: list[str]
+
+
+class ValidationError(ValueError):
+    """
+    One or more items failed validation. The invalid items and their errors
+    are in `invalid`.
+    """
+
+    def __init__(self, table: str, invalid: list[InvalidItem]):
+        self.invalid = invalid
+        errors = "; ".join(invalid[0].errors)
+        more = ""
+        if len(invalid) > 1:
+            more = f" (and {len(invalid) - 1} more invalid items)"
+        super().__init__(f"Invalid {table} item: {errors}{more}")
+
+
+def json_field_translator(col: ColumnElement) -> Callable[[Any], Any]:
+    """
+    Build a function that translates the JSON representation of a field to a
+    db-friendly form and does basic type validation. Everything that depends
+    only on the column is worked out up front, so the returned function does as
+    little as possible per value.
     """
     # col.type.python_type may raise NotImplementedError (when using
     # TypeDecorator, for example) but nothing in our existing models does that.
     col_pyt = col.type.python_type
-    match value:
-        case None if col.nullable:
-            # Nullability isn't part of the python_type, so we need to check
-            # for it separately.
-            return value
-        case int(v) if col_pyt is datetime:
-            # Timestamps are represented as milliseconds since the unix epoch.
-            return datetime.utcfromtimestamp(v / 1000)
-        case _ if not isinstance(value, col_pyt):
+    col_name = col.name
+
+    def check_type(value: T) -> T:
+        if not isinstance(value, col_pyt):
             [vtype, ctype] = [t.__name__ for t in [type(value), col_pyt]]
-            raise TypeError(f"{col.name} has type {vtype}, expected {ctype}")
-    # Everything else is already in an appropriate form.
+            raise TypeError(f"{col_name} has type {vtype}, expected {ctype}")
+        # Everything else is already in an appropriate form.
+        return value
+
+    translate: Callable[[Any], Any] = check_type
+    if col_pyt is datetime:
+
+        def translate(value: T) -> T | datetime:
+            if isinstance(value, int):
+                # Timestamps are represented as milliseconds since the unix epoch.
+                try:
+                    return datetime.utcfromtimestamp(value / 1000)
+                except (OverflowError, OSError, ValueError) as e:
+                    raise ValueError(f"{col_name} timestamp is out of range") from e
+            return check_type(value)
+
+    if col.nullable:
+        # Nullability isn't part of the python_type, so we need to check for it
+        # separately.
+        not_null = translate
+
+        def translate(value: T) -> T | datetime | None:
+            return None if value is None else not_null(value)
+
+    return translate
+
+
+def _untranslate_json_field(value: T) -> T | int:
+    """
+    Translate a db-friendly field value back to its JSON representation. This
+    is the inverse of `json_field_translator`.
+    """
+    if isinstance(value, datetime):
+        # Timestamps are represented as milliseconds since the unix epoch.
+        return round(value.replace(tzinfo=UTC).timestamp() * 1000)
     return value
 
 
+def _build_json_translator(
+    model: type[TBase],
+) -> Callable[[dict[str, Any]], TBase]:
+    translators = tuple(
+        (c.name, json_field_translator(c)) for c in model.__table__.columns
+    )
+
+    def translate(json_dict: dict[str, Any]) -> TBase:
+        try:
+            json_fixed = {name: tr(json_dict[name]) for name, tr in translators}
+        except (KeyError, TypeError, ValueError):
+            raise validation_error(model, json_dict) from None
+        # Every column is present, so any difference in size means extra keys.
+        if len(json_dict) != len(json_fixed):
+            raise validation_error(model, json_dict)
+        return model(**json_fixed)
+
+    return translate
+
+
+def validation_error(model: type["Base"], json_dict: JSONDict) -> ValidationError:
+    """
+    Build an exception for an item we already know is invalid, with every
+    problem found with it. The per-item translators stop at the first problem,
+    so we validate the item again to find the rest.
+    """
+    _, invalid = model.validate_many([json_dict])
+    return ValidationError(model.__tablename__, invalid)
+
+
+def _build_page_validator(
+    model: type[TBase],
+) -> Callable[[Sequence[JSONDict]], tuple[list[TBase], list[InvalidItem]]]:
+    names = tuple(c.name for c in model.__table__.columns)
+    translators = tuple(json_field_translator(c) for c in model.__table__.columns)
+    known = frozenset(names)
+
+    def validate(
+        json_dicts: Sequence[JSONDict],
+    ) -> tuple[list[TBase], list[InvalidItem]]:
+        errors: dict[int, list[str]] = defaultdict(list)
+        # We translate a column at a time so that each translator is used for
+        # the whole page in a tight loop.
+        columns = []
+        for name, translate in zip(names, translators, strict=True):
+            values = []
+            for i, json_dict in enumerate(json_dicts):
+                try:
+                    values.append(translate(json_dict[name]))
+                except KeyError:
+                    errors[i].append(f"{name} is missing")
+                    values.append(None)
+                except (TypeError, ValueError) as e:
+                    errors[i].append(str(e))
+                    values.append(None)
+            columns.append(values)
+        for i, json_dict in enumerate(json_dicts):
+            # Items with every column present and no extra keys are the same
+            # size, so we only need to look closer at the others.
+            needs_check = len(json_dict) != len(names) or i in errors
+            if needs_check and (extra := json_dict.keys() - known):
+                keys = ", ".join(sorted(extra))
+                errors[i].append(
+                    f"Extra keys in JSON for {model.__tablename__}: {keys}"
+                )
+
+        items = []
+        invalid = []
+        for i, (json_dict, *values) in enumerate(
+            zip(json_dicts, *columns, strict=True)
+        ):
+            if i in errors:
+                invalid.append(InvalidItem(json_dict, errors[i]))
+            else:
+                items.append(model(**dict(zip(names, values, strict=True))))
+        return items, invalid
+
+    return validate
+
+
 class Base(MappedAsDataclass, DeclarativeBase):
+    _cached_json_translator: ClassVar[Callable[[dict[str, Any]], Any] | None] = None
+    _cached_page_validator: ClassVar[
+        Callable[[Sequence[JSONDict]], tuple[list[Any], list[InvalidItem]]] | None
+    ] = None
+
+    # SQLite doesn't have arrays, so we store them as JSON there instead.
     type_annotation_map = {
-        list[str]: ARRAY(String),
-        list[float]: ARRAY(Float),
+        list[str]: ARRAY(String).with_variant(JSON(), "sqlite"),
+        list[float]: ARRAY(Float).with_variant(JSON(), "sqlite"),
     }
 
     @classmethod
     def from_json(cls, json_dict: dict[str, Any]) -> Self:
         """
         Perform any translations or corrections necessary on the JSON data
-        before instantiating this model.
+        before instantiating this model. If the data is invalid, a
+        ValidationError with all the problems found is raised.
+        """
+        return cls.json_translator()(json_dict)
+
+    @classmethod
+    def from_json_many(cls, json_dicts: Iterable[dict[str, Any]]) -> list[Self]:
+        """
+        Translate many JSON items into instances of this model. See `from_json`.
+        If any items are invalid, a ValidationError listing them is raised.
+        """
+        items, invalid = cls.validate_many(list(json_dicts))
+        if invalid:
+            raise ValidationError(cls.__tablename__, invalid)
+        return items
+
+    @classmethod
+    def validate_many(
+        cls, json_dicts: Sequence[dict[str, Any]]
+    ) -> tuple[list[Self], list[InvalidItem]]:
+        """
+        Translate a page of JSON items into instances of this model, checking
+        each column across the whole page in one pass. Return the valid items
+        and, separately, the invalid ones with every problem found with each.
+        """
+        # We look in the class dict directly so we don't find a parent's.
+        if (validator := cls.__dict__.get("_cached_page_validator")) is None:
+            validator = _build_page_validator(cls)
+            cls._cached_page_validator = validator
+        return validator(json_dicts)
+
+    @classmethod
+    def json_translator(cls) -> Callable[[dict[str, Any]], Self]:
+        """
+        Return a function that translates JSON data into an instance of this
+        model. This is built the first time it's needed for each model and
+        reused after that.
+        """
+        # We look in the class dict directly so we don't find a parent's.
+        if (translator := cls.__dict__.get("_cached_json_translator")) is None:
+            translator = _build_json_translator(cls)
+            cls._cached_json_translator = translator
+        return translator
+
+    @classmethod
+    def watermark_column(cls) -> ColumnElement:
+        """
+        Return the column used to track how far an incremental sync has got.
+        This is the column marked with `info={"watermark": True}` if there is
+        one, otherwise the (single) primary key column.
+        """
+        for col in cls.__table__.columns:
+            if col.info.get("watermark"):
+                return col
+        [pkey_col] = cls.__table__.primary_key
+        return pkey_col
+
+    def watermark_json_value(self) -> Any:
+        """
+        Return the JSON representation of this instance's watermark column
+        value. See `watermark_column`.
+        """
+        return _untranslate_json_field(getattr(self, self.watermark_column().name))
+
+    def column_values(self) -> tuple:
+        """
+        Return this instance's column values, in column order. Comparing these
+        is much cheaper than comparing `dataclasses.asdict()` results, which
+        deep-copy everything.
+        """
+        return tuple(getattr(self, c.name) for c in self.__table__.columns)
+
+    def clone(self) -> Self:
+        """
+        Return a new, transient instance with the same column values. This is
+        much cheaper than translating the same JSON again, and lets the same
+        item be added to several sessions. Column values are shared, not
+        copied.
+        """
+        cols = self.__table__.columns
+        return type(self)(**{c.name: getattr(self, c.name) for c in cols})
 
-        TODO: Better validation. Specifically, it would be nice to get all the
-            validation errors at once instead of failing on the first.
+    def content_digest(self) -> bytes:
+        """
+        Return a stable 16-byte digest of this instance's column values, for
+        cheap change detection. The digest is computed over a canonical JSON
+        encoding of the values in their export API representation.
+        """
+        values = [_untranslate_json_field(v) for v in self.column_values()]
+        encoded = json.dumps(values, ensure_ascii=False, separators=(",", ":"))
+        return hashlib.blake2b(encoded.encode(), digest_size=16).digest()
+
+    def to_row(self) -> dict[str, Any]:
+        """
+        Return this instance's column values as a dict keyed by column name,
+        suitable for a Core insert.
         """
-        json_fixed = {
-            c.name: _translate_json_field(c, json_dict[c.name])
-            for c in cls.__table__.columns
-        }
-        extra_keys = json_dict.keys() - json_fixed.keys()
-        if extra_keys:
-            keys = ", ".join(sorted(extra_keys))
-            raise ValueError(f"Extra keys in JSON for {cls.__tablename__}: {keys}")
-        return cls(**json_fixed)
+        return {c.name: getattr(self, c.name) for c in self.__table__.columns}
 
     def pkey_value(self) -> tuple:
         """
@@ -81,11 +311,13 @@ class FAQModel(Base, kw_only=True):
 
     faq_id: Mapped[int] = mapped_column(default=None, primary_key=True)
     faq_added_utc: Mapped[datetime]
-    faq_updated_utc: Mapped[datetime]
-    faq_author: Mapped[str]
+    faq_updated_utc: Mapped[datetime] = mapped_column(info={"watermark": True})
+    faq_author: Mapped[str] = mapped_column(info={"intern": True})
     faq_title: Mapped[str]
     faq_content_to_send: Mapped[str]
-    faq_tags: Mapped[list[str] | None] = mapped_column(default=None)
+    faq_tags: Mapped[list[str] | None] = mapped_column(
+        default=None, info={"intern": True}
+    )
     faq_questions: Mapped[list[str]]
     faq_contexts: Mapped[list[str] | None] = mapped_column(default=None)
     faq_thresholds: Mapped[list[float] | None] = mapped_column(default=None)
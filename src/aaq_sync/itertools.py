@@ -1,9 +1,22 @@
-from collections.abc import Iterable, Iterator
+from collections.abc import Generator, Iterable, Iterator
+from itertools import islice
 from typing import Generic, TypeVar
 
 T = TypeVar("T")
 
 
+def chunked(iterable: Iterable[T], size: int) -> Generator[list[T], None, None]:
+    """
+    Split an iterable into lists of (at most) the given size. The last chunk
+    may be smaller.
+    """
+    if size < 1:
+        raise ValueError("Chunk size must be at least 1")
+    it = iter(iterable)
+    while chunk := list(islice(it, size)):
+        yield chunk
+
+
 class IteratorWithFinishedCheck(Generic[T]):
     """
     An iterator that knows if it's reached its end.
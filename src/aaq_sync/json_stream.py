@@ -0,0 +1,143 @@
+import json
+from collections.abc import Generator, Iterable
+from typing import Any
+
+JSONDict = dict[str, Any]
+
+_WHITESPACE = " \t\n\r"
+_VALUE_TERMINATORS = _WHITESPACE + ",:]}"
+_decoder = json.JSONDecoder()
+
+
+class _NeedMoreData(Exception):
+    """
+    Raised internally when the buffer doesn't contain enough data yet.
+    """
+
+
+class _Buffer:
+    """
+    A text buffer that we consume from the front and append to at the back.
+    """
+
+    def __init__(self, chunks: Iterable[str]):
+        self._chunks = iter(chunks)
+        self.text = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self) -> bool:
+        """
+        Read another chunk into the buffer. Return False if there's nothing
+        left to read.
+        """
+        for chunk in self._chunks:
+            if chunk:
+                # Drop the consumed part of the buffer once it's large enough to
+                # be worth copying the rest.
+                if self.pos > len(self.text) // 2:
+                    self.text = self.text[self.pos :]
+                    self.pos = 0
+                self.text += chunk
+                return True
+        self.eof = True
+        return False
+
+    def peek(self) -> str:
+        """
+        Skip whitespace and return the next character without consuming it.
+        """
+        while True:
+            while self.pos < len(self.text) and self.text[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.fill():
+                msg = "Unexpected end of data"
+                raise json.JSONDecodeError(msg, self.text, self.pos)
+
+    def expect(self, chars: str) -> str:
+        """
+        Consume the next non-whitespace character, which must be one of the
+        given characters.
+        """
+        char = self.peek()
+        if char not in chars:
+            expected = " or ".join(repr(c) for c in chars)
+            msg = f"Expecting {expected}"
+            raise json.JSONDecodeError(msg, self.text, self.pos)
+        self.pos += 1
+        return char
+
+    def decode_value(self) -> Any:
+        """
+        Decode and consume the next complete JSON value, reading more data as
+        necessary.
+        """
+        self.peek()
+        while True:
+            try:
+                return self._try_decode_value()
+            except _NeedMoreData:
+                if not self.fill():
+                    # This will either succeed or raise the real decode error.
+                    return self._try_decode_value()
+
+    def _try_decode_value(self) -> Any:
+        try:
+            value, end = _decoder.raw_decode(self.text, self.pos)
+        except json.JSONDecodeError:
+            if self.eof:
+                raise
+            raise _NeedMoreData() from None
+        # A number at the end of the buffer may be cut off partway through (so
+        # "1.5" might look like "1" followed by "."), so we only trust a value
+        # if it's followed by something that can actually end a value.
+        if not self.eof and (
+            end == len(self.text) or self.text[end] not in _VALUE_TERMINATORS
+        ):
+            raise _NeedMoreData()
+        self.pos = end
+        return value
+
+
+def parse_page_stream(
+    chunks: Iterable[str], items_key: str = "result"
+) -> Generator[JSONDict, None, JSONDict]:
+    """
+    Incrementally parse a JSON object from a stream of text chunks, yielding
+    each item of the `items_key` array as soon as it has been read. Any other
+    top-level fields (such as pagination metadata) are returned as a dict when
+    the generator finishes, so callers can use `meta = yield from ...`.
+
+    Only the item currently being parsed needs to be held in memory, so peak
+    memory doesn't depend on how many items are in the page.
+    """
+    buf = _Buffer(chunks)
+    others: JSONDict = {}
+    buf.expect("{")
+    if buf.peek() == "}":
+        buf.expect("}")
+        return others
+    while True:
+        key = buf.decode_value()
+        if not isinstance(key, str):
+            raise json.JSONDecodeError("Expecting property name", buf.text, buf.pos)
+        buf.expect(":")
+        if key == items_key and buf.peek() == "[":
+            yield from _parse_array_items(buf)
+        else:
+            others[key] = buf.decode_value()
+        if buf.expect(",}") == "}":
+            return others
+
+
+def _parse_array_items(buf: _Buffer) -> Generator[Any, None, None]:
+    buf.expect("[")
+    if buf.peek() == "]":
+        buf.expect("]")
+        return
+    while True:
+        yield buf.decode_value()
+        if buf.expect(",]") == "]":
+            return
@@ -0,0 +1,267 @@
+import json
+import math
+import threading
+import time
+from collections import defaultdict
+from collections.abc import Callable, Iterable, Iterator
+from contextlib import AbstractContextManager, contextmanager, nullcontext
+from os import PathLike
+from pathlib import Path
+from typing import Any, Generic, Self, TypeVar
+
+from attrs import define, field
+
+T = TypeVar("T")
+
+# Page request latency buckets, in seconds.
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+PROMETHEUS_PREFIX = "aaq_sync"
+
+
+@define
+class Histogram:
+    """
+    A cumulative histogram in the Prometheus style: each bucket counts the
+    observations less than or equal to its upper bound.
+    """
+
+    buckets: tuple[float, ...] = LATENCY_BUCKETS
+    counts: list[int] = field(init=False)
+    sum: float = 0.0
+    count: int = 0
+
+    def __attrs_post_init__(self):
+        self.counts = [0] * len(self.buckets)
+
+    def observe(self, value: float):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+    def bucket_counts(self) -> dict[str, int]:
+        """
+        Return the cumulative count for each bucket, including the implicit
+        "+Inf" bucket, keyed by its upper bound.
+        """
+        counts = {
+            _format_float(b): c for b, c in zip(self.buckets, self.counts, strict=True)
+        }
+        return counts | {"+Inf": self.count}
+
+
+class CountingIterator(Generic[T]):
+    """
+    An iterator that counts the items it has produced.
+    """
+
+    def __init__(self, items: Iterable[T]):
+        self._it = iter(items)
+        self.count = 0
+
+    def __iter__(self) -> Self:
+        return self
+
+    def __next__(self) -> T:
+        item = next(self._it)
+        self.count += 1
+        return item
+
+
+@define
+class StageStats:
+    seconds: float = 0.0
+    rows: int = 0
+
+
+class _StageStack(threading.local):
+    def __init__(self):
+        # Each frame is [(stage, table), start time of the current slice].
+        self.frames: list[list[Any]] = []
+
+
+@define
+class SyncMetrics:
+    """
+    Counters, histograms and per-stage timings for syncs, all labelled by
+    table.
+
+    Stage timings are exclusive: while a nested stage is running (for example,
+    pulling items from the export API while filtering them), the enclosing
+    stage's clock is paused. This lets us attribute time correctly through
+    our chains of lazy iterators. Stages running in several threads at once
+    are each timed separately and summed.
+
+    All methods are safe to call from several threads.
+    """
+
+    counters: dict[tuple[str, str], float] = field(factory=lambda: defaultdict(float))
+    histograms: dict[tuple[str, str], Histogram] = field(factory=dict)
+    stages: dict[tuple[str, str], StageStats] = field(
+        factory=lambda: defaultdict(StageStats)
+    )
+    clock: Callable[[], float] = field(default=time.perf_counter, repr=False)
+    _lock: threading.Lock = field(
+        factory=threading.Lock, init=False, repr=False, eq=False
+    )
+    _stack: _StageStack = field(factory=_StageStack, init=False, repr=False)
+
+    def inc(self, name: str, table: str, value: float = 1):
+        with self._lock:
+            self.counters[name, table] += value
+
+    def observe(self, name: str, table: str, value: float):
+        with self._lock:
+            if (name, table) not in self.histograms:
+                self.histograms[name, table] = Histogram()
+            self.histograms[name, table].observe(value)
+
+    def add_rows(self, stage: str, table: str, rows: int):
+        with self._lock:
+            self.stages[stage, table].rows += rows
+
+    def _add_time(self, key: tuple[str, str], seconds: float):
+        with self._lock:
+            self.stages[key].seconds += seconds
+
+    @contextmanager
+    def stage(self, stage: str, table: str) -> Iterator[None]:
+        """
+        Time the enclosed code as part of the given stage, pausing the clock
+        of any enclosing stage in this thread.
+        """
+        frames = self._stack.frames
+        now = self.clock()
+        if frames:
+            self._add_time(frames[-1][0], now - frames[-1][1])
+        frames.append([(stage, table), now])
+        try:
+            yield
+        finally:
+            now = self.clock()
+            key, start = frames.pop()
+            self._add_time(key, now - start)
+            if frames:
+                frames[-1][1] = now
+
+    def iter_stage(self, stage: str, table: str, items: Iterable[T]) -> Iterator[T]:
+        """
+        Time producing each item from the given iterable as part of the given
+        stage, and count the items produced as the stage's rows.
+        """
+        it = iter(items)
+        rows = 0
+        try:
+            while True:
+                with self.stage(stage, table):
+                    try:
+                        item = next(it)
+                    except StopIteration:
+                        return
+                rows += 1
+                yield item
+        finally:
+            self.add_rows(stage, table, rows)
+
+    def report(self) -> dict[str, Any]:
+        """
+        Return all metrics as JSON-compatible data, grouped by table.
+        """
+        tables: dict[str, Any] = defaultdict(
+            lambda: {"counters": {}, "stages": {}, "histograms": {}}
+        )
+        with self._lock:
+            for (name, table), value in sorted(self.counters.items()):
+                tables[table]["counters"][name] = value
+            for (name, table), stats in sorted(self.stages.items()):
+                rate = stats.rows / stats.seconds if stats.seconds else None
+                tables[table]["stages"][name] = {
+                    "seconds": stats.seconds,
+                    "rows": stats.rows,
+                    "rows_per_second": rate,
+                }
+            for (name, table), hist in sorted(self.histograms.items()):
+                tables[table]["histograms"][name] = {
+                    "buckets": hist.bucket_counts(),
+                    "sum": hist.sum,
+                    "count": hist.count,
+                }
+        return {"tables": dict(tables)}
+
+    def prometheus_text(self) -> str:
+        """
+        Return all metrics in the Prometheus text exposition format.
+        """
+        p = PROMETHEUS_PREFIX
+        lines = []
+        with self._lock:
+            for name in sorted({name for name, _ in self.counters}):
+                lines.append(f"# TYPE {p}_{name}_total counter")
+                for (n, table), value in sorted(self.counters.items()):
+                    if n == name:
+                        labels = _labels(table=table)
+                        lines.append(f"{p}_{name}_total{labels} {_format_float(value)}")
+            for metric, attr in [("stage_seconds", "seconds"), ("stage_rows", "rows")]:
+                lines.append(f"# TYPE {p}_{metric}_total counter")
+                for (stage_name, table), stats in sorted(self.stages.items()):
+                    labels = _labels(stage=stage_name, table=table)
+                    formatted = _format_float(getattr(stats, attr))
+                    lines.append(f"{p}_{metric}_total{labels} {formatted}")
+            for name in sorted({name for name, _ in self.histograms}):
+                lines.append(f"# TYPE {p}_{name} histogram")
+                for (n, table), hist in sorted(self.histograms.items()):
+                    if n != name:
+                        continue
+                    for le, count in hist.bucket_counts().items():
+                        labels = _labels(table=table, le=le)
+                        lines.append(f"{p}_{name}_bucket{labels} {count}")
+                    labels = _labels(table=table)
+                    lines.append(f"{p}_{name}_sum{labels} {_format_float(hist.sum)}")
+                    lines.append(f"{p}_{name}_count{labels} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+    def write_json(self, path: str | PathLike[str]):
+        _write_atomically(path, json.dumps(self.report(), indent=2) + "\n")
+
+    def write_prometheus(self, path: str | PathLike[str]):
+        _write_atomically(path, self.prometheus_text())
+
+
+def stage(
+    metrics: SyncMetrics | None, stage: str, table: str
+) -> AbstractContextManager[None]:
+    """
+    Time the enclosed code as part of the given stage if we're collecting
+    metrics, otherwise do nothing.
+    """
+    if metrics is None:
+        return nullcontext()
+    return metrics.stage(stage, table)
+
+
+def _labels(**labels: str) -> str:
+    pairs = ",".join(f'{k}="{_escape_label(v)}"' for k, v in labels.items())
+    return f"{{{pairs}}}"
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_float(value: float) -> str:
+    if math.isfinite(value) and value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+def _write_atomically(path: str | PathLike[str], text: str):
+    """
+    Write the file via a temporary file, so that readers (such as the node
+    exporter's textfile collector) never see a partial file.
+    """
+    path = Path(path)
+    tmp = path.with_name(f".{path.name}.tmp")
+    tmp.write_text(text)
+    tmp.replace(path)
@@ -0,0 +1,134 @@
+import sqlite3
+import threading
+import time
+import zlib
+from collections.abc import Callable
+from os import PathLike
+
+from attrs import define, field
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    key TEXT PRIMARY KEY,
+    body BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    stored_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+)
+"""
+
+
+@define
+class CachedPage:
+    body: bytes
+    etag: str | None
+    last_modified: str | None
+    stored_at: float
+
+    def validator_headers(self) -> dict[str, str]:
+        """
+        Headers for a conditional request that the server can answer with
+        "304 Not Modified" if this page is still current.
+        """
+        headers = {}
+        if self.etag is not None:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified is not None:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+@define
+class PageCache:
+    """
+    An on-disk cache of export page bodies, stored zlib-compressed in a SQLite
+    database and keyed by request URL (including the query params).
+
+    Cached pages younger than `max_age` seconds are used without asking the
+    server. Older pages are revalidated with a conditional request if the
+    server sent an `ETag` or `Last-Modified` header for them. When the
+    compressed pages take up more than `max_bytes`, the least recently used
+    pages are evicted.
+    """
+
+    path: str | PathLike[str]
+    max_bytes: int = 512 * 1024 * 1024
+    max_age: float = 0
+    clock: Callable[[], float] = field(default=time.time, repr=False)
+    _conn: sqlite3.Connection = field(init=False, repr=False)
+    # Pages may be fetched from several threads at once.
+    _lock: threading.Lock = field(
+        factory=threading.Lock, init=False, repr=False, eq=False
+    )
+
+    def __attrs_post_init__(self):
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(_SCHEMA)
+
+    def close(self):
+        self._conn.close()
+
+    def is_fresh(self, page: CachedPage) -> bool:
+        return self.clock() - page.stored_at < self.max_age
+
+    def get(self, key: str) -> CachedPage | None:
+        query = "SELECT body, etag, last_modified, stored_at FROM pages WHERE key = ?"
+        with self._lock, self._conn:
+            row = self._conn.execute(query, (key,)).fetchone()
+            if row is None:
+                return None
+            self._touch(key)
+        body, etag, last_modified, stored_at = row
+        return CachedPage(zlib.decompress(body), etag, last_modified, stored_at)
+
+    def put(
+        self,
+        key: str,
+        body: bytes,
+        etag: str | None = None,
+        last_modified: str | None = None,
+    ):
+        compressed = zlib.compress(body)
+        now = self.clock()
+        row = (key, compressed, len(compressed), etag, last_modified, now, now)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?)", row
+            )
+            self._evict()
+
+    def revalidated(self, key: str):
+        """
+        Record that the server has confirmed the cached page is still current.
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE pages SET stored_at = ? WHERE key = ?", (self.clock(), key)
+            )
+
+    def total_bytes(self) -> int:
+        with self._lock:
+            query = "SELECT COALESCE(SUM(size), 0) FROM pages"
+            return self._conn.execute(query).fetchone()[0]
+
+    def _touch(self, key: str):
+        self._conn.execute(
+            "UPDATE pages SET accessed_at = ? WHERE key = ?", (self.clock(), key)
+        )
+
+    def _evict(self):
+        """
+        Delete the least recently used pages until we're within `max_bytes`.
+        """
+        query = "SELECT key, size FROM pages ORDER BY accessed_at DESC, rowid DESC"
+        total = 0
+        evict = []
+        for key, size in self._conn.execute(query):
+            if total + size > self.max_bytes:
+                evict.append((key,))
+            else:
+                total += size
+        self._conn.executemany("DELETE FROM pages WHERE key = ?", evict)
@@ -0,0 +1,256 @@
+"""
+Reconcile a destination database with a source mirror by comparing digests of
+primary key ranges, so that only the ranges that differ need to be fetched.
+
+Run it with `aaq-sync reconcile --help`.
+"""
+
+import hashlib
+import sqlite3
+from collections.abc import Callable
+from functools import reduce
+from typing import Any, cast
+
+from attrs import define, field
+from sqlalchemy import (
+    BigInteger,
+    ColumnElement,
+    Integer,
+    Text,
+    func,
+    select,
+)
+from sqlalchemy.dialects.postgresql import BIT
+from sqlalchemy.orm import Session
+
+from .data_models import Base, TBase
+from .sync import int_pkey_column
+
+# How many sub-ranges to split each differing range into.
+RECONCILE_FANOUT = 16
+# Ranges with at most this many rows on either side are compared row by row.
+RECONCILE_LEAF_ROWS = 1000
+
+# Row text is built from each column's text representation, so these must be
+# unlikely to appear in column values.
+_COLUMN_SEPARATOR = "\x1f"
+_NULL_MARKER = "\\N"
+
+
+def _row_text(model: type[Base]) -> ColumnElement[str]:
+    """
+    Build an expression for a canonical text representation of a row. This
+    depends on how the db renders each column type as text, so it's only
+    comparable between databases of the same kind.
+    """
+    parts = [
+        func.coalesce(col.cast(Text), _NULL_MARKER) for col in model.__table__.columns
+    ]
+    return reduce(lambda a, b: a + _COLUMN_SEPARATOR + b, parts)
+
+
+def _pg_row_hashes(row_text: ColumnElement[str]) -> list[ColumnElement[int]]:
+    # Two 40-bit slices of the MD5 digest, so that summing them over millions
+    # of rows can't overflow.
+    md5 = func.md5(row_text)
+    return [
+        ("x" + func.substr(md5, start, 10)).cast(BIT(40)).cast(BigInteger)
+        for start in [1, 11]
+    ]
+
+
+def _sqlite_hash40(row_text: str, part: int) -> int:
+    """
+    The same slices of the MD5 digest as `_pg_row_hashes`, as a user-defined
+    SQLite function.
+    """
+    digest = hashlib.md5(row_text.encode()).digest()  # noqa: S324 (Not for crypto.)
+    return int.from_bytes(digest[part * 5 : (part + 1) * 5])
+
+
+def _sqlite_row_hashes(row_text: ColumnElement[str]) -> list[ColumnElement[int]]:
+    return [func.aaq_hash40(row_text, part, type_=Integer) for part in [0, 1]]
+
+
+def _sqlite_prepare(session: Session):
+    dbapi_conn = cast(
+        sqlite3.Connection, session.connection().connection.driver_connection
+    )
+    dbapi_conn.create_function("aaq_hash40", 2, _sqlite_hash40, deterministic=True)
+
+
+# Dialect-specific row hash expressions, and anything that needs doing to a
+# session before we can use them.
+ROW_HASHES: dict[str, Callable[[ColumnElement[str]], list[ColumnElement[int]]]] = {
+    "postgresql": _pg_row_hashes,
+    "sqlite": _sqlite_row_hashes,
+}
+ROW_HASH_PREPARE: dict[str, Callable[[Session], Any]] = {
+    "sqlite": _sqlite_prepare,
+}
+
+
+@define(frozen=True)
+class RangeDigest:
+    """
+    An aggregate digest of the rows in a pkey range: the row count and the
+    sums of two row hashes. Summing makes the digest independent of row order.
+    """
+
+    rows: int
+    hash_sums: tuple[int, ...]
+
+
+@define
+class ReconcileResult:
+    # Items that were missing from the destination.
+    inserted: list[Base] = field(factory=list)
+    # Items that were different in the destination.
+    updated: list[Base] = field(factory=list)
+    # Pkeys of items in the destination that aren't in the source. These are
+    # left alone.
+    extra: list[tuple] = field(factory=list)
+    # How many digest queries we made against each database.
+    digest_queries: int = 0
+
+
+@define
+class _DigestSide:
+    """
+    Range digest queries against one database.
+    """
+
+    model: type[Base]
+    session: Session
+    hashes: list[ColumnElement[int]] = field(init=False)
+
+    def __attrs_post_init__(self):
+        dialect = self.session.get_bind().dialect.name
+        if dialect not in ROW_HASHES:
+            raise ValueError(f"Range digests aren't supported for {dialect}")
+        if prepare := ROW_HASH_PREPARE.get(dialect):
+            prepare(self.session)
+        self.hashes = ROW_HASHES[dialect](_row_text(self.model))
+
+    @property
+    def pkey(self) -> ColumnElement[int]:
+        return int_pkey_column(self.model)
+
+    def table_digest(self) -> tuple[int | None, int | None, RangeDigest]:
+        """
+        Return the lowest and highest pkeys and the digest of the whole table.
+        """
+        sums = [func.sum(h) for h in self.hashes]
+        query = select(func.min(self.pkey), func.max(self.pkey), func.count(), *sums)
+        [lo, hi, rows, *hash_sums] = self.session.execute(query).one()
+        return lo, hi, RangeDigest(rows, tuple(int(s or 0) for s in hash_sums))
+
+    def bucket_digests(self, lo: int, hi: int, fanout: int) -> dict[int, RangeDigest]:
+        """
+        Split the range [lo, hi) into `fanout` buckets of (nearly) equal width
+        and return the digest of each bucket that has any rows, in a single
+        query.
+        """
+        bucket = ((self.pkey - lo) * fanout) // (hi - lo)
+        labelled = [h.label(f"h{i}") for i, h in enumerate(self.hashes)]
+        rows = (
+            select(bucket.label("bucket"), *labelled)
+            .where(self.pkey >= lo, self.pkey < hi)
+            .subquery()
+        )
+        sums = [func.sum(rows.c[h.name]) for h in labelled]
+        query = select(rows.c.bucket, func.count(), *sums).group_by(rows.c.bucket)
+        return {
+            b: RangeDigest(n, tuple(int(s) for s in hash_sums))
+            for b, n, *hash_sums in self.session.execute(query)
+        }
+
+    def fetch_range(self, lo: int, hi: int) -> dict[tuple, Base]:
+        query = select(self.model).where(self.pkey >= lo, self.pkey < hi)
+        return {item.pkey_value(): item for item in self.session.scalars(query)}
+
+
+def _bucket_bounds(lo: int, hi: int, fanout: int, bucket: int) -> tuple[int, int]:
+    """
+    Return the pkey range [start, end) covered by the given bucket. This is
+    the inverse of the bucket expression in `_DigestSide.bucket_digests`.
+    """
+    width = hi - lo
+    return lo - (-bucket * width // fanout), lo - (-(bucket + 1) * width // fanout)
+
+
+def reconcile_model_items(
+    model: type[TBase],
+    source: Session,
+    dest: Session,
+    fanout: int = RECONCILE_FANOUT,
+    leaf_rows: int = RECONCILE_LEAF_ROWS,
+) -> ReconcileResult:
+    """
+    Make the items in `dest` match those in `source`, fetching only the pkey
+    ranges whose digests differ. We start by comparing a digest of the whole
+    table, so an unchanged table costs a single query against each database.
+    Otherwise each differing range is split into `fanout` sub-ranges until
+    there are no more than `leaf_rows` rows on either side, and those ranges
+    are compared row by row. Missing and changed items are written to `dest`
+    and the transaction is committed. Items that are only in `dest` are
+    reported but not deleted.
+
+    Digests are computed by each database, so both must be the same kind of
+    database. Only models with a single integer pkey are supported.
+
+    NOTE: Items fetched from `source` are expunged from its session as we go,
+          so that a large reconciliation doesn't hold them all in memory.
+    """
+    # Check that the model has a single integer pkey before we start.
+    int_pkey_column(model)
+    dialects = {s.get_bind().dialect.name for s in [source, dest]}
+    if len(dialects) > 1:
+        kinds = " and ".join(sorted(dialects))
+        raise ValueError(f"Can't compare range digests between {kinds}")
+    src = _DigestSide(model, source)
+    dst = _DigestSide(model, dest)
+    result = ReconcileResult()
+
+    src_lo, src_hi, src_digest = src.table_digest()
+    dst_lo, dst_hi, dst_digest = dst.table_digest()
+    result.digest_queries += 1
+    if src_digest == dst_digest:
+        return result
+    bounds = [b for b in [src_lo, src_hi, dst_lo, dst_hi] if b is not None]
+    ranges = [(min(bounds), max(bounds) + 1, max(src_digest.rows, dst_digest.rows))]
+
+    while ranges:
+        lo, hi, rows = ranges.pop()
+        if rows <= leaf_rows:
+            _reconcile_range(src, dst, lo, hi, result)
+            continue
+        src_buckets = src.bucket_digests(lo, hi, fanout)
+        dst_buckets = dst.bucket_digests(lo, hi, fanout)
+        result.digest_queries += 1
+        for bucket in sorted(src_buckets.keys() | dst_buckets.keys(), reverse=True):
+            src_bucket = src_buckets.get(bucket)
+            dst_bucket = dst_buckets.get(bucket)
+            if src_bucket != dst_bucket:
+                rows = max(b.rows for b in [src_bucket, dst_bucket] if b is not None)
+                ranges.append((*_bucket_bounds(lo, hi, fanout, bucket), rows))
+
+    dest.commit()
+    return result
+
+
+def _reconcile_range(
+    src: _DigestSide, dst: _DigestSide, lo: int, hi: int, result: ReconcileResult
+):
+    src_items = src.fetch_range(lo, hi)
+    dst_items = dst.fetch_range(lo, hi)
+    for pkey, item in sorted(src_items.items()):
+        existing = dst_items.get(pkey)
+        if existing is None:
+            dst.session.add(item.clone())
+            result.inserted.append(item)
+        elif existing.column_values() != item.column_values():
+            dst.session.merge(item.clone())
+            result.updated.append(item)
+    result.extra.extend(sorted(dst_items.keys() - src_items.keys()))
+    src.session.expunge_all()
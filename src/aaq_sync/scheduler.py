@@ -0,0 +1,69 @@
+import random
+import time
+from collections.abc import Callable, Mapping
+from typing import Any
+
+from attrs import define, field
+
+
+@define
+class Scheduler:
+    """
+    Run named jobs repeatedly, each roughly every `interval` seconds, until
+    stopped.
+
+    Each job's next run is scheduled when its current run finishes, so runs of
+    the same job never overlap even if they take longer than the interval. The
+    delay is randomly adjusted by up to `jitter` (as a fraction of the
+    interval) so that jobs drift apart instead of all hitting the export API
+    and the db at once. Jobs that are due at the same time run one after
+    another.
+
+    `stop()` is safe to call from a signal handler. We sleep in slices of at
+    most `poll_seconds` and check whether we've been stopped in between, since
+    an interrupted sleep carries on sleeping after the handler returns.
+    """
+
+    interval: float
+    jitter: float = 0.1
+    poll_seconds: float = 1.0
+    clock: Callable[[], float] = field(default=time.monotonic, repr=False)
+    sleep: Callable[[float], Any] = field(default=time.sleep, repr=False)
+    uniform: Callable[[float, float], float] = field(default=random.uniform, repr=False)
+    stopping: bool = field(default=False, init=False)
+
+    def stop(self, *_args):
+        """
+        Stop after the current job (if any) finishes. Extra args are ignored
+        so this can be used directly as a signal handler.
+        """
+        self.stopping = True
+
+    def next_delay(self) -> float:
+        return self.interval * (1 + self.uniform(-self.jitter, self.jitter))
+
+    def run(
+        self,
+        jobs: Mapping[str, Callable[[], Any]],
+        on_error: Callable[[str, Exception], Any],
+    ):
+        """
+        Run the jobs, all of which are due immediately, until stopped. If a job
+        raises an exception, `on_error` is called with the job name and the
+        exception and the job is rescheduled as usual.
+        """
+        next_runs = {name: self.clock() for name in jobs}
+        while next_runs and not self.stopping:
+            name = min(next_runs, key=next_runs.__getitem__)
+            self._sleep_until(next_runs[name])
+            if self.stopping:
+                return
+            try:
+                jobs[name]()
+            except Exception as e:
+                on_error(name, e)
+            next_runs[name] = self.clock() + self.next_delay()
+
+    def _sleep_until(self, when: float):
+        while not self.stopping and (remaining := when - self.clock()) > 0:
+            self.sleep(min(remaining, self.poll_seconds))
@@ -0,0 +1,184 @@
+"""
+Offline snapshots of export API data, so that one pull from the API can seed
+any number of databases.
+
+A snapshot file starts with `SNAPSHOT_MAGIC` and is followed by a sequence of
+frames. Each frame holds up to `SNAPSHOT_FRAME_ITEMS` items from a single
+table as zlib-compressed NDJSON, preceded by a header with the compressed
+size, the number of items and the table name. The sizes let a reader skip
+frames from other tables without decompressing them, and every table has at
+least one (possibly empty) frame so that empty tables are recorded too.
+"""
+
+import json
+import mmap
+import struct
+import zlib
+from collections.abc import Generator, Iterable, Iterator
+from os import PathLike
+from pathlib import Path
+from typing import IO, Any, Self, TypeVar
+
+from attrs import define, field
+
+from .data_models import TBase
+from .itertools import chunked
+
+T = TypeVar("T")
+# Note: `TGen` on its own is equivalent to `TGen[Any]`.
+TGen = Generator[T, None, None]
+
+JSONDict = dict[str, Any]
+
+SNAPSHOT_MAGIC = b"AAQSNAP1"
+# How many items to compress together in each frame.
+SNAPSHOT_FRAME_ITEMS = 1000
+# Compressed size, item count, table name size.
+_FRAME_HEADER = struct.Struct(">IIH")
+
+
+def _encode_frame(table: str, items: list[JSONDict], level: int) -> bytes:
+    lines = (json.dumps(item, separators=(",", ":")) for item in items)
+    body = zlib.compress("\n".join(lines).encode(), level)
+    name = table.encode()
+    return _FRAME_HEADER.pack(len(body), len(items), len(name)) + name + body
+
+
+@define
+class SnapshotWriter:
+    """
+    Write export items to a snapshot file. See the module docstring for the
+    format.
+    """
+
+    file: IO[bytes]
+    frame_items: int = SNAPSHOT_FRAME_ITEMS
+    level: int = 6
+
+    def __attrs_post_init__(self):
+        self.file.write(SNAPSHOT_MAGIC)
+
+    def write_items(self, table: str, items: Iterable[JSONDict]) -> int:
+        """
+        Write all the given items for a table, and return how many there were.
+        """
+        count = 0
+        for frame in chunked(items, self.frame_items):
+            self.file.write(_encode_frame(table, frame, self.level))
+            count += len(frame)
+        if count == 0:
+            self.file.write(_encode_frame(table, [], self.level))
+        return count
+
+
+@define
+class _Frame:
+    table: str
+    items: int
+    start: int
+    end: int
+
+
+@define
+class SnapshotReader:
+    """
+    Read export items from a snapshot file. The file is memory-mapped, and
+    items are decoded a frame at a time as they're needed.
+    """
+
+    path: Path = field(converter=Path)
+    _file: IO[bytes] = field(init=False, repr=False)
+    _mmap: mmap.mmap = field(init=False, repr=False)
+    _frames: list[_Frame] = field(init=False, repr=False)
+
+    def __attrs_post_init__(self):
+        self._file = self.path.open("rb")
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._frames = list(self._scan_frames())
+        except (ValueError, struct.error) as e:
+            self.close()
+            raise ValueError(f"{self.path} isn't a valid snapshot: {e}") from e
+
+    def _scan_frames(self) -> Iterator[_Frame]:
+        """
+        Read the frame headers, without reading or decompressing any items.
+        """
+        mm = self._mmap
+        if mm[: len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+            raise ValueError("bad magic")
+        pos = len(SNAPSHOT_MAGIC)
+        while pos < len(mm):
+            size, items, name_size = _FRAME_HEADER.unpack_from(mm, pos)
+            pos += _FRAME_HEADER.size
+            table = mm[pos : pos + name_size].decode()
+            start = pos + name_size
+            pos = start + size
+            if pos > len(mm):
+                raise ValueError("truncated frame")
+            yield _Frame(table, items, start, pos)
+
+    def close(self):
+        if hasattr(self, "_mmap"):
+            self._mmap.close()
+        self._file.close()
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def tables(self) -> list[str]:
+        """
+        Return the names of the tables in this snapshot, in the order they
+        were written.
+        """
+        return list(dict.fromkeys(frame.table for frame in self._frames))
+
+    def count_items(self, table: str) -> int:
+        return sum(frame.items for frame in self._frames if frame.table == table)
+
+    def iter_pages(self, table: str) -> TGen[list[JSONDict]]:
+        """
+        Iterate over the items for a table a frame at a time.
+        """
+        for frame in self._frames:
+            if frame.table == table and frame.items:
+                body = zlib.decompress(self._mmap[frame.start : frame.end])
+                yield [json.loads(line) for line in body.split(b"\n")]
+
+    def iter_items(self, table: str) -> TGen[JSONDict]:
+        for page in self.iter_pages(table):
+            yield from page
+
+    def get_model_items(self, model: type[TBase]) -> TGen[TBase]:
+        """
+        Iterate over the items for a model, the same as
+        `ExportClient.get_model_items`.
+        """
+        for page in self.iter_pages(model.__tablename__):
+            yield from model.from_json_many(page)
+
+
+def write_snapshot(
+    path: str | PathLike[str], tables: Iterable[tuple[str, Iterable[JSONDict]]]
+) -> dict[str, int]:
+    """
+    Write a snapshot with the items for each of the given tables, and return
+    how many items each table had. The snapshot is written to a temporary file
+    which only replaces `path` once it's complete, so a failure partway through
+    never leaves a partial snapshot behind.
+    """
+    path = Path(path)
+    tmp = path.with_name(f".{path.name}.tmp")
+    counts = {}
+    try:
+        with tmp.open("wb") as f:
+            writer = SnapshotWriter(f)
+            for table, items in tables:
+                counts[table] = writer.write_items(table, items)
+        tmp.replace(path)
+    finally:
+        tmp.unlink(missing_ok=True)
+    return counts
@@ -1,19 +1,70 @@
-from collections.abc import Generator, Iterable, Sequence
-from dataclasses import asdict
-from typing import TypeVar
+from array import array
+from bisect import bisect_left
+from collections.abc import Callable, Collection, Generator, Iterable, Mapping, Sequence
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from itertools import chain, pairwise
+from queue import Queue
+from typing import Any, Literal, TypeVar, cast
 
-from sqlalchemy import select
+from sqlalchemy import (
+    ColumnElement,
+    Table,
+    any_,
+    bindparam,
+    delete,
+    insert,
+    or_,
+    select,
+    tuple_,
+)
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from .data_export_client import ExportClient
-from .data_models import Base
-from .itertools import IteratorWithFinishedCheck
+from .data_export_client import AsyncExportClient, ExportClient
+from .data_models import Base, InvalidItem
+from .itertools import IteratorWithFinishedCheck, chunked
+from .metrics import CountingIterator, SyncMetrics, stage
+from .sync_state import (
+    clear_checkpoint,
+    delete_digests,
+    fetch_digests,
+    get_checkpoint,
+    get_watermark,
+    quarantine_items,
+    set_checkpoint,
+    set_watermark,
+    store_digests,
+)
 
 T = TypeVar("T")
 # Note: `TGen` on its own is equivalent to `TGen[Any]`.
 TGen = Generator[T, None, None]
 TBase = TypeVar("TBase", bound=Base)
 
+# How many existing rows to fetch from the db at a time when streaming them.
+MERGE_JOIN_YIELD_PER = 1000
+# How many new rows to send to the db at a time when bulk inserting them.
+BULK_INSERT_CHUNK_SIZE = 1000
+# How many new rows to compare at a time when using content digests.
+DIGEST_BATCH_SIZE = 1000
+# How many items to pass to fan-out destinations at a time, and how many of
+# those chunks may be queued up for each destination.
+FANOUT_CHUNK_SIZE = 1000
+FANOUT_QUEUE_CHUNKS = 4
+# How many missing rows to delete at a time when pruning.
+PRUNE_BATCH_SIZE = 1000
+
+InsertMethod = Literal["orm", "executemany", "copy"]
+OnConflict = Literal["error", "update"]
+
+# Dialect-specific INSERT constructs that support ON CONFLICT.
+UPSERT_INSERTS: dict[str, Callable[[Table], Any]] = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+
 
 def filter_existing(olds: Iterable[TBase], news: Iterable[TBase]) -> TGen[TBase]:
     """
@@ -24,53 +75,767 @@ def filter_existing(olds: Iterable[TBase], news: Iterable[TBase]) -> TGen[TBase]
     news = IteratorWithFinishedCheck(news)
     if news.finished:
         return
-    existing = {old.pkey_value(): old for old in olds}
+    yield from _filter_indexed(_index_by_pkey(olds), news)
+
+
+def _index_by_pkey(olds: Iterable[TBase]) -> dict[tuple, TBase]:
+    return {old.pkey_value(): old for old in olds}
+
+
+def _filter_indexed(
+    existing: Mapping[tuple, TBase], news: Iterable[TBase]
+) -> TGen[TBase]:
+    """
+    Filter existing items (indexed by pkey) out of the new items collection.
+    See `filter_existing` for details.
+    """
     for new in news:
         nkey = new.pkey_value()
         if (old := existing.get(nkey)) is not None:
-            # Compare just the data, not ORM state.
-            if asdict(old) != asdict(new):
-                ostr = f"{type(new).__name__}{nkey}"
-                raise ValueError(f"Object already exists with different value: {ostr}")
+            _check_unchanged(old, new)
             # Skip existing objects that already match.
         else:
             yield new
 
 
-def fetch_existing(model: type[TBase], session: Session) -> Iterable[TBase]:
+def _check_unchanged(old: TBase, new: TBase):
+    # Compare just the data, not ORM state.
+    if old.column_values() != new.column_values():
+        _raise_changed(new)
+
+
+def _raise_changed(new: Base):
+    ostr = f"{type(new).__name__}{new.pkey_value()}"
+    raise ValueError(f"Object already exists with different value: {ostr}")
+
+
+def filter_existing_ordered(
+    fetch_olds: Callable[[], Iterable[TBase]], news: Iterable[TBase]
+) -> TGen[TBase]:
+    """
+    Filter existing items out of the new items collection, the same as
+    `filter_existing`, but assuming that both existing and new items are
+    ordered by primary key. This allows us to stream through both at once (a
+    merge join) without holding all the existing items in memory.
+
+    If the new items turn out not to be in strictly increasing pkey order, the
+    remaining new items are filtered using `filter_existing` against a fresh
+    batch of existing items.
+    """
+    news = IteratorWithFinishedCheck(news)
+    if news.finished:
+        return
+    olds = IteratorWithFinishedCheck(fetch_olds())
+    prev_nkey = None
+    for new in news:
+        nkey = new.pkey_value()
+        if prev_nkey is not None and nkey <= prev_nkey:
+            yield from filter_existing(fetch_olds(), chain([new], news))
+            return
+        prev_nkey = nkey
+        while not olds.finished and olds.peek_next().pkey_value() < nkey:
+            next(olds)
+        if not olds.finished and olds.peek_next().pkey_value() == nkey:
+            _check_unchanged(olds.peek_next(), new)
+            # Skip existing objects that already match.
+        else:
+            yield new
+
+
+def fetch_existing(
+    model: type[TBase], session: Session, yield_per: int | None = None
+) -> Iterable[TBase]:
+    """
+    Fetch existing items from the database, ordered by primary key. If
+    `yield_per` is given, results are streamed from the database in batches of
+    that size instead of all being loaded at once.
+    """
+    query = select(model).order_by(*model.__table__.primary_key)
+    if yield_per is not None:
+        query = query.execution_options(yield_per=yield_per)
+    return session.scalars(query)
+
+
+def fetch_existing_by_pkey(
+    model: type[TBase], session: Session, pkeys: Collection[tuple]
+) -> Iterable[TBase]:
+    """
+    Fetch existing items with the given pkey values from the database.
+
+    For composite primary keys this uses a row-value comparison, which
+    PostgreSQL handles with the same kind of plan as a join against a VALUES
+    list.
+    """
+    pkey_cols = list(model.__table__.primary_key)
+    if len(pkey_cols) == 1:
+        [pkey_col] = pkey_cols
+        cond = pkey_col.in_([pkey for (pkey,) in pkeys])
+    else:
+        cond = tuple_(*pkey_cols).in_(pkeys)
+    return session.scalars(select(model).where(cond))
+
+
+def _filter_existing_batched(
+    model: type[TBase], session: Session, news: Iterable[TBase], batch_size: int
+) -> TGen[TBase]:
+    """
+    Filter existing items out of the new items collection a batch at a time,
+    only fetching the existing items that match each batch's pkeys.
+    """
+    for batch in chunked(news, batch_size):
+        pkeys = {new.pkey_value() for new in batch}
+        olds = fetch_existing_by_pkey(model, session, pkeys)
+        yield from filter_existing(olds, batch)
+
+
+def model_table(model: type[Base]) -> Table:
+    """
+    Return the model's table. The declarative `__table__` attribute is typed
+    as a generic FromClause, which doesn't have everything a Table does.
+    """
+    return cast(Table, model.__table__)
+
+
+def filter_existing_by_digest(
+    model: type[TBase], session: Session, news: Iterable[TBase]
+) -> TGen[TBase]:
     """
-    Fetch existing items from the database.
+    Filter existing items out of the new items collection by comparing content
+    digests stored in a sidecar table instead of whole rows. If any new item's
+    digest doesn't match the stored one, raise an exception.
+
+    Items without a stored digest (such as those stored before we started
+    recording digests) are compared against existing rows fetched by pkey a
+    batch at a time, and their digests are recorded for next time.
+
+    NOTE: The stored digests are only updated by our own syncs, so this
+          assumes nothing else modifies the synced table.
     """
-    return session.scalars(select(model).order_by(*model.__table__.primary_key))
+    digests = fetch_digests(session, model)
+    for batch in chunked(news, DIGEST_BATCH_SIZE):
+        unknown = []
+        for new in batch:
+            digest = digests.get(new.pkey_value())
+            if digest is None:
+                unknown.append(new)
+            elif digest != new.content_digest():
+                _raise_changed(new)
+        if unknown:
+            pkeys = {new.pkey_value() for new in unknown}
+            olds = fetch_existing_by_pkey(model, session, pkeys)
+            yield from filter_existing(olds, unknown)
+            store_digests(session, model, unknown)
+            digests.update((new.pkey_value(), new.content_digest()) for new in unknown)
 
 
-def store_new(news: Iterable[TBase], session: Session) -> Sequence[TBase]:
+def _insert_executemany(
+    model: type[TBase], session: Session, news: Iterable[TBase]
+) -> list[TBase]:
+    """
+    Insert new items using a Core INSERT with executemany semantics, which
+    bypasses the ORM unit of work.
+    """
+    stored: list[TBase] = []
+    for chunk in chunked(news, BULK_INSERT_CHUNK_SIZE):
+        session.execute(insert(model_table(model)), [new.to_row() for new in chunk])
+        stored.extend(chunk)
+    return stored
+
+
+def _insert_copy(
+    model: type[TBase], session: Session, news: Iterable[TBase]
+) -> list[TBase]:
+    """
+    Insert new items using PostgreSQL's `COPY ... FROM STDIN` through psycopg.
+
+    We send a chunk at a time, because nothing else can use the connection
+    while a COPY is in progress and filtering new items may need to query the
+    database.
+    """
+    import psycopg
+    from psycopg import sql
+
+    conn = session.connection()
+    if (conn.dialect.name, conn.dialect.driver) != ("postgresql", "psycopg"):
+        raise ValueError("COPY is only supported with postgresql+psycopg")
+    pgconn = cast(psycopg.Connection, conn.connection.driver_connection)
+    table = model_table(model)
+    colnames = [col.name for col in table.columns]
+    copy_sql = sql.SQL("COPY {} ({}) FROM STDIN").format(
+        sql.Identifier(*filter(None, [table.schema, table.name])),
+        sql.SQL(", ").join(map(sql.Identifier, colnames)),
+    )
+    stored: list[TBase] = []
+    for chunk in chunked(news, BULK_INSERT_CHUNK_SIZE):
+        with pgconn.cursor() as cursor, cursor.copy(copy_sql) as copy:
+            for new in chunk:
+                copy.write_row(list(new.to_row().values()))
+        stored.extend(chunk)
+    return stored
+
+
+def upsert_changed(
+    model: type[TBase],
+    session: Session,
+    news: Iterable[TBase],
+    use_digests: bool = False,
+) -> list[TBase]:
+    """
+    Insert new items and update existing items that have changed, using
+    `INSERT ... ON CONFLICT (pkey) DO UPDATE ... WHERE <columns differ>`. This
+    is supported for PostgreSQL and SQLite.
+
+    Only the items that were actually inserted or updated are returned. Any
+    stored content digests for them are deleted, so that later syncs using
+    digests don't compare against the old values. If `use_digests` is set,
+    their new digests are stored instead.
+    """
+    dialect_name = session.connection().dialect.name
+    if dialect_name not in UPSERT_INSERTS:
+        raise ValueError(f"Upserts aren't supported for {dialect_name}")
+    table = model_table(model)
+    pkey_cols = list(table.primary_key)
+    insert_stmt = UPSERT_INSERTS[dialect_name](table)
+    excluded = insert_stmt.excluded
+    updates = {c.name: excluded[c.name] for c in table.columns if not c.primary_key}
+    changed = or_(*(table.c[k].is_distinct_from(v) for k, v in updates.items()))
+    stmt = insert_stmt.on_conflict_do_update(
+        index_elements=pkey_cols, set_=updates, where=changed
+    ).returning(*pkey_cols)
+    stored: list[TBase] = []
+    for chunk in chunked(news, BULK_INSERT_CHUNK_SIZE):
+        # A single statement can't affect the same row twice, so only the last
+        # item with each pkey is kept.
+        by_pkey = {new.pkey_value(): new for new in chunk}
+        rows = session.execute(stmt, [new.to_row() for new in by_pkey.values()])
+        upserted = {tuple(row) for row in rows}
+        changed_items = [new for pkey, new in by_pkey.items() if pkey in upserted]
+        delete_digests(session, model, upserted)
+        if use_digests:
+            store_digests(session, model, changed_items)
+        stored.extend(changed_items)
+    return stored
+
+
+def store_new(
+    news: Iterable[TBase],
+    session: Session,
+    merge_join: bool = False,
+    batch_size: int | None = None,
+    insert_method: InsertMethod = "orm",
+    on_conflict: OnConflict = "error",
+    use_digests: bool = False,
+    metrics: SyncMetrics | None = None,
+) -> Sequence[TBase]:
     """
     Store new items in the database.
 
+    By default, all existing items are fetched from the database to compare
+    against. If `merge_join` is set, new items are assumed to be ordered by
+    primary key and are compared against existing items streamed from the
+    database instead. See `filter_existing_ordered` for details. If
+    `batch_size` is set, new items are processed in batches of that size and
+    only existing items with matching pkeys are fetched for each batch. If
+    `use_digests` is set, new items are compared against stored content
+    digests instead. See `filter_existing_by_digest` for details. Only one of
+    these lookup strategies may be used at a time.
+
+    New items are added to the session by default. If `insert_method` is
+    "executemany" or "copy", they are instead inserted directly in bulk and
+    the returned items aren't attached to the session.
+
+    If `on_conflict` is "update", existing items aren't fetched and compared
+    at all. Instead, all items are upserted and any changed existing items are
+    updated. See `upsert_changed` for details. Apart from `use_digests`, which
+    keeps the stored digests up to date, the other options don't apply in this
+    case.
+
+    If `metrics` is set, time spent filtering and storing items is recorded
+    there, along with how many items were stored or skipped.
+
     NOTE: This is intended to be a low-level operation and thus doesn't commit
           the transaction.
     """
+    if sum([merge_join, batch_size is not None, use_digests]) > 1:
+        raise ValueError("merge_join, batch_size and use_digests can't be combined")
     news = IteratorWithFinishedCheck(news)
     if news.finished:
         return []
-    olds = fetch_existing(type(news.peek_next()), session)
+    model = type(news.peek_next())
+    table = model.__tablename__
+    counted = CountingIterator(news)
+    stored: Sequence[TBase]
+    if on_conflict == "update":
+        with stage(metrics, "store_new", table):
+            stored = upsert_changed(model, session, counted, use_digests)
+        record_stored(metrics, table, counted.count, stored)
+        return stored
+    with stage(metrics, "filter_existing", table):
+        filtered = _filter_new(
+            model, session, counted, merge_join, batch_size, use_digests
+        )
+    if metrics is not None:
+        filtered = metrics.iter_stage("filter_existing", table, filtered)
+    with stage(metrics, "store_new", table):
+        stored = insert_new(model, session, filtered, insert_method)
+    record_stored(metrics, table, counted.count, stored)
+    return stored
+
+
+def _filter_new(
+    model: type[TBase],
+    session: Session,
+    news: Iterable[TBase],
+    merge_join: bool,
+    batch_size: int | None,
+    use_digests: bool,
+) -> Iterable[TBase]:
+    """
+    Filter out existing items using the chosen lookup strategy. See
+    `store_new`.
+    """
+    if merge_join:
+        fetch_olds = partial(fetch_existing, model, session, MERGE_JOIN_YIELD_PER)
+        return filter_existing_ordered(fetch_olds, news)
+    if batch_size is not None:
+        return _filter_existing_batched(model, session, news, batch_size)
+    if use_digests:
+        return filter_existing_by_digest(model, session, news)
+    return filter_existing(fetch_existing(model, session), news)
+
+
+def insert_new(
+    model: type[TBase],
+    session: Session,
+    news: Iterable[TBase],
+    insert_method: InsertMethod = "orm",
+) -> Sequence[TBase]:
+    """
+    Insert items that are already known to be new, using the given insert
+    method (see `store_new`), and return them.
+
+    NOTE: This is intended to be a low-level operation and thus doesn't commit
+          the transaction.
+    """
+    match insert_method:
+        case "executemany":
+            return _insert_executemany(model, session, news)
+        case "copy":
+            return _insert_copy(model, session, news)
     stored: list[TBase] = []
-    for new in filter_existing(olds, news):
+    for new in news:
         session.add(new)
         stored.append(new)
     return stored
 
 
+def record_stored(
+    metrics: SyncMetrics | None, table: str, considered: int, stored: Sequence
+):
+    """
+    Count the items that were stored and the ones that were skipped because
+    they already existed, if we're collecting metrics.
+    """
+    if metrics is not None:
+        metrics.inc("rows_inserted", table, len(stored))
+        metrics.inc("rows_skipped", table, considered - len(stored))
+
+
+def flush_and_commit(session: Session, model: type[Base], metrics: SyncMetrics | None):
+    """
+    Flush and commit the session's transaction, timing each separately if
+    we're collecting metrics.
+    """
+    with stage(metrics, "flush", model.__tablename__):
+        session.flush()
+    with stage(metrics, "commit", model.__tablename__):
+        session.commit()
+
+
+def int_pkey_column(model: type[Base]) -> ColumnElement[int]:
+    """
+    Return the model's pkey column, which must be a single integer column.
+    """
+    pkey_cols = list(model.__table__.primary_key)
+    if len(pkey_cols) != 1 or pkey_cols[0].type.python_type is not int:
+        raise ValueError(f"{model.__tablename__} doesn't have a single integer pkey")
+    return pkey_cols[0]
+
+
+def _collect_pkeys(
+    items: Iterable[TBase], pkey_name: str, seen: "array[int]"
+) -> TGen[TBase]:
+    for item in items:
+        seen.append(getattr(item, pkey_name))
+        yield item
+
+
+def prune_missing(
+    model: type[Base],
+    session: Session,
+    seen: Iterable[int],
+    batch_size: int = PRUNE_BATCH_SIZE,
+) -> int:
+    """
+    Delete all rows whose pkeys aren't in `seen`, in batches of `batch_size`,
+    and return how many were deleted. Only the pkeys of existing rows are
+    fetched, `batch_size` at a time, and `seen` is kept as a sorted array of
+    ints rather than a set so that it stays small even for large tables. The
+    export is usually in pkey order already, so `seen` is only sorted if it
+    isn't. Any stored content digests for the deleted rows are deleted too.
+
+    NOTE: This is intended to be a low-level operation and thus doesn't commit
+          the transaction.
+    """
+    pkey_col = int_pkey_column(model)
+    if not isinstance(seen, array):
+        seen = array("q", seen)
+    if not all(a <= b for a, b in pairwise(seen)):
+        seen = array("q", sorted(seen))
+    missing = array("q")
+    pkeys_query = select(pkey_col).order_by(pkey_col)
+    for pkey in session.scalars(pkeys_query.execution_options(yield_per=batch_size)):
+        i = bisect_left(seen, pkey)
+        if i == len(seen) or seen[i] != pkey:
+            missing.append(pkey)
+    dialect = session.get_bind().dialect.name
+    for batch in chunked(missing, batch_size):
+        query = delete(model).where(_pkey_in(pkey_col, batch, dialect))
+        session.execute(query, execution_options={"synchronize_session": False})
+        delete_digests(session, model, [(pkey,) for pkey in batch])
+    return len(missing)
+
+
+def _pkey_in(pkey_col: ColumnElement[int], pkeys: list[int], dialect: str):
+    if dialect == "postgresql":
+        # A single array param instead of one param per pkey.
+        array_type = postgresql.ARRAY(pkey_col.type)
+        return pkey_col == any_(bindparam("pkeys", pkeys, type_=array_type))
+    return pkey_col.in_(pkeys)
+
+
 def sync_model_items(
-    model: type[TBase], exporter: ExportClient, session: Session
+    model: type[TBase],
+    exporter: ExportClient,
+    session: Session,
+    incremental: bool = False,
+    watermark_param: str | None = None,
+    commit_every: int | None = None,
+    prune: bool = False,
+    quarantine: bool = False,
+    metrics: SyncMetrics | None = None,
+    **store_kw,
 ) -> Sequence[TBase]:
     """
     Fetch model items from the data export API and store the new ones in the database.
+    Any extra keyword args are passed through to `store_new`.
+
+    If `incremental` is set, only items with a watermark column value (see
+    `Base.watermark_column`) at least as high as the highest one seen by the
+    previous incremental sync are considered. If `watermark_param` is also
+    set, the previous watermark is sent to the export API as a query param
+    with that name so the server can do the filtering.
+
+    By default, the whole sync happens in a single transaction. If
+    `commit_every` is set, the transaction is instead committed after every
+    `commit_every` items along with a checkpoint recording how far we've got,
+    and a sync that finds a checkpoint resumes from there. Each chunk of items
+    is stored separately, so this is best combined with a lookup strategy that
+    doesn't fetch the whole table every time, such as `batch_size`.
+
+    If `prune` is set, rows that weren't in the export are deleted once all
+    items have been fetched and stored. See `prune_missing`. This needs a
+    complete export, so it can't be combined with `incremental` or
+    `commit_every`.
+
+    If `quarantine` is set, each page of items is validated as a whole, and
+    invalid items are stored in the quarantine table with their errors (see
+    `QuarantinedItem`) instead of failing the sync, so the valid items are
+    still stored. Quarantining an item again replaces its old entry. Invalid
+    items don't count towards an incremental sync's watermark, but once a
+    newer valid item is stored the watermark moves past them, so they won't
+    be retried unless they're updated. This can't be combined with `prune`
+    (which would delete rows whose items are now invalid) or `commit_every`
+    (which needs every item to resume at the right offset).
+
+    If `metrics` is set, time spent in each stage of the sync is recorded
+    there. See `SyncMetrics` for details.
 
     NOTE: This is intended to be a high-level operation and thus commits the
           transaction.
     """
-    model_items = exporter.get_model_items(model)
+    if prune and (incremental or commit_every is not None):
+        raise ValueError("prune can't be combined with incremental or commit_every")
+    if quarantine and (prune or commit_every is not None):
+        raise ValueError("quarantine can't be combined with prune or commit_every")
+    store_kw["metrics"] = metrics
+    if commit_every is not None:
+        return _sync_model_items_chunked(
+            model,
+            exporter,
+            session,
+            commit_every,
+            incremental,
+            watermark_param,
+            store_kw,
+        )
+    invalid: list[InvalidItem] = []
+    quarantine_kw = {"on_invalid": invalid.extend} if quarantine else {}
     with session.begin():
-        return store_new(model_items, session)
+        if not incremental:
+            model_items = exporter.get_model_items(model, **quarantine_kw)
+            if prune:
+                seen: array[int] = array("q")
+                pkey_name = int_pkey_column(model).name
+                model_items = _collect_pkeys(model_items, pkey_name, seen)
+            stored = store_new(model_items, session, **store_kw)
+            quarantine_items(session, model, invalid)
+            if prune:
+                # Any failure fetching or storing items would have raised an
+                # exception by now, so we know we've seen everything.
+                table = model.__tablename__
+                with stage(metrics, "prune", table):
+                    pruned = prune_missing(model, session, seen)
+                if metrics is not None:
+                    metrics.inc("rows_deleted", table, pruned)
+            clear_checkpoint(session, model)
+            flush_and_commit(session, model, metrics)
+            return stored
+
+        tracker = _WatermarkTracker(get_watermark(session, model))
+        export_kw = _watermark_export_kw([tracker.previous], watermark_param)
+        export_kw.update(quarantine_kw)
+        model_items = tracker.filter(exporter.get_model_items(model, **export_kw))
+        stored = store_new(model_items, session, **store_kw)
+        quarantine_items(session, model, invalid)
+        tracker.save(session, model)
+        clear_checkpoint(session, model)
+        flush_and_commit(session, model, metrics)
+        return stored
+
+
+def _sync_model_items_chunked(
+    model: type[TBase],
+    exporter: ExportClient,
+    session: Session,
+    commit_every: int,
+    incremental: bool,
+    watermark_param: str | None,
+    store_kw: dict[str, Any],
+) -> Sequence[TBase]:
+    """
+    Sync model items, committing every `commit_every` items along with a
+    checkpoint. See `sync_model_items`.
+
+    The checkpoint records the export API offset to resume from, and the mode
+    and export filters in use so that we only resume a sync whose offsets still
+    line up. The watermark is only advanced once the sync is complete, so a
+    resumed incremental sync uses the same server-side filter as the one it's
+    resuming. Any completed sync of the table clears the checkpoint, since
+    items may have been added or removed upstream since it was recorded.
+    """
+    with session.begin():
+        checkpoint = get_checkpoint(session, model)
+        tracker = _WatermarkTracker(
+            get_watermark(session, model) if incremental else None
+        )
+        offset = 0
+        export_kw = {}
+        if incremental:
+            export_kw = _watermark_export_kw([tracker.previous], watermark_param)
+        # A checkpoint left by a sync with a different mode or different export
+        # filters doesn't tell us anything about this one's offsets, so we
+        # start from the beginning instead.
+        if (
+            checkpoint is not None
+            and checkpoint.incremental == incremental
+            and checkpoint.filters == export_kw.get("filters")
+        ):
+            offset = checkpoint.offset
+            if checkpoint.watermark is not None:
+                tracker.watermark = checkpoint.watermark
+
+    stored: list[TBase] = []
+    items = exporter.get_model_items(model, offset=offset, **export_kw)
+    # We chunk the items before filtering them so that we can keep track of
+    # the export offset.
+    for chunk in chunked(items, commit_every):
+        offset += len(chunk)
+        news = tracker.filter(chunk) if incremental else chunk
+        with session.begin():
+            stored.extend(store_new(news, session, **store_kw))
+            set_checkpoint(
+                session,
+                model,
+                offset,
+                filters=export_kw.get("filters"),
+                watermark=tracker.watermark if incremental else None,
+                last_pkey=chunk[-1].pkey_value(),
+                incremental=incremental,
+            )
+            flush_and_commit(session, model, store_kw["metrics"])
+    with session.begin():
+        if incremental:
+            tracker.save(session, model)
+        clear_checkpoint(session, model)
+    return stored
+
+
+def _watermark_export_kw(
+    watermarks: Sequence[Any], watermark_param: str | None
+) -> dict[str, Any]:
+    """
+    Build the export args for server-side watermark filtering. When syncing
+    to several destinations, we can only ask for items above the lowest of
+    their watermarks.
+    """
+    if watermark_param is None or not watermarks or None in watermarks:
+        return {}
+    return {"filters": {watermark_param: min(watermarks)}}
+
+
+def sync_model_items_fanout(
+    model: type[TBase],
+    exporter: ExportClient,
+    sessions: Sequence[Session],
+    incremental: bool = False,
+    watermark_param: str | None = None,
+    **store_kw,
+) -> list[Future[Sequence[TBase]]]:
+    """
+    Fetch model items from the data export API once and store the new ones in
+    each of several databases concurrently. Any extra keyword args are passed
+    through to `store_new`, and `incremental` and `watermark_param` work as in
+    `sync_model_items`, with each destination tracking its own watermark.
+
+    Items are fetched and translated in the calling thread, and each
+    destination session consumes its own copies of them (see `Base.clone`)
+    from a bounded queue in a worker thread. A slow destination therefore
+    holds up the others by at most `FANOUT_QUEUE_CHUNKS` chunks.
+
+    Returns one future per session, in the same order, which are all done by
+    the time this returns. A failure in one destination is reported in its
+    future and rolls back only that destination's transaction. If fetching
+    from the export API fails, all destinations are rolled back and the error
+    is raised.
+
+    NOTE: This is intended to be a high-level operation and thus commits the
+          transactions.
+    """
+    if not sessions:
+        return []
+    export_kw: dict[str, Any] = {}
+    if incremental and watermark_param is not None:
+        watermarks = []
+        for session in sessions:
+            with session.begin():
+                watermarks.append(get_watermark(session, model))
+        export_kw = _watermark_export_kw(watermarks, watermark_param)
+
+    def consume(session: Session, queue: Queue) -> Sequence[TBase]:
+        items = _iter_fanout_queue(queue)
+        try:
+            with session.begin():
+                if not incremental:
+                    stored = store_new(items, session, **store_kw)
+                else:
+                    tracker = _WatermarkTracker(get_watermark(session, model))
+                    stored = store_new(tracker.filter(items), session, **store_kw)
+                    tracker.save(session, model)
+                clear_checkpoint(session, model)
+                flush_and_commit(session, model, store_kw.get("metrics"))
+                return stored
+        finally:
+            # Keep draining our queue so the producer never blocks on us.
+            for _ in items:
+                pass
+
+    queues: list[Queue] = [Queue(maxsize=FANOUT_QUEUE_CHUNKS) for _ in sessions]
+    with ThreadPoolExecutor(
+        max_workers=len(sessions), thread_name_prefix=f"fanout-{model.__name__}"
+    ) as pool:
+        futures = [
+            pool.submit(consume, s, q) for s, q in zip(sessions, queues, strict=True)
+        ]
+        try:
+            items = exporter.get_model_items(model, **export_kw)
+            for chunk in chunked(items, FANOUT_CHUNK_SIZE):
+                # The first destination gets the original items, the others
+                # get copies.
+                queues[0].put(chunk)
+                for queue in queues[1:]:
+                    queue.put([item.clone() for item in chunk])
+        except BaseException:
+            for queue in queues:
+                queue.put(_FANOUT_ABORT)
+            raise
+        for queue in queues:
+            queue.put(_FANOUT_DONE)
+    return futures
+
+
+_FANOUT_DONE = object()
+_FANOUT_ABORT = object()
+
+
+class FanoutAborted(Exception):
+    """
+    Raised in fan-out consumers when the producer fails, so that their
+    transactions are rolled back.
+    """
+
+
+def _iter_fanout_queue(queue: Queue) -> TGen:
+    while True:
+        chunk = queue.get()
+        if chunk is _FANOUT_DONE:
+            return
+        if chunk is _FANOUT_ABORT:
+            raise FanoutAborted("Fetching items from the export API failed")
+        yield from chunk
+
+
+class _WatermarkTracker:
+    """
+    Filter out items that are below the previous watermark, and keep track of
+    the highest watermark value seen.
+    """
+
+    def __init__(self, watermark: Any):
+        self.previous = watermark
+        self.watermark = watermark
+
+    def save(self, session: Session, model: type[Base]):
+        if self.watermark is not None:
+            set_watermark(session, model, self.watermark)
+
+    def filter(self, items: Iterable[TBase]) -> TGen[TBase]:
+        for item in items:
+            value = item.watermark_json_value()
+            if self.previous is not None and value < self.previous:
+                continue
+            if self.watermark is None or value > self.watermark:
+                self.watermark = value
+            yield item
+
+
+async def async_sync_model_items(
+    model: type[TBase], exporter: AsyncExportClient, session: AsyncSession
+) -> Sequence[TBase]:
+    """
+    Asyncio equivalent of `sync_model_items`. Each page of new items is
+    filtered and flushed to the database while the next page is being fetched.
+
+    NOTE: This is intended to be a high-level operation and thus commits the
+          transaction.
+    """
+    async with session.begin():
+        existing = _index_by_pkey(await session.scalars(select(model)))
+        stored: list[TBase] = []
+        async for page in exporter.get_model_pages(model):
+            news = list(_filter_indexed(existing, page))
+            session.add_all(news)
+            stored.extend(news)
+            await session.flush()
+        await session.run_sync(clear_checkpoint, model)
+        return stored
@@ -0,0 +1,277 @@
+import hashlib
+import json
+from collections.abc import Iterable
+from datetime import datetime
+from typing import Any
+
+from sqlalchemy import (
+    JSON,
+    LargeBinary,
+    UniqueConstraint,
+    delete,
+    insert,
+    inspect,
+    select,
+)
+from sqlalchemy.orm import (
+    DeclarativeBase,
+    Mapped,
+    MappedAsDataclass,
+    Session,
+    mapped_column,
+)
+
+from .data_models import Base, InvalidItem
+
+
+class StateBase(MappedAsDataclass, DeclarativeBase):
+    """
+    Base class for our own bookkeeping tables. These live in a separate
+    registry so they aren't mistaken for AAQ tables to sync.
+    """
+
+
+class SyncState(StateBase, kw_only=True):
+    """
+    Per-table sync state, stored in the destination database.
+    """
+
+    __tablename__ = "aaq_sync_state"
+
+    table_name: Mapped[str] = mapped_column(primary_key=True)
+    # The highest watermark column value seen by the last successful sync, in
+    # its JSON representation.
+    watermark: Mapped[Any] = mapped_column(JSON, default=None, nullable=True)
+    updated_utc: Mapped[datetime] = mapped_column(default_factory=datetime.utcnow)
+
+
+class RowDigest(StateBase, kw_only=True):
+    """
+    Content digests of rows we've synced, so that we can detect changes
+    without loading and comparing whole rows. See `Base.content_digest`.
+    """
+
+    __tablename__ = "aaq_sync_digests"
+
+    table_name: Mapped[str] = mapped_column(primary_key=True)
+    # The JSON-encoded primary key value.
+    pkey: Mapped[str] = mapped_column(primary_key=True)
+    digest: Mapped[bytes] = mapped_column(LargeBinary(16))
+
+
+class SyncCheckpoint(StateBase, kw_only=True):
+    """
+    Progress of an unfinished sync that commits as it goes, so that it can be
+    resumed. See `sync_model_items`.
+    """
+
+    __tablename__ = "aaq_sync_checkpoints"
+
+    table_name: Mapped[str] = mapped_column(primary_key=True)
+    # The export API offset of the first item that hasn't been committed yet.
+    offset: Mapped[int]
+    # Whether the sync is incremental, which changes which items it exports.
+    incremental: Mapped[bool] = mapped_column(default=False)
+    # The export filters in use, which we need to resume from the same offset.
+    filters: Mapped[Any] = mapped_column(JSON, default=None, nullable=True)
+    # The highest watermark seen so far, in its JSON representation.
+    watermark: Mapped[Any] = mapped_column(JSON, default=None, nullable=True)
+    # The JSON-encoded primary key value of the last committed item.
+    last_pkey: Mapped[str | None] = mapped_column(default=None)
+    updated_utc: Mapped[datetime] = mapped_column(default_factory=datetime.utcnow)
+
+
+class QuarantinedItem(StateBase, kw_only=True):
+    """
+    An exported item that failed validation, kept aside with its errors
+    instead of failing the sync. See `sync_model_items`.
+    """
+
+    __tablename__ = "aaq_sync_quarantine"
+    __table_args__ = (UniqueConstraint("table_name", "item_key"),)
+
+    id: Mapped[int] = mapped_column(init=False, primary_key=True)
+    table_name: Mapped[str]
+    # Identifies the item, so that quarantining it again replaces its entry.
+    # See `_quarantine_key`.
+    item_key: Mapped[str]
+    # The item as it was exported.
+    item: Mapped[Any] = mapped_column(JSON)
+    # Every problem found with the item.
+    errors: Mapped[list[str]] = mapped_column(JSON)
+    quarantined_utc: Mapped[datetime] = mapped_column(default_factory=datetime.utcnow)
+
+
+def ensure_table(session: Session, state_model: type[StateBase]):
+    """
+    Create the table for the given bookkeeping model if it doesn't exist yet.
+    """
+    table = StateBase.metadata.tables[state_model.__tablename__]
+    table.create(session.connection(), checkfirst=True)
+
+
+def table_exists(session: Session, state_model: type[StateBase]) -> bool:
+    """
+    Check whether the table for the given bookkeeping model exists, without
+    creating it.
+    """
+    conn = session.connection()
+    return inspect(conn).has_table(state_model.__tablename__)
+
+
+def get_sync_state(session: Session, model: type[Base]) -> SyncState | None:
+    """
+    Fetch the sync state for the given model, creating the state table if
+    necessary.
+    """
+    ensure_table(session, SyncState)
+    return session.get(SyncState, model.__tablename__)
+
+
+def get_watermark(session: Session, model: type[Base]) -> Any:
+    state = get_sync_state(session, model)
+    return None if state is None else state.watermark
+
+
+def set_watermark(session: Session, model: type[Base], watermark: Any):
+    state = get_sync_state(session, model)
+    if state is None:
+        state = SyncState(table_name=model.__tablename__)
+        session.add(state)
+    state.watermark = watermark
+    state.updated_utc = datetime.utcnow()
+
+
+def fetch_digests(session: Session, model: type[Base]) -> dict[tuple, bytes]:
+    """
+    Fetch the stored content digests for the given model, keyed by pkey value.
+    Only the pkeys and digests are fetched, not the rows themselves.
+    """
+    ensure_table(session, RowDigest)
+    query = select(RowDigest.pkey, RowDigest.digest).where(
+        RowDigest.table_name == model.__tablename__
+    )
+    return {tuple(json.loads(pkey)): digest for pkey, digest in session.execute(query)}
+
+
+def store_digests(session: Session, model: type[Base], items: Iterable[Base]):
+    """
+    Store content digests for the given items, which mustn't already have
+    digests stored.
+    """
+    rows = [
+        {
+            "table_name": model.__tablename__,
+            "pkey": json.dumps(list(item.pkey_value())),
+            "digest": item.content_digest(),
+        }
+        for item in items
+    ]
+    if rows:
+        ensure_table(session, RowDigest)
+        session.execute(insert(RowDigest), rows)
+
+
+def delete_digests(session: Session, model: type[Base], pkeys: Iterable[tuple]):
+    """
+    Delete the stored content digests for the given pkeys, if there are any.
+    This should be done whenever rows are changed or deleted, whether or not
+    the sync doing so uses digests, so that later syncs that do use them never
+    compare against stale digests.
+    """
+    encoded = [json.dumps(list(pkey)) for pkey in pkeys]
+    if encoded and table_exists(session, RowDigest):
+        session.execute(
+            delete(RowDigest).where(
+                RowDigest.table_name == model.__tablename__,
+                RowDigest.pkey.in_(encoded),
+            )
+        )
+
+
+def get_checkpoint(session: Session, model: type[Base]) -> SyncCheckpoint | None:
+    ensure_table(session, SyncCheckpoint)
+    return session.get(SyncCheckpoint, model.__tablename__)
+
+
+def set_checkpoint(
+    session: Session,
+    model: type[Base],
+    offset: int,
+    filters: dict[str, Any] | None = None,
+    watermark: Any = None,
+    last_pkey: tuple | None = None,
+    incremental: bool = False,
+):
+    checkpoint = get_checkpoint(session, model)
+    if checkpoint is None:
+        checkpoint = SyncCheckpoint(table_name=model.__tablename__, offset=offset)
+        session.add(checkpoint)
+    checkpoint.offset = offset
+    checkpoint.incremental = incremental
+    checkpoint.filters = filters
+    checkpoint.watermark = watermark
+    checkpoint.last_pkey = None if last_pkey is None else json.dumps(list(last_pkey))
+    checkpoint.updated_utc = datetime.utcnow()
+
+
+def clear_checkpoint(session: Session, model: type[Base]):
+    checkpoint = get_checkpoint(session, model)
+    if checkpoint is not None:
+        session.delete(checkpoint)
+
+
+def _quarantine_key(model: type[Base], item: dict[str, Any]) -> str:
+    """
+    Identify an invalid item by its JSON-encoded pkey value if it has one, or
+    by a hash of its content if it doesn't.
+    """
+    names = [col.name for col in model.__table__.primary_key]
+    if all(item.get(name) is not None for name in names):
+        return json.dumps([item[name] for name in names])
+    content = json.dumps(item, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def quarantine_items(
+    session: Session, model: type[Base], invalid: Iterable[InvalidItem]
+):
+    """
+    Store the given invalid items and their errors in the quarantine table.
+    An item that's already quarantined (see `_quarantine_key`) replaces its
+    old entry, so repeated syncs of the same invalid items don't add more.
+    """
+    now = datetime.utcnow()
+    rows = {}
+    for item, errors in invalid:
+        key = _quarantine_key(model, item)
+        rows[key] = {
+            "table_name": model.__tablename__,
+            "item_key": key,
+            "item": item,
+            "errors": errors,
+            "quarantined_utc": now,
+        }
+    if rows:
+        ensure_table(session, QuarantinedItem)
+        session.execute(
+            delete(QuarantinedItem).where(
+                QuarantinedItem.table_name == model.__tablename__,
+                QuarantinedItem.item_key.in_(rows.keys()),
+            )
+        )
+        session.execute(insert(QuarantinedItem), list(rows.values()))
+
+
+def fetch_quarantined(session: Session, model: type[Base]) -> list[QuarantinedItem]:
+    """
+    Fetch the quarantined items for the given model, in the order they were
+    (last) quarantined.
+    """
+    ensure_table(session, QuarantinedItem)
+    query = (
+        select(QuarantinedItem)
+        .where(QuarantinedItem.table_name == model.__tablename__)
+        .order_by(QuarantinedItem.id)
+    )
+    return list(session.scalars(query))
@@ -0,0 +1,252 @@
+"""
+HTTP transport options for the export API clients: HTTP/2, connection pool
+limits, negotiated response compression and retries with backoff.
+"""
+
+import asyncio
+import time
+from collections.abc import Awaitable, Callable, Iterable
+from datetime import UTC, datetime
+from email.utils import parsedate_to_datetime
+from importlib.util import find_spec
+
+from attrs import define, field
+from httpx import (
+    AsyncBaseTransport,
+    AsyncHTTPTransport,
+    BaseTransport,
+    HTTPTransport,
+    Limits,
+    Request,
+    Response,
+    Timeout,
+    TransportError,
+)
+from httpx import __version__ as httpx_version
+
+# Statuses that mean "try again later" rather than "this request is bad". A
+# 500 may well be transient too, and the export API only serves reads, so
+# retrying one is harmless.
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+def _can_decode(encoding: str) -> bool:
+    """
+    Check whether httpx can decode the given content encoding, which depends on
+    which optional packages are installed (and, for zstd, the httpx version).
+    """
+    match encoding:
+        case "zstd":
+            httpx_minor = tuple(int(part) for part in httpx_version.split(".")[:2])
+            return httpx_minor >= (0, 27) and find_spec("zstandard") is not None
+        case "br":
+            return any(find_spec(pkg) is not None for pkg in ["brotli", "brotlicffi"])
+    return True
+
+
+def supported_encodings() -> list[str]:
+    """
+    Return the response content encodings we can decode, best first.
+    """
+    preferred = ["zstd", "br", "gzip", "deflate"]
+    return [enc for enc in preferred if _can_decode(enc)]
+
+
+def http2_available() -> bool:
+    return find_spec("h2") is not None
+
+
+def _retry_after(response: Response) -> float | None:
+    """
+    Return the number of seconds the server asked us to wait in its
+    `Retry-After` header, which may be a number of seconds or an HTTP date.
+    """
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=UTC)
+    return max(0.0, (when - datetime.now(UTC)).total_seconds())
+
+
+@define
+class _RetryPolicy:
+    retries: int
+    backoff: float
+    max_backoff: float
+
+    def delay(self, attempt: int, response: Response | None) -> float | None:
+        """
+        Return how long to wait before retrying after the given (zero-based)
+        attempt failed, or None if we shouldn't retry. We back off
+        exponentially, but wait longer if the server asks us to. If it asks us
+        to wait longer than `max_backoff`, we give up instead.
+        """
+        if attempt >= self.retries:
+            return None
+        if response is not None and response.status_code not in RETRY_STATUSES:
+            return None
+        delay = min(self.max_backoff, self.backoff * 2**attempt)
+        retry_after = None if response is None else _retry_after(response)
+        if retry_after is not None:
+            if retry_after > self.max_backoff:
+                return None
+            delay = max(delay, retry_after)
+        return delay
+
+
+@define
+class RetryTransport(BaseTransport, AsyncBaseTransport):
+    """
+    A transport that retries requests that fail with a connection error or a
+    "try again later" status (see `RETRY_STATUSES`), with exponential backoff
+    that honours `Retry-After`. The export API is read-only, so every request
+    is safe to retry.
+
+    This wraps either a sync or an async transport, and should only be used
+    with a client of the same kind.
+    """
+
+    transport: BaseTransport | AsyncBaseTransport
+    retries: int = 3
+    backoff: float = 0.5
+    max_backoff: float = 30.0
+    sleep: Callable[[float], None] = field(default=time.sleep, repr=False)
+    async_sleep: Callable[[float], Awaitable[None]] = field(
+        default=asyncio.sleep, repr=False
+    )
+
+    @property
+    def _policy(self) -> _RetryPolicy:
+        return _RetryPolicy(self.retries, self.backoff, self.max_backoff)
+
+    def handle_request(self, request: Request) -> Response:
+        assert isinstance(self.transport, BaseTransport)  # noqa: S101 (For mypy.)
+        policy = self._policy
+        attempt = 0
+        while True:
+            try:
+                response = self.transport.handle_request(request)
+            except TransportError:
+                if (delay := policy.delay(attempt, None)) is None:
+                    raise
+            else:
+                if (delay := policy.delay(attempt, response)) is None:
+                    return response
+                response.close()
+            self.sleep(delay)
+            attempt += 1
+
+    async def handle_async_request(self, request: Request) -> Response:
+        assert isinstance(self.transport, AsyncBaseTransport)  # noqa: S101
+        policy = self._policy
+        attempt = 0
+        while True:
+            try:
+                response = await self.transport.handle_async_request(request)
+            except TransportError:
+                if (delay := policy.delay(attempt, None)) is None:
+                    raise
+            else:
+                if (delay := policy.delay(attempt, response)) is None:
+                    return response
+                await response.aclose()
+            await self.async_sleep(delay)
+            attempt += 1
+
+    def close(self):
+        assert isinstance(self.transport, BaseTransport)  # noqa: S101
+        self.transport.close()
+
+    async def aclose(self):
+        assert isinstance(self.transport, AsyncBaseTransport)  # noqa: S101
+        await self.transport.aclose()
+
+
+def _to_tuple(values: Iterable[str]) -> tuple[str, ...]:
+    return tuple(values)
+
+
+@define(frozen=True)
+class HTTPOptions:
+    """
+    Options for the HTTP clients used to talk to the export API. The defaults
+    match httpx's, apart from `encodings` (which lists everything we can
+    decode) and `retries`.
+    """
+
+    http2: bool = False
+    max_connections: int | None = 100
+    max_keepalive_connections: int | None = 20
+    keepalive_expiry: float | None = 5.0
+    timeout: float | None = 5.0
+    # Response content encodings to ask for, best first. An empty list asks
+    # for uncompressed responses.
+    encodings: tuple[str, ...] = field(
+        factory=lambda: tuple(supported_encodings()), converter=_to_tuple
+    )
+    retries: int = 0
+    backoff: float = 0.5
+    max_backoff: float = 30.0
+
+    def __attrs_post_init__(self):
+        # httpx only checks for h2 when it builds its own transport.
+        if self.http2 and not http2_available():
+            raise ImportError(
+                "http2=True needs the h2 package, which can be installed with"
+                " `pip install aaq-sync[http2]`"
+            )
+        unsupported = set(self.encodings) - set(supported_encodings())
+        if unsupported:
+            encs = ", ".join(sorted(unsupported))
+            raise ValueError(f"Can't decode content encodings: {encs}")
+
+    def headers(self) -> dict[str, str]:
+        return {"Accept-Encoding": ", ".join(self.encodings) or "identity"}
+
+    def limits(self) -> Limits:
+        return Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+
+    def timeouts(self) -> Timeout:
+        return Timeout(self.timeout)
+
+    def _with_retries(self, transport):
+        if self.retries == 0:
+            return transport
+        return RetryTransport(
+            transport,
+            retries=self.retries,
+            backoff=self.backoff,
+            max_backoff=self.max_backoff,
+        )
+
+    def transport(self, inner: BaseTransport | None = None) -> BaseTransport:
+        """
+        Build a sync transport with these options. If `inner` is given, it's
+        used instead of a network transport, and only the retry options apply.
+        """
+        if inner is None:
+            inner = HTTPTransport(http2=self.http2, limits=self.limits())
+        return self._with_retries(inner)
+
+    def async_transport(
+        self, inner: AsyncBaseTransport | None = None
+    ) -> AsyncBaseTransport:
+        """
+        Build an async transport with these options, the same as `transport`.
+        """
+        if inner is None:
+            inner = AsyncHTTPTransport(http2=self.http2, limits=self.limits())
+        return self._with_retries(inner)
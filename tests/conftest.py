@@ -3,17 +3,42 @@ import os
 import pytest
 from pytest_postgresql import factories
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine
 from sqlalchemy.pool import NullPool
 
 if "USE_EXISTING_PG" in os.environ:
     pg_fixture = factories.postgresql("postgresql_noproc")
+    pg_mirror_fixture = factories.postgresql("postgresql_noproc", dbname="mirror")
 else:
     pg_fixture = factories.postgresql("postgresql_proc")
+    pg_mirror_fixture = factories.postgresql("postgresql_proc", dbname="mirror")
 
 
-@pytest.fixture()
-def dbengine(pg_fixture):
-    i = pg_fixture.info
+def _pg_engine(pg):
+    i = pg.info
     creds = f"{i.user}:{i.password}"
     url = f"postgresql+psycopg://{creds}@{i.host}:{i.port}/{i.dbname}"
     return create_engine(url, echo=False, poolclass=NullPool)
+
+
+@pytest.fixture()
+def dbengine(pg_fixture):
+    return _pg_engine(pg_fixture)
+
+
+@pytest.fixture()
+def mirror_dbengine(pg_mirror_fixture):
+    """
+    A second PostgreSQL database, for tests that need two of the same kind.
+    """
+    return _pg_engine(pg_mirror_fixture)
+
+
+@pytest.fixture()
+def async_dbengine(dbengine):
+    return create_async_engine(dbengine.url, echo=False, poolclass=NullPool)
+
+
+@pytest.fixture()
+def anyio_backend():
+    return "asyncio"
@@ -1,3 +1,5 @@
+import gzip
+import hashlib
 from typing import Any
 
 from attrs import define, field
@@ -12,6 +14,20 @@ class FakeDataExport:
     base_url: URL
     mock: HTTPXMock
     token: str | None = None
+    # If set, the query param used to filter items by `faq_updated_utc`.
+    watermark_param: str | None = None
+    # If set, requests with a larger limit fail with a server error.
+    max_limit: int | None = None
+    # If set, pages have ETags and unchanged pages can be revalidated.
+    use_etags: bool = False
+    # The number of requests answered with "304 Not Modified".
+    not_modified: int = 0
+    # The number of requests to answer with "429 Too Many Requests" before
+    # answering normally, and the Retry-After header to send with them.
+    throttle: int = 0
+    retry_after: str | None = None
+    # If set, responses are gzipped for clients that accept it.
+    use_gzip: bool = False
 
     faqmatches: list[JSONDict] = field(factory=list)
 
@@ -23,12 +39,36 @@ class FakeDataExport:
         if self.token is not None and req_auth != f"Bearer {self.token}":
             body = {"error": "Authorization Failed!", "message": "Invalid Auth Token"}
             return Response(status_code=401, json=body)
+        if self.throttle > 0:
+            self.throttle -= 1
+            headers = (
+                {} if self.retry_after is None else {"Retry-After": self.retry_after}
+            )
+            return Response(status_code=429, headers=headers)
         path = req.url.path[len(self.base_url.path) :]
         items = {
             "faqmatches": self.faqmatches,
         }[path]
+        if self.watermark_param and self.watermark_param in req.url.params:
+            watermark = int(req.url.params[self.watermark_param])
+            items = [i for i in items if i["faq_updated_utc"] >= watermark]
         offset = int(req.url.params["offset"])
         limit = int(req.url.params["limit"])
+        if self.max_limit is not None and limit > self.max_limit:
+            return Response(status_code=503, json={"error": "Too much!"})
         items = items[offset:][:limit]
         meta = {"size": len(items), "offset": offset, "limit": limit}
-        return Response(status_code=200, json={"metadata": meta, "result": items})
+        resp = Response(status_code=200, json={"metadata": meta, "result": items})
+        if self.use_etags:
+            etag = f'"{hashlib.md5(resp.content).hexdigest()}"'  # noqa: S324
+            if req.headers.get("If-None-Match") == etag:
+                self.not_modified += 1
+                return Response(status_code=304, headers={"ETag": etag})
+            resp.headers["ETag"] = etag
+        if self.use_gzip and "gzip" in req.headers.get("Accept-Encoding", ""):
+            gzipped = gzip.compress(resp.content)
+            headers = {**resp.headers, "Content-Encoding": "gzip"}
+            headers["Content-Length"] = str(len(gzipped))
+            # Content from an iterator is left for the client to decode.
+            resp = Response(status_code=200, headers=headers, content=iter([gzipped]))
+        return resp
@@ -0,0 +1,82 @@
+import pytest
+from httpx import HTTPStatusError, ReadTimeout, Request, Response
+
+from aaq_sync.adaptive_paging import AdaptivePageSizer
+
+
+def http_error(status_code: int) -> HTTPStatusError:
+    req = Request("GET", "https://example.com/")
+    resp = Response(status_code=status_code, request=req)
+    return HTTPStatusError("Error", request=req, response=resp)
+
+
+def test_initial_limit():
+    """
+    The initial limit is clamped to the configured bounds.
+    """
+    assert AdaptivePageSizer().limit == 1000
+    assert AdaptivePageSizer(initial_limit=5).limit == 100
+    assert AdaptivePageSizer(initial_limit=50000).limit == 10000
+
+    with pytest.raises(ValueError, match="bounds"):
+        AdaptivePageSizer(min_limit=10, max_limit=5)
+    with pytest.raises(ValueError, match="bounds"):
+        AdaptivePageSizer(min_limit=0)
+
+
+def test_record_page():
+    """
+    The limit grows when pages are fast and shrinks when they're slow, by at
+    most max_growth at a time and within the configured bounds.
+    """
+    sizer = AdaptivePageSizer(target_seconds=2.0, max_limit=3000)
+
+    sizer.record_page(elapsed=1.6, nbytes=1000)
+    assert sizer.limit == 1250
+    sizer.record_page(elapsed=0.1, nbytes=1000)
+    assert sizer.limit == 2500
+    sizer.record_page(elapsed=0.1, nbytes=1000)
+    assert sizer.limit == 3000
+
+    sizer.record_page(elapsed=3.0, nbytes=1000)
+    assert sizer.limit == 2000
+    sizer.record_page(elapsed=60.0, nbytes=1000)
+    assert sizer.limit == 1000
+    sizer.record_page(elapsed=0.0, nbytes=1000)
+    assert sizer.limit == 2000
+
+
+def test_record_page_max_bytes():
+    """
+    If pages are too big, the limit shrinks even if they're fast.
+    """
+    sizer = AdaptivePageSizer(max_page_bytes=1_000_000)
+
+    sizer.record_page(elapsed=0.1, nbytes=4_000_000)
+    assert sizer.limit == 250
+    sizer.record_page(elapsed=0.1, nbytes=500_000)
+    assert sizer.limit == 500
+
+
+def test_record_failure():
+    """
+    Server errors and timeouts shrink the limit and are retried a limited
+    number of times in a row. Other errors aren't retried.
+    """
+    sizer = AdaptivePageSizer(max_retries=2)
+
+    assert sizer.record_failure(http_error(503)) is True
+    assert sizer.limit == 500
+    assert sizer.record_failure(ReadTimeout("Timeout")) is True
+    assert sizer.limit == 250
+    assert sizer.record_failure(http_error(500)) is False
+    assert sizer.limit == 125
+
+    # A successful page resets the failure count.
+    sizer.record_page(elapsed=2.0, nbytes=1000)
+    assert sizer.record_failure(http_error(502)) is True
+    assert sizer.limit == 100
+
+    assert sizer.record_failure(http_error(401)) is False
+    assert sizer.record_failure(ValueError("Not HTTP")) is False
+    assert sizer.limit == 100
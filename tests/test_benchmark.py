@@ -0,0 +1,81 @@
+import json
+
+from click.testing import CliRunner
+
+from aaq_sync.benchmark import main, synthetic_faqs
+from aaq_sync.data_models import FAQModel
+
+from .helpers import Database
+
+STAGES = [
+    "http",
+    "json_decode",
+    "from_json",
+    "filter_existing",
+    "store_new",
+    "commit",
+    "resync_unchanged",
+    "resync_unchanged_core",
+]
+
+
+def test_synthetic_faqs():
+    """
+    Synthetic FAQs are valid export data with the requested sizes, and are
+    reproducible.
+    """
+    faqds = synthetic_faqs(5, text_size=50, array_len=2, seed=1)
+    faqs = FAQModel.from_json_many(faqds)
+
+    assert [faq.faq_id for faq in faqs] == [1, 2, 3, 4, 5]
+    assert all(len(faq.faq_content_to_send) == 50 for faq in faqs)
+    assert all(len(faq.faq_questions) == 2 for faq in faqs)
+    assert len({faq.faq_content_to_send for faq in faqs}) == 5
+    assert synthetic_faqs(5, text_size=50, array_len=2, seed=1) == faqds
+    assert synthetic_faqs(5, text_size=50, array_len=2, seed=2) != faqds
+
+
+def test_benchmark_smoke(dbengine, tmp_path):
+    """
+    The benchmark runs against SQLite and PostgreSQL and writes its results as
+    JSON.
+    """
+    db = Database(dbengine)
+    output = tmp_path / "results.json"
+    opts = [
+        *("--db-url", db.url_with_password),
+        *("--db-url", f"sqlite:///{tmp_path / 'bench.db'}"),
+        *("--rows", "25"),
+        *("--page-size", "10"),
+        *("--insert-method", "executemany"),
+        *("--startup-runs", "0"),
+        *("--output", str(output)),
+    ]
+
+    result = CliRunner().invoke(main, opts)
+    print(result.output)
+    assert result.exit_code == 0
+    results = json.loads(output.read_text())
+    assert results["params"]["rows"] == 25
+    assert "cli_startup_seconds" not in results
+    assert [r["db"] for r in results["results"]] == ["postgresql", "sqlite"]
+    for r in results["results"]:
+        assert list(r["stages"]) == STAGES
+        assert r["rows_per_second"] > 0
+    assert len(db.fetch_faqs()) == 25
+
+
+def test_benchmark_defaults():
+    """
+    By default, the benchmark uses a temporary SQLite db and writes to stdout.
+    """
+    result = CliRunner().invoke(main, ["--rows", "3", "--insert-method", "orm"])
+    assert result.exit_code == 0
+    results = json.loads(result.output)
+    [r] = results["results"]
+    assert r["db"] == "sqlite"
+    assert results["cli_startup_seconds"] > 0
+
+    # The copy insert method only works with PostgreSQL.
+    result = CliRunner().invoke(main, ["--rows", "3", "--insert-method", "copy"])
+    assert result.exit_code != 0
@@ -1,11 +1,20 @@
 import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
 
 import pytest
 from click.testing import CliRunner
 from httpx import URL
+from sqlalchemy import create_engine
 
-from aaq_sync.cli import aaq_sync
-from aaq_sync.data_models import Base, FAQModel
+from aaq_sync.cli import TABLE_NAMES, aaq_sync, main
+from aaq_sync.data_models import Base, FAQModel, get_models
+from aaq_sync.snapshot import write_snapshot
+from aaq_sync.sync_state import fetch_quarantined
 
 from .fake_data_export import FakeDataExport
 from .helpers import Database, read_test_data
@@ -16,6 +25,10 @@ OPTS_EXPORT_TOKEN = ("--export-token", "faketoken")
 OPTS_EXPORT = (*OPTS_EXPORT_URL, *OPTS_EXPORT_TOKEN)
 OPTS_TABLE = ("--table", "faqmatches")
 
+# Modules that are slow to import, which the CLI shouldn't need until it runs
+# a command.
+HEAVY_MODULES = ["sqlalchemy", "httpx", "aaq_sync.data_models"]
+
 
 @pytest.fixture()
 def runner():
@@ -38,6 +51,43 @@ def fake_data_export(httpx_mock):
     return FakeDataExport(URL("https://127.0.0.100:1234/"), httpx_mock)
 
 
+def test_table_names():
+    """
+    The CLI's static list of table names matches the models.
+    """
+    assert sorted(TABLE_NAMES) == sorted(m.__tablename__ for m in get_models())
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ["--help"],
+        ["sync", "--help"],
+        ["load", "--help"],
+        ["reconcile", "--help"],
+        ["sync", "--table", "x"],
+    ],
+)
+def test_startup_imports(args):
+    """
+    Showing help or reporting a usage error doesn't import any heavy modules,
+    so that short runs start quickly.
+    """
+    code = "\n".join([
+        "import sys",
+        "from aaq_sync.cli import main",
+        "try:",
+        f"    main({args!r})",
+        "except SystemExit:",
+        "    pass",
+        f"print([m for m in {HEAVY_MODULES!r} if m in sys.modules])",
+    ])
+    result = subprocess.run(  # noqa: S603 (Our own code.)
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    assert result.stdout.splitlines()[-1] == "[]"
+
+
 def test_missing_opts(runner):
     """
     All required options must be provided.
@@ -101,3 +151,789 @@ def test_sync_faqmatches_envvars(runner, fake_data_export, db, monkeypatch):
     print(result.output)
     assert result.exit_code == 0
     assert db.fetch_faqs() == [faq1, faq2]
+
+
+def test_sync_faqmatches_prefetch(runner, fake_data_export, db):
+    """
+    Export pages can be prefetched concurrently.
+    """
+    faqds = json.loads(read_test_data("two_faqs.json"))["result"]
+    [faq1, faq2] = [FAQModel.from_json(faqd) for faqd in faqds]
+    fake_data_export.faqmatches.extend(faqds)
+
+    opts = [
+        *("--db-url", db.engine.url),
+        *("--export-url", fake_data_export.base_url),
+        *("--export-token", "faketoken"),
+        *("--table", "faqmatches"),
+        *("--prefetch-pages", "3"),
+    ]
+
+    result = runner.invoke(aaq_sync, opts)
+    print(result.output)
+    assert result.exit_code == 0
+    assert db.fetch_faqs() == [faq1, faq2]
+
+
+def test_sync_faqmatches_async(runner, fake_data_export, db):
+    """
+    Syncing can use asyncio instead of threads.
+    """
+    faqds = json.loads(read_test_data("two_faqs.json"))["result"]
+    [faq1, faq2] = [FAQModel.from_json(faqd) for faqd in faqds]
+    fake_data_export.faqmatches.extend(faqds)
+
+    opts = [
+        *("--db-url", db.engine.url),
+        *("--export-url", fake_data_export.base_url),
+        *("--export-token", "faketoken"),
+        *("--table", "faqmatches"),
+        "--async",
+    ]
+
+    result = runner.invoke(aaq_sync, opts)
+    print(result.output)
+    assert result.exit_code == 0
+    assert db.fetch_faqs() == [faq1, faq2]
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ["--parallel-tables"],
+        ["--prefetch-pages", "2"],
+        ["--stream"],
+        ["--adaptive-paging"],
+        ["--page-cache", "cache.db"],
+        ["--merge-join"],
+        ["--lookup-batch-size", "10"],
+        ["--incremental"],
+        ["--watermark-param", "since"],
+        ["--commit-every", "10"],
+        ["--insert-method", "executemany"],
+        ["--on-conflict", "update"],
+        ["--use-digests"],
+    ],
+)
+def test_sync_faqmatches_async_unsupported(runner, args):
+    """
+    Options that the asyncio sync doesn't support are rejected rather than
+    ignored.
+    """
+    opts = [*OPTS_DB, *OPTS_EXPORT, *OPTS_TABLE, "--async", *args]
+    result = runner.invoke(aaq_sync, opts)
+    assert result.exit_code == 2
+    assert f"--async can't be used with {args[0]}" in result.output
+
+
+def test_sync_faqmatches_parallel(runner, fake_data_export, db):
+    """
+    Tables can be synced in parallel, each reporting its own result.
+    """
+    faqds = json.loads(read_test_data("two_faqs.json"))["result"]
+    [faq1, faq2] = [FAQModel.from_json(faqd) for faqd in faqds]
+    fake_data_export.faqmatches.extend(faqds)
+
+    opts = [
+        *("--db-url", db.engine.url),
+        *("--export-url", fake_data_export.base_url),
+        *("--export-token", "faketoken"),
+        *("--table", "faqmatches"),
+        "--parallel-tables",
+    ]
+
+    result = runner.invoke(aaq_sync, opts)
+    print(result.output)
+    assert result.exit_code == 0
+    assert "Synced 2 faqmatches items." in result.output
+    assert db.fetch_faqs() == [faq1, faq2]
+
+
+def test_sync_faqmatches_parallel_failure(runner, fake_data_export, db):
+    """
+    When syncing tables in parallel, failures are reported per table.
+    """
+    fake_data_export.token = "goodtoken"  # noqa: S105 (Not a real token.)
+
+    opts = [
+        *("--db-url", db.engine.url),
+        *("--export-url", fake_data_export.base_url),
+        *("--export-token", "badtoken"),
+        *("--table", "faqmatches"),
+        "--parallel-tables",
+    ]
+
+    result = runner.invoke(aaq_sync, opts)
+    print(result.output)
+    assert result.exit_code != 0
+    assert "Failed to sync faqmatches: Client error '401" in result.output
+    assert "Failed to sync: faqmatches" in result.output
+    assert db.fetch_faqs() == []
+
+
+def test_sync_faqmatches_fanout(runner, fake_data_export, db, tmp_path):
+    """
+    Tables can be synced to several databases at once, each reporting its own
+    result.
+    """
+    faqds = json.loads(read_test_data("two_faqs.json"))["result"]
+    [faq1, faq2] = [FAQModel.from_json(faqd) for faqd in faqds]
+    fake_data_export.faqmatches.extend(faqds)
+    sqlite_url = f"sqlite:///{tmp_path / 'dest.db'}"
+    sqlite_db = Database(create_engine(sqlite_url))
+    Base.metadata.create_all(sqlite_db.engine)
+    empty_url = f"sqlite:///{tmp_path / 'empty.db'}"
+
+    opts = [
+        *("--db-url", db.engine.url),
+        *("--db-url", sqlite_url),
+        *("--export-url", fake_data_export.base_url),
+        *("--export-token", "faketoken"),
+        *("--table", "faqmatches"),
+    ]
+
+    result = runner.invoke(aaq_sync, opts)
+    print(result.output)
+    assert result.exit_code == 0
+    assert "Syncing faqmatches to 2 databases ..." in result.output
+    assert f"Synced 2 faqmatches items to {sqlite_url}." in result.output
+    assert db.fetch_faqs() == [faq1, faq2]
+    assert sqlite_db.fetch_faqs() == [faq1, faq2]
+    assert len(fake_data_export.mock.get_requests()) == 1
+
+    # A failure in one database is reported.
+    result = runner.invoke(aaq_sync, [*opts, "--db-url", empty_url])
+    print(result.output)
+    assert result.exit_code != 0
+    assert f"Failed to sync faqmatches to {empty_url}: " in result.output
+    assert f"Failed to sync: faqmatches to {empty_url}" in result.output
+
+    # Fan-out can't be combined with other modes.
+    result = runner.invoke(aaq_sync, [*opts, "--parallel-tables"])
+    assert result.exit_code != 0
+    assert "can't be used with multiple --db-url" in result.output
+
+
+def test_sync_faqmatches_merge_join(runner, fake_data_export, db):
+    """
+    Existing items can be streamed and merge-joined with new items.
+    """
+    faqds = json.loads(read_test_data("two_faqs.json"))["result"]
+    [faq1, faq2] = [FAQModel.from_json(faqd) for faqd in faqds]
+    fake_data_export.faqmatches.extend(faqds)
+    db.faq_json_to_db("two_faqs.json")
+
+    opts = [
+        *("--db-url", db.engine.url),
+        *("--export-url", fake_data_export.base_url),
+        *("--export-token", "faketoken"),
+        *("--table", "faqmatches"),
+        "--merge-join",
+    ]
+
+    result = runner.invoke(aaq_sync, opts)
+    print(result.output)
+    assert result.exit_code == 0
+    assert "Synced 0 faqmatches items." in result.output
+    assert db.fetch_faqs() == [faq1, faq2]
+
+
+def test_sync_faqmatches_lookup_batch_size(runner, fake_data_export, db):
+    """
+    Existing items can be looked up a batch at a time.
+    """
+    faqds = json.loads(read_test_data("two_faqs.json"))["result"]
+    [faq1, faq2] = [FAQModel.from_json(faqd) for faqd in faqds]
+    fake_data_export.faqmatches.extend(faqds)
+    db.faq_json_to_db("two_faqs.json")
+
+    opts = [
+        *("--db-url", db.engine.url),
+        *("--export-url", fake_data_export.base_url),
+        *("--export-token", "faketoken"),
+        *("--table", "faqmatches"),
+        *("--lookup-batch-size", "1"),
+    ]
+
+    result = runner.invoke(aaq_sync, opts)
+    print(result.output)
+    assert result.exit_code == 0
+    assert "Synced 0 faqmatches items." in result.output
+    assert db.fetch_faqs() == [faq1, faq2]
+
+
+@pytest.mark.parametrize(
+    "lookup_opts",
+    [
+        ["--merge-join", "--lookup-batch-size=1"],
+        ["--merge-join", "--use-digests"],
+        ["--lookup-batch-size=1", "--use-digests"],
+    ],
+)
+def test_sync_faqmatches_lookup_conflicts(runner, lookup_opts):
+    """
+    Only one way of looking up existing items can be used at a time.
+    """
+    result = runner.invoke(
+        aaq_sync, [*OPTS_DB, *OPTS_EXPORT, *OPTS_TABLE, *lookup_opts]
+    )
+    assert result.exit_code == 2
+    assert "Only one of --merge-join, --lookup-batch-size and" in result.output
+
+
+def test_sync_faqmatches_incremental(runner, fake_data_export, db):
+    """
+    Incremental syncs skip items older than the last incremental sync saw.
+    """
+    faqds = json.loads(read_test_data("two_faqs.json"))["result"]
+    [faq1, faq2] = [FAQModel.from_json(faqd) for faqd in faqds]
+    fake_data_export.faqmatches.extend(faqds)
+    fake_data_export.watermark_param = "updated_since"
+
+    opts = [
+        *("--db-url", db.engine.url),
+        *("--export-url", fake_data_export.base_url),
+        *("--export-token", "faketoken"),
+        *("--table", "faqmatches"),
+        "--incremental",
+        *("--watermark-param", "updated_since"),
+    ]
+
+    result = runner.invoke(aaq_sync, opts)
+    print(result.output)
+    assert result.exit_code == 0
+    assert "Synced 2 faqmatches items." in result.output
+
+    # This is older than the watermark, so it's ignored.
+    fake_data_export.faqmatches.append(faqds[0] | {"faq_id": 3})
+    result = runner.invoke(aaq_sync, opts)
+    print(result.output)
+    assert result.exit_code == 0
+    assert "Synced 0 faqmatches items." in result.output
+    assert db.fetch_faqs() == [faq1, faq2]
+
+
+def test_sync_faqmatches_commit_every(runner, fake_data_export, db):
+    """
+    Syncs can commit every so many items.
+    """
+    faqds = json.loads(read_test_data("two_faqs.json"))["result"]
+    [faq1, faq2] = [FAQModel.from_json(faqd) for faqd in faqds]
+    fake_data_export.faqmatches.extend(faqds)
+
+    opts = [
+        *("--db-url", db.engine.url),
+        *("--export-url", fake_data_export.base_url),
+        *("--export-token", "faketoken"),
+        *("--table", "faqmatches"),
+        *("--commit-every", "1"),
+        *("--lookup-batch-size", "1"),
+    ]
+
+    result = runner.invoke(aaq_sync, opts)
+    print(result.output)
+    assert result.exit_code == 0
+    assert db.fetch_faqs() == [faq1, faq2]
+
+
+def test_sync_faqmatches_prune(runner, fake_data_export, db):
+    """
+    Syncs can delete items that are no longer in the export.
+    """
+    faqds = json.loads(read_test_data("two_faqs.json"))["result"]
+    [faq1, faq2] = [FAQModel.from_json(faqd) for faqd in faqds]
+    fake_data_export.faqmatches.append(faqds[1])
+    with db.session() as session:
+        session.add(faq1)
+        session.commit()
+
+    opts = [
+        *("--db-url", db.engine.url),
+        *("--export-url", fake_data_export.base_url),
+        *("--export-token", "faketoken"),
+        *("--table", "faqmatches"),
+        "--prune",
+    ]
+
+    result = runner.invoke(aaq_sync, opts)
+    print(result.output)
+    assert result.exit_code == 0
+    assert db.fetch_faqs() == [faq2]
+
+    for opt in ["--async", "--incremental", "--commit-every=1"]:
+        result = runner.invoke(aaq_sync, [*opts, opt])
+        assert result.exit_code != 0
+        assert "--prune can't be used with" in result.output
+
+
+def test_sync_faqmatches_quarantine(runner, fake_data_export, db):
+    """
+    Invalid items can be quarantined instead of failing the sync.
+    """
+    faqds = json.loads(read_test_data("two_faqs.json"))["result"]
+    [faq1, faq2] = [FAQModel.from_json(faqd) for faqd in faqds]
+    bad = faqds[0] | {"faq_id": 3, "faq_weight": "heavy"}
+    fake_data_export.faqmatches.extend([*faqds, bad])
+
+    opts = [
+        *("--db-url", db.engine.url),
+        *("--export-url", fake_data_export.base_url),
+        *("--export-token", "faketoken"),
+        *("--table", "faqmatches"),
+    ]
+
+    result = runner.invoke(aaq_sync, opts)
+    assert result.exit_code != 0
+    assert db.fetch_faqs() == []
+
+    result = runner.invoke(aaq_sync, [*opts, "--quarantine"])
+    print(result.output)
+    assert result.exit_code == 0
+    assert db.fetch_faqs() == [faq1, faq2]
+    with db.session() as session:
+        [quarantined] = fetch_quarantined(session, FAQModel)
+    assert quarantined.item == bad
+
+    for opt in ["--async", "--commit-every=1", "--prune"]:
+        result = runner.invoke(aaq_sync, [*opts, "--quarantine", opt])
+        assert result.exit_code != 0
+        assert "--quarantine can't be used with" in result.output
+
+    result = runner.invoke(aaq_sync, [*opts, "--quarantine", "--core"])
+    assert result.exit_code != 0
+    assert "--core can't be used with --quarantine" in result.output
+
+
+def test_sync_faqmatches_core(runner, fake_data_export, db):
+    """
+    Syncs can use the core engine instead of the ORM.
+    """
+    faqds = json.loads(read_test_data("two_faqs.json"))["result"]
+    [faq1, faq2] = [FAQModel.from_json(faqd) for faqd in faqds]
+    fake_data_export.faqmatches.extend(faqds)
+
+    opts = [
+        *("--db-url", db.engine.url),
+        *("--export-url", fake_data_export.base_url),
+        *("--export-token", "faketoken"),
+        *("--table", "faqmatches"),
+        "--core",
+    ]
+
+    result = runner.invoke(aaq_sync, [*opts, "--lookup-batch-size", "1"])
+    print(result.output)
+    assert result.exit_code == 0
+    assert "Synced 2 faqmatches items." in result.output
+    assert db.fetch_faqs() == [faq1, faq2]
+
+    result = runner.invoke(aaq_sync, [*opts, "--parallel-tables"])
+    assert result.exit_code == 0
+    assert "Synced 0 faqmatches items." in result.output
+
+    result = runner.invoke(aaq_sync, [*opts, "--incremental", "--use-digests"])
+    assert result.exit_code != 0
+    assert "--core can't be used with --incremental, --use-digests" in result.output
+
+
+def test_sync_faqmatches_insert_copy(runner, fake_data_export, db):
+    """
+    New items can be inserted with COPY.
+    """
+    faqds = json.loads(read_test_data("two_faqs.json"))["result"]
+    [faq1, faq2] = [FAQModel.from_json(faqd) for faqd in faqds]
+    fake_data_export.faqmatches.extend(faqds)
+
+    opts = [
+        *("--db-url", db.engine.url),
+        *("--export-url", fake_data_export.base_url),
+        *("--export-token", "faketoken"),
+        *("--table", "faqmatches"),
+        *("--insert-method", "copy"),
+    ]
+
+    result = runner.invoke(aaq_sync, opts)
+    print(result.output)
+    assert result.exit_code == 0
+    assert "Synced 2 faqmatches items." in result.output
+    assert db.fetch_faqs() == [faq1, faq2]
+
+
+def test_sync_faqmatches_on_conflict_update(runner, fake_data_export, db):
+    """
+    Changed items can be updated instead of causing an error.
+    """
+    faqds = json.loads(read_test_data("two_faqs.json"))["result"]
+    db.faq_json_to_db("two_faqs.json")
+    faqds[1] = faqds[1] | {"faq_title": "Changed"}
+    [faq1, faq2] = [FAQModel.from_json(faqd) for faqd in faqds]
+    fake_data_export.faqmatches.extend(faqds)
+
+    opts = [
+        *("--db-url", db.engine.url),
+        *("--export-url", fake_data_export.base_url),
+        *("--export-token", "faketoken"),
+        *("--table", "faqmatches"),
+    ]
+
+    result = runner.invoke(aaq_sync, opts)
+    assert result.exit_code != 0
+    assert "already exists with different value" in str(result.exception)
+
+    result = runner.invoke(aaq_sync, [*opts, *("--on-conflict", "update")])
+    print(result.output)
+    assert result.exit_code == 0
+    assert "Synced 1 faqmatches items." in result.output
+    assert db.fetch_faqs() == [faq1, faq2]
+
+
+def test_sync_faqmatches_use_digests(runner, fake_data_export, db):
+    """
+    New items can be compared against stored content digests.
+    """
+    faqds = json.loads(read_test_data("two_faqs.json"))["result"]
+    [faq1, faq2] = [FAQModel.from_json(faqd) for faqd in faqds]
+    fake_data_export.faqmatches.extend(faqds)
+
+    opts = [
+        *("--db-url", db.engine.url),
+        *("--export-url", fake_data_export.base_url),
+        *("--export-token", "faketoken"),
+        *("--table", "faqmatches"),
+        "--use-digests",
+    ]
+
+    result = runner.invoke(aaq_sync, opts)
+    print(result.output)
+    assert result.exit_code == 0
+    assert "Synced 2 faqmatches items." in result.output
+
+    result = runner.invoke(aaq_sync, opts)
+    print(result.output)
+    assert result.exit_code == 0
+    assert "Synced 0 faqmatches items." in result.output
+    assert db.fetch_faqs() == [faq1, faq2]
+
+
+def test_sync_faqmatches_stream(runner, fake_data_export, db):
+    """
+    Export pages can be parsed as they're streamed.
+    """
+    faqds = json.loads(read_test_data("two_faqs.json"))["result"]
+    [faq1, faq2] = [FAQModel.from_json(faqd) for faqd in faqds]
+    fake_data_export.faqmatches.extend(faqds)
+
+    opts = [
+        *("--db-url", db.engine.url),
+        *("--export-url", fake_data_export.base_url),
+        *("--export-token", "faketoken"),
+        *("--table", "faqmatches"),
+        "--stream",
+    ]
+
+    result = runner.invoke(aaq_sync, opts)
+    print(result.output)
+    assert result.exit_code == 0
+    assert db.fetch_faqs() == [faq1, faq2]
+
+    # Streamed pages are fetched one at a time.
+    result = runner.invoke(aaq_sync, [*opts, "--prefetch-pages", "2"])
+    assert result.exit_code == 2
+    assert "--stream can't be used with --prefetch-pages" in result.output
+
+
+def test_sync_faqmatches_http_options(runner, fake_data_export, db, httpx_mock):
+    """
+    The export API's HTTP client can be configured, and asks for compressed
+    responses unless told not to.
+    """
+    faqds = json.loads(read_test_data("two_faqs.json"))["result"]
+    [faq1, faq2] = [FAQModel.from_json(faqd) for faqd in faqds]
+    fake_data_export.faqmatches.extend(faqds)
+    fake_data_export.use_gzip = True
+
+    opts = [
+        *("--db-url", db.engine.url),
+        *("--export-url", fake_data_export.base_url),
+        *("--export-token", "faketoken"),
+        *("--table", "faqmatches"),
+        *("--max-connections", "4"),
+        *("--max-keepalive-connections", "2"),
+        *("--keepalive-expiry", "1"),
+        *("--http-timeout", "10"),
+        *("--retries", "2"),
+        *("--retry-backoff", "0.1"),
+    ]
+
+    result = runner.invoke(aaq_sync, opts)
+    print(result.output)
+    assert result.exit_code == 0
+    assert db.fetch_faqs() == [faq1, faq2]
+    [req] = httpx_mock.get_requests()
+    assert "gzip" in req.headers["Accept-Encoding"]
+
+    result = runner.invoke(aaq_sync, [*opts, "--no-compression"])
+    print(result.output)
+    assert result.exit_code == 0
+    [_, req] = httpx_mock.get_requests()
+    assert req.headers["Accept-Encoding"] == "identity"
+
+
+def test_sync_faqmatches_http2_unavailable(runner, monkeypatch):
+    """
+    HTTP/2 needs an optional package.
+    """
+    monkeypatch.setattr("aaq_sync.transport.http2_available", lambda: False)
+    opts = [*OPTS_DB, *OPTS_EXPORT, *OPTS_TABLE, "--http2"]
+    result = runner.invoke(aaq_sync, opts)
+    assert result.exit_code == 2
+    assert "--http2 needs the h2 package" in result.output
+
+
+def test_sync_faqmatches_adaptive_paging(runner, fake_data_export, db):
+    """
+    Export page sizes can be chosen adaptively.
+    """
+    faqds = json.loads(read_test_data("two_faqs.json"))["result"]
+    [faq1, faq2] = [FAQModel.from_json(faqd) for faqd in faqds]
+    fake_data_export.faqmatches.extend(faqds)
+
+    opts = [
+        *("--db-url", db.engine.url),
+        *("--export-url", fake_data_export.base_url),
+        *("--export-token", "faketoken"),
+        *("--table", "faqmatches"),
+        "--adaptive-paging",
+        *("--target-page-seconds", "0.5"),
+    ]
+
+    result = runner.invoke(aaq_sync, opts)
+    print(result.output)
+    assert result.exit_code == 0
+    assert db.fetch_faqs() == [faq1, faq2]
+
+    # Each page's size depends on the previous ones, so they're fetched one at
+    # a time and not streamed.
+    for opt in ["--stream", "--prefetch-pages=2"]:
+        result = runner.invoke(aaq_sync, [*opts, opt])
+        assert result.exit_code == 2
+        assert "--adaptive-paging can't be used with" in result.output
+
+
+def test_sync_faqmatches_page_cache(runner, fake_data_export, db, tmp_path):
+    """
+    Export pages can be cached on disk.
+    """
+    faqds = json.loads(read_test_data("two_faqs.json"))["result"]
+    [faq1, faq2] = [FAQModel.from_json(faqd) for faqd in faqds]
+    fake_data_export.faqmatches.extend(faqds)
+
+    opts = [
+        *("--db-url", db.engine.url),
+        *("--export-url", fake_data_export.base_url),
+        *("--export-token", "faketoken"),
+        *("--table", "faqmatches"),
+        *("--page-cache", tmp_path / "pages.db"),
+        *("--page-cache-max-age", "60"),
+    ]
+
+    result = runner.invoke(aaq_sync, opts)
+    print(result.output)
+    assert result.exit_code == 0
+    assert db.fetch_faqs() == [faq1, faq2]
+
+    # The second run uses the cached page without asking the server.
+    result = runner.invoke(aaq_sync, opts)
+    assert result.exit_code == 0
+    assert len(fake_data_export.mock.get_requests()) == 1
+
+    # Only whole pages are cached, so streamed pages can't be.
+    result = runner.invoke(aaq_sync, [*opts, "--stream"])
+    assert result.exit_code == 2
+    assert "--page-cache can't be used with --stream" in result.output
+
+
+def test_sync_faqmatches_interval(runner, fake_data_export, db):
+    """
+    Tables can be synced repeatedly until we get SIGTERM.
+    """
+    faqds = json.loads(read_test_data("two_faqs.json"))["result"]
+    [faq1, faq2] = [FAQModel.from_json(faqd) for faqd in faqds]
+    fake_data_export.faqmatches.extend(faqds)
+
+    opts = [
+        *("--db-url", db.engine.url),
+        *("--export-url", fake_data_export.base_url),
+        *("--export-token", "faketoken"),
+        *("--table", "faqmatches"),
+        *("--interval", "0.1"),
+        *("--jitter", "0"),
+    ]
+
+    def stop_after_syncs():
+        while len(fake_data_export.mock.get_requests()) < 3:
+            time.sleep(0.01)
+        os.kill(os.getpid(), signal.SIGTERM)
+
+    stopper = threading.Thread(target=stop_after_syncs)
+    stopper.start()
+    result = runner.invoke(aaq_sync, opts)
+    stopper.join()
+    print(result.output)
+    assert result.exit_code == 0
+    assert result.output.count("Synced 0 faqmatches items.") >= 2
+    assert result.output.endswith("Stopped.\n")
+    assert db.fetch_faqs() == [faq1, faq2]
+    # Our signal handler has been removed.
+    assert signal.getsignal(signal.SIGTERM) == signal.SIG_DFL
+
+
+def test_sync_faqmatches_interval_failure(runner, fake_data_export, db):
+    """
+    Failures while syncing repeatedly are reported without stopping.
+    """
+    fake_data_export.token = "goodtoken"  # noqa: S105 (Not a real token.)
+
+    opts = [
+        *("--db-url", db.engine.url),
+        *("--export-url", fake_data_export.base_url),
+        *("--export-token", "badtoken"),
+        *("--table", "faqmatches"),
+        *("--interval", "0.1"),
+    ]
+
+    def stop_after_syncs():
+        while len(fake_data_export.mock.get_requests()) < 2:
+            time.sleep(0.01)
+        os.kill(os.getpid(), signal.SIGTERM)
+
+    stopper = threading.Thread(target=stop_after_syncs)
+    stopper.start()
+    result = runner.invoke(aaq_sync, opts)
+    stopper.join()
+    print(result.output)
+    assert result.exit_code == 0
+    assert result.output.count("Failed to sync faqmatches: Client error") >= 2
+
+    result = runner.invoke(aaq_sync, [*opts, "--parallel-tables"])
+    assert result.exit_code != 0
+    assert "can't be used with --interval" in result.output
+
+
+def test_sync_faqmatches_metrics(runner, fake_data_export, db, tmp_path):
+    """
+    Sync metrics can be written as JSON and in the Prometheus text format.
+    """
+    faqds = json.loads(read_test_data("two_faqs.json"))["result"]
+    fake_data_export.faqmatches.extend(faqds)
+    json_path = tmp_path / "metrics.json"
+    prom_path = tmp_path / "metrics.prom"
+
+    opts = [
+        *("--db-url", db.engine.url),
+        *("--export-url", fake_data_export.base_url),
+        *("--export-token", "faketoken"),
+        *("--table", "faqmatches"),
+    ]
+
+    result = runner.invoke(aaq_sync, [*opts, "--metrics-json", json_path])
+    print(result.output)
+    assert result.exit_code == 0
+    report = json.loads(json_path.read_text())["tables"]["faqmatches"]
+    assert report["counters"]["rows_inserted"] == 2
+    assert not prom_path.exists()
+
+    result = runner.invoke(aaq_sync, [*opts, "--metrics-prometheus", prom_path])
+    assert result.exit_code == 0
+    prom_text = prom_path.read_text()
+    assert 'aaq_sync_rows_skipped_total{table="faqmatches"} 2' in prom_text
+    assert 'aaq_sync_page_latency_seconds_count{table="faqmatches"} 1' in prom_text
+
+    result = runner.invoke(aaq_sync, [*opts, "--async", "--metrics-json", json_path])
+    assert result.exit_code != 0
+    assert "--async doesn't support metrics" in result.output
+
+
+def test_default_command(runner, fake_data_export, db):
+    """
+    The sync command runs if no other command is given.
+    """
+    fake_data_export.faqmatches.extend(
+        json.loads(read_test_data("two_faqs.json"))["result"]
+    )
+    opts = [
+        *("--db-url", db.engine.url),
+        *("--export-url", fake_data_export.base_url),
+        *("--export-token", "faketoken"),
+        *("--table", "faqmatches"),
+    ]
+
+    result = runner.invoke(main, opts)
+    print(result.output)
+    assert result.exit_code == 0
+    assert "Synced 2 faqmatches items." in result.output
+
+    result = runner.invoke(main, ["sync", *opts])
+    assert result.exit_code == 0
+    assert "Synced 0 faqmatches items." in result.output
+
+    result = runner.invoke(main, [])
+    assert "Missing option '--db-url'" in result.output
+
+    result = runner.invoke(main, ["--help"])
+    assert result.exit_code == 0
+    assert all(cmd in result.output for cmd in ["sync", "dump", "load"])
+
+
+def test_dump_and_load(runner, fake_data_export, db, tmp_path, monkeypatch):
+    """
+    Tables can be dumped to a snapshot file and loaded into several databases
+    without using the export API again.
+    """
+    faqds = json.loads(read_test_data("two_faqs.json"))["result"]
+    faqs = [FAQModel.from_json(faqd) for faqd in faqds]
+    fake_data_export.faqmatches.extend(faqds)
+    snapshot = tmp_path / "faqs.aaqs"
+    sqlite_engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    Base.metadata.create_all(sqlite_engine)
+    sqlite_db = Database(sqlite_engine)
+    monkeypatch.setenv("AAQ_SYNC_EXPORT_TOKEN", "faketoken")
+
+    result = runner.invoke(
+        main,
+        [
+            "dump",
+            *("--export-url", fake_data_export.base_url),
+            *("--table", "faqmatches"),
+            *("--to-file", snapshot),
+        ],
+    )
+    print(result.output)
+    assert result.exit_code == 0
+    assert result.output == "Dumped 2 faqmatches items.\n"
+
+    load_opts = [
+        "load",
+        *("--db-url", db.url_with_password),
+        *("--db-url", sqlite_engine.url),
+        *("--from-file", snapshot),
+    ]
+    result = runner.invoke(main, load_opts)
+    print(result.output)
+    assert result.exit_code == 0
+    assert result.output.count("Loaded 2 faqmatches items into") == 2
+    assert db.fetch_faqs() == faqs
+    assert sqlite_db.fetch_faqs() == faqs
+
+    result = runner.invoke(main, [*load_opts, "--table", "faqmatches"])
+    assert result.exit_code == 0
+    assert result.output.count("Loaded 0 faqmatches items into") == 2
+    assert len(fake_data_export.mock.get_requests()) == 1
+
+    empty_snapshot = tmp_path / "empty.aaqs"
+    write_snapshot(empty_snapshot, [])
+    result = runner.invoke(
+        main, [*load_opts[:-1], empty_snapshot, "--table", "faqmatches"]
+    )
+    assert result.exit_code != 0
+    assert "Not in" in result.output
+    assert "empty.aaqs: faqmatches" in result.output
@@ -0,0 +1,172 @@
+import json
+from typing import Any
+
+import pytest
+from httpx import URL
+from sqlalchemy import create_engine
+from sqlalchemy.orm import DeclarativeBase, Mapped, Session, mapped_column
+
+from aaq_sync.core_sync import (
+    core_sync_model_items,
+    fetch_existing_rows,
+    row_pkey,
+    row_translator,
+    row_type,
+    store_new_rows,
+)
+from aaq_sync.data_export_client import ExportClient
+from aaq_sync.data_models import Base, FAQModel, ValidationError
+from aaq_sync.metrics import SyncMetrics
+from aaq_sync.sync_state import get_checkpoint, set_checkpoint
+
+from .fake_data_export import FakeDataExport
+from .helpers import Database, read_test_data
+
+
+@pytest.fixture()
+def db(dbengine):
+    Base.metadata.create_all(dbengine)
+    return Database(dbengine)
+
+
+@pytest.fixture()
+def sqlite_db(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}", echo=False)
+    Base.metadata.create_all(engine)
+    return Database(engine)
+
+
+@pytest.fixture(params=["postgresql", "sqlite"])
+def any_db(request):
+    return request.getfixturevalue(
+        {"postgresql": "db", "sqlite": "sqlite_db"}[request.param]
+    )
+
+
+@pytest.fixture()
+def fake_data_export(httpx_mock):
+    return FakeDataExport(URL("https://127.0.0.100:1234/"), httpx_mock)
+
+
+def faq_dicts() -> list[dict]:
+    return json.loads(read_test_data("two_faqs.json"))["result"]
+
+
+def test_row_translator():
+    """
+    Export JSON is translated into compact row tuples with the same values as
+    model instances, and repeated strings are interned.
+    """
+    [faq1d, faq2d] = faq_dicts()
+    # Rows have a namedtuple type that mypy doesn't know about.
+    translate: Any = row_translator(FAQModel)
+    row = translate(faq1d)
+
+    assert type(row) is row_type(FAQModel)
+    assert not hasattr(row, "__dict__")
+    assert row == FAQModel.from_json(faq1d).column_values()
+    assert row.faq_id == 1
+    assert row_pkey(FAQModel)(row) == 1
+
+    # Separately decoded strings are different objects until they're interned.
+    [copy1d, _] = faq_dicts()
+    copy1d["faq_tags"] = ["rabbit", *copy1d["faq_tags"]]
+    faq2d["faq_tags"] = ["rabbit"]
+    assert faq1d["faq_author"] is not copy1d["faq_author"]
+    [copy1, row2] = [translate(d) for d in [copy1d, faq2d]]
+    assert copy1.faq_author is row.faq_author
+    assert copy1.faq_tags[0] is row2.faq_tags[0]
+    assert translate(faq2d | {"faq_tags": None}).faq_tags is None
+
+    with pytest.raises(
+        ValidationError, match="Extra keys in JSON for faqmatches: x, y"
+    ):
+        translate(faq1d | {"x": 1, "y": 2})
+    match = "faq_weight has type str, expected int; Extra keys .* faqmatches: x"
+    with pytest.raises(ValidationError, match=match):
+        translate(faq1d | {"faq_weight": "heavy", "x": 1})
+
+
+def test_composite_pkey_rows(dbengine):
+    """
+    Rows with composite pkeys can be looked up by pkey.
+    """
+
+    class CompositeBase(DeclarativeBase):
+        pass
+
+    class Pair(CompositeBase):
+        __tablename__ = "pairs"
+        a: Mapped[int] = mapped_column(primary_key=True)
+        b: Mapped[int] = mapped_column(primary_key=True)
+        c: Mapped[str]
+
+    CompositeBase.metadata.create_all(dbengine)
+    pkey = row_pkey(Pair)  # type: ignore
+    assert pkey(row_type(Pair)(1, 2, "x")) == (1, 2)  # type: ignore
+    with Session(dbengine) as session:
+        session.add_all([Pair(a=1, b=1, c="x"), Pair(a=1, b=2, c="y")])
+        session.commit()
+        rows = fetch_existing_rows(Pair, session, [(1, 2), (2, 1)])  # type: ignore
+        assert list(rows) == [(1, 2, "y")]
+
+
+def test_store_new_rows(any_db):
+    """
+    New rows are stored a batch at a time, and existing rows are skipped or
+    must be unchanged.
+    """
+    # Rows have a namedtuple type that mypy doesn't know about.
+    translate: Any = row_translator(FAQModel)
+    [row1, row2] = [translate(d) for d in faq_dicts()]
+    row3 = translate(faq_dicts()[0] | {"faq_id": 3})
+    [faq1, faq2, faq3] = [FAQModel(**row._asdict()) for row in [row1, row2, row3]]
+
+    with any_db.session() as session:
+        assert store_new_rows(FAQModel, session, []) == []
+        assert store_new_rows(FAQModel, session, [row1, row1]) == [row1]
+        session.commit()
+    assert any_db.fetch_faqs() == [faq1]
+
+    with any_db.session() as session:
+        news = [row1, row2, row3, row3]
+        assert store_new_rows(FAQModel, session, news, batch_size=2) == [row2, row3]
+        session.commit()
+    assert any_db.fetch_faqs() == [faq1, faq2, faq3]
+
+    row3c = row3._replace(faq_title="New")
+    match = r"already exists with different value: FAQModel\(3,\)"
+    with any_db.session() as session, pytest.raises(ValueError, match=match):
+        store_new_rows(FAQModel, session, [row1, row3c])
+
+
+def test_core_sync_model_items(fake_data_export, db):
+    """
+    New items from the export API are stored in the db without creating ORM
+    instances.
+    """
+    [faq1d, faq2d] = faq_dicts()
+    [faq1, faq2] = [FAQModel.from_json(d) for d in [faq1d, faq2d]]
+    fake_data_export.faqmatches.append(faq1d)
+    metrics = SyncMetrics()
+
+    with ExportClient(fake_data_export.base_url, "token", metrics=metrics) as ec:
+        with db.session() as session:
+            stored = core_sync_model_items(FAQModel, ec, session, metrics=metrics)
+            assert stored == [faq1.column_values()]
+        assert db.fetch_faqs() == [faq1]
+
+        fake_data_export.faqmatches.append(faq2d)
+        with db.session() as session:
+            set_checkpoint(session, FAQModel, 1)
+            session.commit()
+        with db.session() as session:
+            stored = core_sync_model_items(FAQModel, ec, session, batch_size=1)
+            assert stored == [faq2.column_values()]
+            # A completed sync clears any checkpoint left by a failed one.
+            assert get_checkpoint(session, FAQModel) is None
+        assert db.fetch_faqs() == [faq1, faq2]
+
+    report = metrics.report()["tables"]["faqmatches"]
+    assert report["counters"]["rows_inserted"] == 1
+    assert {"filter_existing", "store_new", "commit"} <= report["stages"].keys()
@@ -2,8 +2,15 @@ import json
 from datetime import datetime
 
 import pytest
+from sqlalchemy import Column, Integer, MetaData, Table, inspect
 
-from aaq_sync.data_models import Base, FAQModel, get_models
+from aaq_sync.data_models import (
+    Base,
+    FAQModel,
+    ValidationError,
+    _untranslate_json_field,
+    get_models,
+)
 
 from .helpers import Database, read_test_data
 
@@ -82,18 +89,168 @@ def test_faq_from_json(db):
 def test_faq_from_json_validation():
     """
     When loading data from JSON, various invalid inputs are detected.
-
-    TODO: Better validation in the code under test.
     """
     faq_json = json.loads(read_test_data("two_faqs.json"))["result"][0]
 
-    with pytest.raises(KeyError):
+    with pytest.raises(ValidationError, match="faq_id is missing; faq_added_utc"):
         FAQModel.from_json({})
 
     extra_match = r"Extra keys .* faqmatches: another, extra"
-    with pytest.raises(ValueError, match=extra_match):
+    with pytest.raises(ValidationError, match=extra_match):
         FAQModel.from_json(faq_json | {"extra": "field", "another": 1})
 
     type_match = r"faq_id has type str, expected int"
-    with pytest.raises(TypeError, match=type_match):
+    with pytest.raises(ValidationError, match=type_match):
         FAQModel.from_json(faq_json | {"faq_id": "superego"})
+
+    type_match = r"faq_updated_utc has type str, expected datetime"
+    with pytest.raises(ValidationError, match=type_match):
+        FAQModel.from_json(faq_json | {"faq_updated_utc": "yesterday"})
+
+    type_match = r"faq_title has type NoneType, expected str"
+    with pytest.raises(ValidationError, match=type_match):
+        FAQModel.from_json(faq_json | {"faq_title": None})
+
+    type_match = r"faq_tags has type str, expected list"
+    with pytest.raises(ValidationError, match=type_match):
+        FAQModel.from_json(faq_json | {"faq_tags": "tag"})
+
+    # All the problems are reported at once.
+    bad_json = faq_json | {"faq_id": "superego", "faq_title": None, "extra": 1}
+    del bad_json["faq_weight"]
+    with pytest.raises(ValidationError) as errinfo:
+        FAQModel.from_json(bad_json)
+    [invalid] = errinfo.value.invalid
+    assert invalid.item == bad_json
+    assert invalid.errors == [
+        "faq_id has type str, expected int",
+        "faq_title has type NoneType, expected str",
+        "faq_weight is missing",
+        "Extra keys in JSON for faqmatches: extra",
+    ]
+
+
+def test_faq_from_json_many():
+    """
+    We can translate many JSON items at once.
+    """
+    faq_dicts = json.loads(read_test_data("two_faqs.json"))["result"]
+
+    assert FAQModel.from_json_many([]) == []
+    faqs = FAQModel.from_json_many(faq_dicts)
+    assert faqs == [FAQModel.from_json(faqd) for faqd in faq_dicts]
+
+    extra_match = r"Extra keys .* faqmatches: extra"
+    with pytest.raises(ValidationError, match=extra_match):
+        FAQModel.from_json_many([faq_dicts[0], faq_dicts[1] | {"extra": "field"}])
+
+    more_match = r"faq_id has type str, expected int \(and 1 more invalid items\)"
+    with pytest.raises(ValidationError, match=more_match):
+        FAQModel.from_json_many([faqd | {"faq_id": "x"} for faqd in faq_dicts])
+
+
+def test_faq_validate_many():
+    """
+    A page of items is validated as a whole, and the invalid items are
+    returned separately along with all their errors.
+    """
+    [faqd1, faqd2] = json.loads(read_test_data("two_faqs.json"))["result"]
+    bad1 = faqd1 | {"faq_id": 3, "faq_weight": 1.5}
+    bad2 = faqd2 | {"faq_id": 4, "faq_added_utc": 10**20, "extra": "field"}
+
+    assert FAQModel.validate_many([]) == ([], [])
+    items, invalid = FAQModel.validate_many([bad1, faqd1, bad2, faqd2])
+    assert items == FAQModel.from_json_many([faqd1, faqd2])
+    assert invalid == [
+        (bad1, ["faq_weight has type float, expected int"]),
+        (
+            bad2,
+            [
+                "faq_added_utc timestamp is out of range",
+                "Extra keys in JSON for faqmatches: extra",
+            ],
+        ),
+    ]
+
+
+def test_faq_watermark():
+    """
+    FAQs use their last update time as an incremental sync watermark, which we
+    can get in its JSON representation.
+    """
+    faq_json = json.loads(read_test_data("two_faqs.json"))["result"][0]
+    faq = FAQModel.from_json(faq_json)
+
+    assert FAQModel.watermark_column() is FAQModel.__table__.c.faq_updated_utc
+    assert faq.watermark_json_value() == faq_json["faq_updated_utc"]
+
+
+def test_watermark_fallback():
+    """
+    Models without an explicit watermark column use their primary key.
+    """
+    table = Table("things", MetaData(), Column("id", Integer, primary_key=True))
+
+    class Things:
+        __table__ = table
+
+    # We don't want to register a new model, so we call the classmethod's
+    # underlying function on a plain class with a table.
+    assert Base.watermark_column.__func__(Things) is table.c.id  # type: ignore
+
+
+def test_untranslate_json_field():
+    """
+    Translating fields back to JSON is the inverse of translating from JSON.
+    """
+    faq_json = json.loads(read_test_data("two_faqs.json"))["result"][0]
+    faq = FAQModel.from_json(faq_json)
+
+    for col in FAQModel.__table__.columns:
+        value = getattr(faq, col.name)
+        assert _untranslate_json_field(value) == faq_json[col.name]
+
+
+def test_faq_content_digest():
+    """
+    FAQs have a stable content digest that changes when any column does.
+    """
+    [faqd1, faqd2] = json.loads(read_test_data("two_faqs.json"))["result"]
+    faq1 = FAQModel.from_json(faqd1)
+
+    digest = faq1.content_digest()
+    assert len(digest) == 16
+    assert FAQModel.from_json(faqd1).content_digest() == digest
+    assert FAQModel.from_json(faqd2).content_digest() != digest
+
+    faq1.faq_questions = [*faq1.faq_questions, "Another question"]
+    assert faq1.content_digest() != digest
+
+
+def test_faq_column_values():
+    """
+    We can get the column values of an FAQ in column order.
+    """
+    faq_json = json.loads(read_test_data("two_faqs.json"))["result"][0]
+    faq = FAQModel.from_json(faq_json)
+
+    values = faq.column_values()
+    assert [c.name for c in FAQModel.__table__.columns][:2] == [
+        "faq_id",
+        "faq_added_utc",
+    ]
+    assert values[:2] == (1, datetime(2022, 4, 7, 13, 19, 21))
+    assert values == tuple(faq.to_row().values())
+
+
+def test_faq_clone():
+    """
+    A cloned FAQ is an equal but separate transient instance.
+    """
+    faq_json = json.loads(read_test_data("two_faqs.json"))["result"][0]
+    faq = FAQModel.from_json(faq_json)
+
+    clone = faq.clone()
+    assert clone == faq
+    assert clone is not faq
+    assert inspect(clone).transient
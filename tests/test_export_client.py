@@ -1,10 +1,16 @@
 import json
+import sys
 
 import pytest
-from httpx import URL, HTTPStatusError
+from httpx import URL, HTTPStatusError, MockTransport
+from pytest_httpx import HTTPXMock
 
-from aaq_sync.data_export_client import ExportClient
-from aaq_sync.data_models import FAQModel
+from aaq_sync.adaptive_paging import AdaptivePageSizer
+from aaq_sync.data_export_client import AsyncExportClient, ExportClient
+from aaq_sync.data_models import FAQModel, InvalidItem, ValidationError
+from aaq_sync.metrics import SyncMetrics
+from aaq_sync.page_cache import PageCache
+from aaq_sync.transport import HTTPOptions
 
 from .fake_data_export import FakeDataExport
 from .helpers import read_test_data
@@ -61,6 +67,19 @@ def test_export_client_faqmatches_paginated(fake_data_export):
         assert p3.items == []
 
 
+def test_export_client_page_body(fake_data_export):
+    """
+    The client can fetch a page's raw body without decoding it.
+    """
+    [faq1, faq2] = json.loads(read_test_data("two_faqs.json"))["result"]
+    fake_data_export.faqmatches.extend([faq1, faq2])
+
+    with ExportClient(fake_data_export.base_url, "token") as ec:
+        body = ec.get_page_body("faqmatches", limit=1, offset=1)
+        assert isinstance(body, bytes)
+        assert json.loads(body)["result"] == [faq2]
+
+
 def test_export_client_faqmatches_iter_page(fake_data_export):
     """
     A paginated response is an iterable over its own items.
@@ -87,6 +106,251 @@ def test_export_client_faqmatches_iter_all(fake_data_export):
         assert list(page.iter_all()) == [faq1, faq2]
 
 
+def test_export_client_faqmatches_iter_all_many_pages(fake_data_export):
+    """
+    Iterating over all pages doesn't recurse, so we can iterate over more pages
+    than the recursion limit allows.
+    """
+    [faq1, _] = json.loads(read_test_data("two_faqs.json"))["result"]
+    faqs = [faq1 | {"faq_id": i} for i in range(sys.getrecursionlimit() + 10)]
+    fake_data_export.faqmatches.extend(faqs)
+
+    with ExportClient(fake_data_export.base_url, "token") as ec:
+        page = ec.get_faqmatches(limit=1)
+        assert list(page.iter_all()) == faqs
+
+
+@pytest.mark.parametrize("prefetch_pages", [1, 2, 5])
+def test_export_client_faqmatches_prefetch(fake_data_export, prefetch_pages):
+    """
+    When prefetching pages, all items are still returned in order.
+    """
+    [faq1, _] = json.loads(read_test_data("two_faqs.json"))["result"]
+    faqs = [faq1 | {"faq_id": i} for i in range(13)]
+    fake_data_export.faqmatches.extend(faqs)
+
+    ec = ExportClient(fake_data_export.base_url, "token", prefetch_pages=prefetch_pages)
+    with ec:
+        page = ec.get_faqmatches(limit=3)
+        assert list(page.iter_all()) == faqs
+        # Five pages, plus at most prefetch_pages speculative requests past the
+        # last page.
+        assert 5 <= len(fake_data_export.mock.get_requests()) <= 5 + prefetch_pages
+
+
+def test_export_client_faqmatches_prefetch_stop_early(fake_data_export):
+    """
+    If we stop iterating before the last page, the outstanding page requests
+    are cleaned up.
+    """
+    [faq1, _] = json.loads(read_test_data("two_faqs.json"))["result"]
+    faqs = [faq1 | {"faq_id": i} for i in range(20)]
+    fake_data_export.faqmatches.extend(faqs)
+
+    with ExportClient(fake_data_export.base_url, "token", prefetch_pages=3) as ec:
+        items = ec.get_faqmatches(limit=2).iter_all()
+        assert [next(items) for _ in range(5)] == faqs[:5]
+        items.close()
+        assert len(fake_data_export.mock.get_requests()) <= 1 + 3 + 1
+
+
+def test_export_client_models_stream(fake_data_export):
+    """
+    The client can parse pages incrementally as they're streamed.
+    """
+    [faq1, faq2] = json.loads(read_test_data("two_faqs.json"))["result"]
+    faqs = [faq1 | {"faq_id": i} for i in range(5)]
+    fake_data_export.faqmatches.extend([*faqs, faq2])
+    models = [FAQModel.from_json(faq) for faq in [*faqs, faq2]]
+
+    with ExportClient(fake_data_export.base_url, "token", stream=True) as ec:
+        assert list(ec.get_model_items(FAQModel, limit=2)) == models
+        assert len(fake_data_export.mock.get_requests()) == 4
+
+        fake_data_export.faqmatches[:] = []
+        assert list(ec.get_model_items(FAQModel)) == []
+
+
+def test_export_client_models_adaptive(fake_data_export):
+    """
+    The client can choose page sizes adaptively, backing off after server
+    errors.
+    """
+    [faq1, _] = json.loads(read_test_data("two_faqs.json"))["result"]
+    faqs = [faq1 | {"faq_id": i} for i in range(20)]
+    fake_data_export.faqmatches.extend(faqs)
+    fake_data_export.max_limit = 6
+    models = [FAQModel.from_json(faq) for faq in faqs]
+
+    # Every page takes exactly one second.
+    ticks = iter(range(100))
+    sizer = AdaptivePageSizer(
+        min_limit=1,
+        initial_limit=2,
+        target_seconds=2.0,
+        clock=lambda: next(ticks),
+    )
+    with ExportClient(fake_data_export.base_url, "token", page_sizer=sizer) as ec:
+        assert list(ec.get_model_items(FAQModel)) == models
+
+    reqs = fake_data_export.mock.get_requests()
+    limits = [(int(r.url.params["offset"]), int(r.url.params["limit"])) for r in reqs]
+    # Pages double in size until they fail, then halve and start growing again.
+    assert limits == [(0, 2), (2, 4), (6, 8), (6, 4), (10, 8), (10, 4), (14, 8)] + [
+        (14, 4),
+        (18, 8),
+        (18, 4),
+    ]
+
+
+def test_export_client_page_sizer_per_table(fake_data_export):
+    """
+    Each table's page sizes are chosen separately, so tables synced one after
+    another (or at the same time) don't affect each other.
+    """
+    [faq1, _] = json.loads(read_test_data("two_faqs.json"))["result"]
+    fake_data_export.faqmatches.extend([faq1 | {"faq_id": i} for i in range(5)])
+
+    ticks = iter(range(100))
+    sizer = AdaptivePageSizer(
+        min_limit=1, initial_limit=2, target_seconds=2.0, clock=lambda: next(ticks)
+    )
+    with ExportClient(fake_data_export.base_url, "token", page_sizer=sizer) as ec:
+        list(ec.get_model_items(FAQModel))
+        faq_sizer = ec.page_sizer_for("faqmatches")
+        assert faq_sizer.limit == 8
+        assert ec.page_sizer_for("faqmatches") is faq_sizer
+        assert ec.page_sizer_for("other").limit == 2
+        assert sizer.limit == 2
+
+
+def test_export_client_models_adaptive_gives_up(fake_data_export):
+    """
+    If page requests keep failing, the client eventually gives up.
+    """
+    fake_data_export.max_limit = 0
+    sizer = AdaptivePageSizer(min_limit=1, initial_limit=4, max_retries=2)
+
+    with ExportClient(fake_data_export.base_url, "token", page_sizer=sizer) as ec:
+        with pytest.raises(HTTPStatusError) as errinfo:
+            list(ec.get_model_items(FAQModel))
+        assert errinfo.value.response.status_code == 503
+
+    reqs = fake_data_export.mock.get_requests()
+    assert [int(r.url.params["limit"]) for r in reqs] == [4, 2, 1]
+
+
+def test_export_client_page_cache(fake_data_export, tmp_path):
+    """
+    Cached pages are revalidated with their ETags, and only changed pages are
+    downloaded again.
+    """
+    [faq1, faq2] = json.loads(read_test_data("two_faqs.json"))["result"]
+    fake_data_export.faqmatches.extend([faq1, faq2])
+    fake_data_export.use_etags = True
+    cache = PageCache(tmp_path / "pages.db")
+
+    def get_items():
+        with ExportClient(fake_data_export.base_url, "tkn", page_cache=cache) as ec:
+            return list(ec.get_model_items(FAQModel, limit=1))
+
+    models = [FAQModel.from_json(faq) for faq in [faq1, faq2]]
+    assert get_items() == models
+    reqs = fake_data_export.mock.get_requests()
+    assert [r.headers.get("If-None-Match") for r in reqs] == [None, None, None]
+    assert fake_data_export.not_modified == 0
+
+    # Nothing has changed, so every page is revalidated.
+    assert get_items() == models
+    reqs = fake_data_export.mock.get_requests()[3:]
+    assert all(r.headers.get("If-None-Match") for r in reqs)
+    assert fake_data_export.not_modified == 3
+
+    # Only the changed page (and the new one after it) is downloaded again.
+    faq3 = faq2 | {"faq_id": 3}
+    fake_data_export.faqmatches.append(faq3)
+    assert get_items() == [*models, FAQModel.from_json(faq3)]
+    assert len(fake_data_export.mock.get_requests()) == 10
+    assert fake_data_export.not_modified == 5
+    cache.close()
+
+
+def test_export_client_page_cache_fresh(fake_data_export, tmp_path):
+    """
+    Fresh cached pages are used without making any requests, whether or not the
+    server sent validators for them.
+    """
+    [faq1, faq2] = json.loads(read_test_data("two_faqs.json"))["result"]
+    fake_data_export.faqmatches.extend([faq1, faq2])
+    cache = PageCache(tmp_path / "pages.db", max_age=3600)
+    models = [FAQModel.from_json(faq) for faq in [faq1, faq2]]
+
+    with ExportClient(fake_data_export.base_url, "tkn", page_cache=cache) as ec:
+        assert list(ec.get_model_items(FAQModel)) == models
+        assert len(fake_data_export.mock.get_requests()) == 1
+        assert list(ec.get_model_items(FAQModel)) == models
+        assert len(fake_data_export.mock.get_requests()) == 1
+
+    # Once they're stale, pages without validators are downloaded again.
+    cache.max_age = 0
+    with ExportClient(fake_data_export.base_url, "tkn", page_cache=cache) as ec:
+        assert list(ec.get_model_items(FAQModel)) == models
+    reqs = fake_data_export.mock.get_requests()
+    assert len(reqs) == 2
+    assert "If-None-Match" not in reqs[1].headers
+    cache.close()
+
+
+def test_export_client_page_cache_error(fake_data_export, tmp_path):
+    """
+    Errors aren't cached.
+    """
+    fake_data_export.token = "right"  # noqa: S105
+    cache = PageCache(tmp_path / "pages.db")
+
+    ec = ExportClient(fake_data_export.base_url, "wrong", page_cache=cache)
+    with ec, pytest.raises(HTTPStatusError):
+        list(ec.get_model_items(FAQModel))
+    assert cache.total_bytes() == 0
+    cache.close()
+
+
+@pytest.mark.parametrize(
+    ("client_kw", "page_kw"),
+    [
+        ({}, {"limit": 2}),
+        ({"stream": True}, {"limit": 2}),
+        ({"page_sizer": AdaptivePageSizer(initial_limit=2)}, {}),
+    ],
+)
+def test_export_client_models_validated(fake_data_export, client_kw, page_kw):
+    """
+    If asked to, the client validates whole pages and passes invalid items to
+    a callback instead of failing.
+    """
+    [faq1, faq2] = json.loads(read_test_data("two_faqs.json"))["result"]
+    [faqm1, faqm2] = [FAQModel.from_json(faq) for faq in [faq1, faq2]]
+    bad1 = faq1 | {"faq_id": 3, "faq_weight": "heavy"}
+    bad2 = faq2 | {"faq_id": 4, "faq_tags": "tag"}
+    fake_data_export.faqmatches.extend([bad1, faq1, faq2, bad2])
+    metrics = SyncMetrics()
+    invalid: list[InvalidItem] = []
+
+    ec = ExportClient(fake_data_export.base_url, "t", metrics=metrics, **client_kw)
+    with ec:
+        with pytest.raises(ValidationError, match="faq_weight has type str"):
+            list(ec.get_model_items(FAQModel, **page_kw))
+        items = ec.get_model_items(FAQModel, on_invalid=invalid.extend, **page_kw)
+        assert list(items) == [faqm1, faqm2]
+
+    assert invalid == [
+        (bad1, ["faq_weight has type str, expected int"]),
+        (bad2, ["faq_tags has type str, expected list"]),
+    ]
+    counters = metrics.report()["tables"]["faqmatches"]["counters"]
+    assert counters["rows_invalid"] == 2
+
+
 def test_export_client_auth(fake_data_export):
     """
     The client properly sends the given authentication token.
@@ -100,6 +364,11 @@ def test_export_client_auth(fake_data_export):
             ec.get_faqmatches()
         assert errinfo.value.response.status_code == 401
 
+    with ExportClient(fake_data_export.base_url, "badtoken", stream=True) as ec:
+        with pytest.raises(HTTPStatusError) as errinfo:
+            next(ec.get_model_items(FAQModel))
+        assert errinfo.value.response.status_code == 401
+
 
 def test_export_client_models(fake_data_export):
     """
@@ -120,3 +389,162 @@ def test_export_client_models(fake_data_export):
         fake_data_export.faqmatches.append(faq2)
         two = list(ec.get_model_items(FAQModel))
         assert two == [faqm1, faqm2]
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_export_client_metrics(fake_data_export, stream):
+    """
+    The client records metrics for the pages and rows it fetches.
+    """
+    [faq1, faq2] = json.loads(read_test_data("two_faqs.json"))["result"]
+    fake_data_export.faqmatches.extend([faq1, faq2, faq1 | {"faq_id": 3}])
+    metrics = SyncMetrics()
+    ec = ExportClient(fake_data_export.base_url, "t", stream=stream, metrics=metrics)
+
+    with ec:
+        assert len(list(ec.get_model_items(FAQModel, limit=2))) == 3
+
+    report = metrics.report()["tables"]["faqmatches"]
+    assert report["counters"]["pages_fetched"] == 2
+    assert report["counters"]["rows_fetched"] == 3
+    assert report["counters"]["bytes_received"] > 0
+    assert report["stages"]["http"]["rows"] == 3
+    assert report["stages"]["from_json"]["rows"] == 3
+    if stream:
+        # Streamed pages are parsed as they arrive.
+        assert "json_decode" not in report["stages"]
+        assert report["histograms"] == {}
+    else:
+        assert report["stages"]["json_decode"]["rows"] == 3
+        assert report["histograms"]["page_latency_seconds"]["count"] == 2
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_export_client_compression(fake_data_export, httpx_mock, stream):
+    """
+    The client asks for compressed responses and decodes them, unless told not
+    to.
+    """
+    [faq1, faq2] = json.loads(read_test_data("two_faqs.json"))["result"]
+    [faqm1, faqm2] = [FAQModel.from_json(faq) for faq in [faq1, faq2]]
+    fake_data_export.faqmatches.extend([faq1, faq2])
+    fake_data_export.use_gzip = True
+
+    with ExportClient(fake_data_export.base_url, "token", stream=stream) as ec:
+        assert list(ec.get_model_items(FAQModel)) == [faqm1, faqm2]
+    [req] = httpx_mock.get_requests()
+    assert req.headers["Accept-Encoding"] == "gzip, deflate"
+
+    http = HTTPOptions(encodings=[])
+    ec = ExportClient(fake_data_export.base_url, "token", stream=stream, http=http)
+    with ec:
+        assert list(ec.get_model_items(FAQModel)) == [faqm1, faqm2]
+    [_, req] = httpx_mock.get_requests()
+    assert req.headers["Accept-Encoding"] == "identity"
+
+
+def test_export_client_retries():
+    """
+    The client retries throttled requests if it's configured to, and otherwise
+    fails.
+    """
+    [faq1, faq2] = json.loads(read_test_data("two_faqs.json"))["result"]
+    # The HTTPX mock replaces the client's transport, so we can't use it here.
+    fake = FakeDataExport(URL("https://127.0.0.100:1234/"), HTTPXMock())
+    fake.faqmatches.extend([faq1, faq2])
+    fake.throttle = 2
+    fake.retry_after = "0"
+    transport = MockTransport(fake.handle_request)
+
+    with ExportClient(fake.base_url, "token", transport=transport) as ec:
+        with pytest.raises(HTTPStatusError) as errinfo:
+            ec.get_faqmatches()
+        assert errinfo.value.response.status_code == 429
+
+    http = HTTPOptions(retries=1, backoff=0)
+    with ExportClient(fake.base_url, "t", transport=transport, http=http) as ec:
+        assert ec.get_faqmatches().items == [faq1, faq2]
+    assert fake.throttle == 0
+
+
+@pytest.mark.anyio()
+async def test_async_export_client_models(fake_data_export):
+    """
+    Given a model class, the async client fetches all items as instances of
+    that model.
+    """
+    [faq1, faq2] = json.loads(read_test_data("two_faqs.json"))["result"]
+    [faqm1, faqm2] = [FAQModel.from_json(faq) for faq in [faq1, faq2]]
+
+    async with AsyncExportClient(fake_data_export.base_url, "token") as ec:
+        empty = [item async for item in ec.get_model_items(FAQModel)]
+        assert empty == []
+
+        fake_data_export.faqmatches.append(faq1)
+        one = [item async for item in ec.get_model_items(FAQModel)]
+        assert one == [faqm1]
+
+        fake_data_export.faqmatches.append(faq2)
+        two = [item async for item in ec.get_model_items(FAQModel)]
+        assert two == [faqm1, faqm2]
+
+
+@pytest.mark.anyio()
+async def test_async_export_client_model_pages(fake_data_export):
+    """
+    The async client fetches model items a page at a time.
+    """
+    [faq1, faq2] = json.loads(read_test_data("two_faqs.json"))["result"]
+    [faqm1, faqm2] = [FAQModel.from_json(faq) for faq in [faq1, faq2]]
+    fake_data_export.faqmatches.extend([faq1, faq2])
+
+    async with AsyncExportClient(fake_data_export.base_url, "token") as ec:
+        pages = [page async for page in ec.get_model_pages(FAQModel, limit=1)]
+        assert pages == [[faqm1], [faqm2], []]
+
+
+@pytest.mark.anyio()
+async def test_async_export_client_stop_early(fake_data_export):
+    """
+    If we stop iterating before the last page, the outstanding page request is
+    cancelled.
+    """
+    [faq1, faq2] = json.loads(read_test_data("two_faqs.json"))["result"]
+    faqm1 = FAQModel.from_json(faq1)
+    fake_data_export.faqmatches.extend([faq1, faq2])
+
+    async with AsyncExportClient(fake_data_export.base_url, "token") as ec:
+        pages = ec.get_model_pages(FAQModel, limit=1)
+        assert await anext(pages) == [faqm1]
+        await pages.aclose()
+
+
+@pytest.mark.anyio()
+async def test_async_export_client_auth(fake_data_export):
+    """
+    The async client properly sends the given authentication token.
+    """
+    fake_data_export.token = "goodtoken"  # noqa: S105 (Not a real token.)
+    async with AsyncExportClient(fake_data_export.base_url, "badtoken") as ec:
+        with pytest.raises(HTTPStatusError) as errinfo:
+            await anext(ec.get_model_items(FAQModel))
+        assert errinfo.value.response.status_code == 401
+
+
+@pytest.mark.anyio()
+async def test_async_export_client_retries():
+    """
+    The async client retries throttled requests if it's configured to.
+    """
+    [faq1, faq2] = json.loads(read_test_data("two_faqs.json"))["result"]
+    [faqm1, faqm2] = [FAQModel.from_json(faq) for faq in [faq1, faq2]]
+    fake = FakeDataExport(URL("https://127.0.0.100:1234/"), HTTPXMock())
+    fake.faqmatches.extend([faq1, faq2])
+    fake.throttle = 1
+    transport = MockTransport(fake.handle_request)
+
+    http = HTTPOptions(retries=1, backoff=0)
+    ec = AsyncExportClient(fake.base_url, "t", transport=transport, http=http)
+    async with ec:
+        assert [i async for i in ec.get_model_items(FAQModel)] == [faqm1, faqm2]
+    assert fake.throttle == 0
@@ -1,6 +1,6 @@
 import pytest
 
-from aaq_sync.itertools import IteratorWithFinishedCheck
+from aaq_sync.itertools import IteratorWithFinishedCheck, chunked
 
 
 def test_iwfc_finished_empty():
@@ -47,3 +47,16 @@ def test_iwfc_peek_next():
     # We're finished, so there's nothing left to peek at.
     with pytest.raises(StopIteration):
         three.peek_next()
+
+
+def test_chunked():
+    """
+    chunked() splits an iterable into lists of at most the given size.
+    """
+    assert list(chunked([], 2)) == []
+    assert list(chunked([1], 2)) == [[1]]
+    assert list(chunked([1, 2], 2)) == [[1, 2]]
+    assert list(chunked(iter([1, 2, 3, 4, 5]), 2)) == [[1, 2], [3, 4], [5]]
+
+    with pytest.raises(ValueError, match="at least 1"):
+        list(chunked([1, 2], 0))
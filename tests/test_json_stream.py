@@ -0,0 +1,111 @@
+import json
+
+import pytest
+
+from aaq_sync.json_stream import parse_page_stream
+
+from .helpers import read_test_data
+
+
+def parse_all(chunks):
+    """
+    Parse a whole page, returning the items and the other top-level fields.
+    """
+    items = []
+    parser = parse_page_stream(chunks)
+    while True:
+        try:
+            items.append(next(parser))
+        except StopIteration as e:
+            return items, e.value
+
+
+def split_every(text, n):
+    return [text[i : i + n] for i in range(0, len(text), n)]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 64, 100000])
+def test_parse_page_stream(chunk_size):
+    """
+    Items and metadata are parsed correctly however the input is chunked.
+    """
+    text = read_test_data("two_faqs.json")
+    page = json.loads(text)
+
+    items, others = parse_all(split_every(text, chunk_size))
+    assert items == page["result"]
+    assert others == {"metadata": page["metadata"]}
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 5, 100000])
+def test_parse_page_stream_tricky(chunk_size):
+    """
+    Strings containing structural characters, escapes, nested containers,
+    numbers split across chunks, and metadata after the items are all handled.
+    """
+    page = {
+        "result": [
+            {"s": 'x]}",\\ é\U0001f930', "n": -12345.678e-3},
+            [1, [2, [3]], {"a": {}}],
+            12345,
+            None,
+            True,
+            "plain",
+        ],
+        "metadata": {"size": 6, "offset": 0, "limit": 10},
+        "other": [1.5],
+    }
+    text = json.dumps(page, indent=2, ensure_ascii=False)
+
+    items, others = parse_all(split_every(text, chunk_size))
+    assert items == page["result"]
+    assert others == {"metadata": page["metadata"], "other": [1.5]}
+
+
+def test_parse_page_stream_empty():
+    """
+    Empty objects and empty item lists are handled.
+    """
+    assert parse_all(["{}"]) == ([], {})
+    assert parse_all(["", " { } ", ""]) == ([], {})
+    assert parse_all(['{"result": []}']) == ([], {})
+    assert parse_all(['{"result" :[ ] , "a":1}']) == ([], {"a": 1})
+    # Items that aren't in an array are just another field.
+    assert parse_all(['{"result": null}']) == ([], {"result": None})
+
+
+def test_parse_page_stream_yields_early():
+    """
+    Each item is yielded as soon as it has been read, without waiting for the
+    rest of the input.
+    """
+
+    def chunks():
+        yield '{"result": [{"a": 1}, '
+        raise AssertionError("Read too far!")
+
+    parser = parse_page_stream(chunks())
+    assert next(parser) == {"a": 1}
+
+
+@pytest.mark.parametrize(
+    ("text", "msg"),
+    [
+        ("", "Unexpected end of data"),
+        ("[]", "Expecting '{'"),
+        ('{"result": [{"a": 1}', "Unexpected end of data"),
+        ('{"result": [{"a": 1', "Expecting"),
+        ('{"result": [1 2]}', "Expecting ',' or ']'"),
+        ('{"a": 1 "b": 2}', "Expecting ',' or '}'"),
+        ('{"a" 1}', "Expecting ':'"),
+        ("{1: 2}", "Expecting property name"),
+        ('{"a": nope}', "Expecting value"),
+        ('{"a": 1', "Unexpected end of data"),
+    ],
+)
+def test_parse_page_stream_invalid(text, msg):
+    """
+    Invalid or truncated input raises a decode error.
+    """
+    with pytest.raises(json.JSONDecodeError, match=msg):
+        parse_all(split_every(text, 2))
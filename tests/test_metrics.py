@@ -0,0 +1,190 @@
+import json
+
+from aaq_sync.metrics import CountingIterator, Histogram, SyncMetrics, stage
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_histogram():
+    """
+    Histogram buckets are cumulative, with an implicit +Inf bucket.
+    """
+    hist = Histogram(buckets=(0.1, 1.0))
+    for value in [0.05, 0.5, 0.5, 5]:
+        hist.observe(value)
+
+    assert hist.bucket_counts() == {"0.1": 1, "1": 3, "+Inf": 4}
+    assert (hist.sum, hist.count) == (6.05, 4)
+
+
+def test_counting_iterator():
+    """
+    A CountingIterator counts the items it has produced so far.
+    """
+    counted = CountingIterator("abc")
+    assert next(counted) == "a"
+    assert counted.count == 1
+    assert list(counted) == ["b", "c"]
+    assert counted.count == 3
+
+
+def test_nested_stages():
+    """
+    Stage timings are exclusive of any nested stages.
+    """
+    clock = FakeClock()
+    metrics = SyncMetrics(clock=clock)
+
+    with metrics.stage("outer", "t"):
+        clock.now += 1
+        with metrics.stage("inner", "t"):
+            clock.now += 2
+        clock.now += 3
+        with metrics.stage("inner", "t"):
+            clock.now += 4
+
+    assert metrics.stages["outer", "t"].seconds == 4
+    assert metrics.stages["inner", "t"].seconds == 6
+
+    # The stage helper does nothing without metrics.
+    with stage(None, "outer", "t"):
+        clock.now += 1
+    with stage(metrics, "outer", "t"):
+        clock.now += 1
+    assert metrics.stages["outer", "t"].seconds == 5
+
+
+def test_iter_stage():
+    """
+    Producing items from an iterator can be timed as a stage, excluding time
+    spent in nested stages and time spent by the consumer.
+    """
+    clock = FakeClock()
+    metrics = SyncMetrics(clock=clock)
+
+    def produce():
+        for i in range(3):
+            clock.now += 1
+            with metrics.stage("upstream", "t"):
+                clock.now += 10
+            yield i
+
+    items = []
+    for item in metrics.iter_stage("filter", "t", produce()):
+        clock.now += 100
+        items.append(item)
+
+    assert items == [0, 1, 2]
+    assert metrics.stages["filter", "t"].seconds == 3
+    assert metrics.stages["filter", "t"].rows == 3
+    assert metrics.stages["upstream", "t"].seconds == 30
+
+
+def make_metrics() -> SyncMetrics:
+    clock = FakeClock()
+    metrics = SyncMetrics(clock=clock)
+    metrics.inc("rows_inserted", "faqmatches", 3)
+    metrics.inc("rows_inserted", "other", 1)
+    metrics.observe("page_latency_seconds", "faqmatches", 0.2)
+    with metrics.stage("http", "faqmatches"):
+        clock.now += 0.5
+    metrics.add_rows("http", "faqmatches", 3)
+    with metrics.stage("commit", "other"):
+        pass
+    return metrics
+
+
+def test_report():
+    """
+    The report groups metrics by table.
+    """
+    buckets = {"0.05": 0, "0.1": 0, "0.25": 1, "0.5": 1, "1": 1, "2.5": 1}
+    buckets |= {"5": 1, "10": 1, "30": 1, "60": 1, "+Inf": 1}
+    assert make_metrics().report() == {
+        "tables": {
+            "faqmatches": {
+                "counters": {"rows_inserted": 3},
+                "stages": {
+                    "http": {"seconds": 0.5, "rows": 3, "rows_per_second": 6.0},
+                },
+                "histograms": {
+                    "page_latency_seconds": {
+                        "buckets": buckets,
+                        "sum": 0.2,
+                        "count": 1,
+                    },
+                },
+            },
+            "other": {
+                "counters": {"rows_inserted": 1},
+                "stages": {
+                    "commit": {"seconds": 0, "rows": 0, "rows_per_second": None},
+                },
+                "histograms": {},
+            },
+        }
+    }
+
+
+def test_prometheus_text():
+    """
+    Metrics can be rendered in the Prometheus text format.
+    """
+    lines = make_metrics().prometheus_text().splitlines()
+    assert lines[:9] == [
+        "# TYPE aaq_sync_rows_inserted_total counter",
+        'aaq_sync_rows_inserted_total{table="faqmatches"} 3',
+        'aaq_sync_rows_inserted_total{table="other"} 1',
+        "# TYPE aaq_sync_stage_seconds_total counter",
+        'aaq_sync_stage_seconds_total{stage="commit",table="other"} 0',
+        'aaq_sync_stage_seconds_total{stage="http",table="faqmatches"} 0.5',
+        "# TYPE aaq_sync_stage_rows_total counter",
+        'aaq_sync_stage_rows_total{stage="commit",table="other"} 0',
+        'aaq_sync_stage_rows_total{stage="http",table="faqmatches"} 3',
+    ]
+    assert lines[9] == "# TYPE aaq_sync_page_latency_seconds histogram"
+    assert (
+        lines[10]
+        == 'aaq_sync_page_latency_seconds_bucket{table="faqmatches",le="0.05"} 0'
+    )
+    assert lines[-3:] == [
+        'aaq_sync_page_latency_seconds_bucket{table="faqmatches",le="+Inf"} 1',
+        'aaq_sync_page_latency_seconds_sum{table="faqmatches"} 0.2',
+        'aaq_sync_page_latency_seconds_count{table="faqmatches"} 1',
+    ]
+
+    # Label values are escaped, and each histogram gets its own family.
+    metrics = SyncMetrics()
+    metrics.inc("odd", 'a"b\\c\nd')
+    metrics.observe("a_seconds", "t", 1)
+    metrics.observe("b_seconds", "t", 2)
+    text = metrics.prometheus_text()
+    assert text.count("_count{") == 2
+    assert text.index("# TYPE aaq_sync_b_seconds") > text.index("a_seconds_count")
+    assert 'aaq_sync_odd_total{table="a\\"b\\\\c\\nd"} 1' in text
+
+
+def test_write(tmp_path):
+    """
+    Metrics can be written to files, replacing what was there.
+    """
+    metrics = make_metrics()
+    json_path = tmp_path / "metrics.json"
+    prom_path = tmp_path / "metrics.prom"
+    json_path.write_text("old")
+
+    metrics.write_json(json_path)
+    metrics.write_prometheus(prom_path)
+
+    assert json.loads(json_path.read_text()) == metrics.report()
+    assert prom_path.read_text() == metrics.prometheus_text()
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "metrics.json",
+        "metrics.prom",
+    ]
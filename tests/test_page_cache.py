@@ -0,0 +1,111 @@
+import sqlite3
+import zlib
+
+import pytest
+
+from aaq_sync.page_cache import CachedPage, PageCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture()
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture()
+def cache(tmp_path, clock):
+    cache = PageCache(tmp_path / "pages.db", clock=clock)
+    yield cache
+    cache.close()
+
+
+def test_put_get(cache, tmp_path):
+    """
+    Page bodies are stored compressed along with their validators.
+    """
+    body = b'{"result": []}' * 100
+    assert cache.get("page1") is None
+
+    cache.put("page1", body, etag='"abc"')
+    cache.put("page2", b"{}", last_modified="Wed, 21 Oct 2015 07:28:00 GMT")
+
+    assert cache.get("page1") == CachedPage(body, '"abc"', None, 1000.0)
+    assert cache.get("page2") == CachedPage(
+        b"{}", None, "Wed, 21 Oct 2015 07:28:00 GMT", 1000.0
+    )
+    assert cache.total_bytes() == len(zlib.compress(body)) + len(zlib.compress(b"{}"))
+
+    # The cache persists across instances.
+    cache2 = PageCache(tmp_path / "pages.db")
+    assert cache2.get("page1") == CachedPage(body, '"abc"', None, 1000.0)
+    cache2.close()
+
+
+def test_validator_headers():
+    """
+    Conditional request headers are built from whichever validators we have.
+    """
+    assert CachedPage(b"", None, None, 0).validator_headers() == {}
+    assert CachedPage(b"", '"abc"', "yesterday", 0).validator_headers() == {
+        "If-None-Match": '"abc"',
+        "If-Modified-Since": "yesterday",
+    }
+
+
+def test_freshness(tmp_path, clock):
+    """
+    Pages are fresh until they're max_age seconds old. Revalidating a page makes
+    it fresh again.
+    """
+    cache = PageCache(tmp_path / "pages.db", max_age=60, clock=clock)
+    cache.put("page1", b"{}")
+    page = CachedPage(b"{}", None, None, stored_at=clock.now)
+    assert cache.get("page1") == page
+    assert cache.is_fresh(page)
+
+    clock.now += 60
+    assert not cache.is_fresh(page)
+
+    cache.revalidated("page1")
+    assert cache.get("page1") == CachedPage(b"{}", None, None, stored_at=clock.now)
+
+    # With the default max_age, pages are never fresh.
+    cache.max_age = 0
+    assert not cache.is_fresh(CachedPage(b"{}", None, None, stored_at=clock.now))
+    cache.close()
+
+
+def test_lru_eviction(tmp_path, clock):
+    """
+    When the cache is too big, the least recently used pages are evicted.
+    """
+    body_size = len(zlib.compress(b"a" * 100))
+    cache = PageCache(tmp_path / "pages.db", max_bytes=3 * body_size, clock=clock)
+
+    for key in ["a", "b", "c"]:
+        clock.now += 1
+        cache.put(key, b"a" * 100)
+    # Reading "a" makes it more recently used than "b".
+    clock.now += 1
+    cache.get("a")
+
+    clock.now += 1
+    cache.put("d", b"a" * 100)
+    assert [k for k in "abcd" if cache.get(k) is not None] == ["a", "c", "d"]
+    assert cache.total_bytes() == 3 * body_size
+
+    # A page that's too big on its own to fit doesn't stay in the cache.
+    cache.put("e", bytes(range(256)) * 100)
+    assert cache.get("e") is None
+    cache.close()
+
+    with sqlite3.connect(tmp_path / "pages.db") as conn:
+        [(count,)] = conn.execute("SELECT COUNT(*) FROM pages")
+    assert count == 3
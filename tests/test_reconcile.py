@@ -0,0 +1,169 @@
+import pytest
+from click.testing import CliRunner
+from sqlalchemy import create_engine
+from sqlalchemy.orm import DeclarativeBase, Mapped, Session, mapped_column
+
+from aaq_sync.benchmark import synthetic_faqs
+from aaq_sync.cli import main, reconcile
+from aaq_sync.data_models import Base, FAQModel
+from aaq_sync.reconcile import (
+    RECONCILE_FANOUT,
+    RECONCILE_LEAF_ROWS,
+    reconcile_model_items,
+)
+
+from .helpers import Database
+
+
+def sqlite_database(path) -> Database:
+    engine = create_engine(f"sqlite:///{path}", echo=False)
+    Base.metadata.create_all(engine)
+    return Database(engine)
+
+
+@pytest.fixture(params=["postgresql", "sqlite"])
+def db_pair(request, tmp_path):
+    """
+    A source and destination database of the same kind.
+    """
+    if request.param == "sqlite":
+        return tuple(sqlite_database(tmp_path / f"{n}.db") for n in ["src", "dst"])
+    engines = [request.getfixturevalue(f) for f in ["mirror_dbengine", "dbengine"]]
+    for engine in engines:
+        Base.metadata.create_all(engine)
+    return Database(engines[0]), Database(engines[1])
+
+
+def store(db: Database, faqs: list[FAQModel]):
+    with db.session() as session:
+        session.add_all([faq.clone() for faq in faqs])
+        session.commit()
+
+
+def test_reconcile(db_pair):
+    """
+    Missing and changed items are copied from the source, only fetching the
+    pkey ranges that differ, and extra items are reported.
+    """
+    source, dest = db_pair
+    faqs = FAQModel.from_json_many(synthetic_faqs(200, text_size=20, array_len=2))
+    store(source, faqs)
+    changed = [faqs[5].clone(), faqs[150].clone()]
+    changed[0].faq_title = "Changed"
+    changed[1].faq_tags = None
+    extra = FAQModel.from_json(synthetic_faqs(300)[-1])
+    store(dest, [*faqs[:5], changed[0], *faqs[6:150], changed[1], *faqs[152:], extra])
+
+    def reconcile():
+        with source.session() as src, dest.session() as dst:
+            return reconcile_model_items(FAQModel, src, dst, fanout=4, leaf_rows=10)
+
+    result = reconcile()
+    assert result.inserted == [faqs[151]]
+    assert result.updated == [faqs[5], faqs[150]]
+    assert result.extra == [(300,)]
+    assert dest.fetch_faqs() == [*faqs, extra]
+    # We narrowed down to a few small ranges instead of comparing everything.
+    assert result.digest_queries < 20
+
+    result = reconcile()
+    assert (result.inserted, result.updated, result.extra) == ([], [], [(300,)])
+
+    # An unchanged table needs only one digest query.
+    with dest.session() as session:
+        session.delete(session.get(FAQModel, 300))
+        session.commit()
+    result = reconcile()
+    assert (result.inserted, result.updated, result.extra) == ([], [], [])
+    assert result.digest_queries == 1
+
+
+def test_reconcile_empty(tmp_path):
+    """
+    Reconciling with an empty source or destination works.
+    """
+    source = sqlite_database(tmp_path / "source.db")
+    dest = sqlite_database(tmp_path / "dest.db")
+    faqs = FAQModel.from_json_many(synthetic_faqs(3, text_size=20))
+
+    with source.session() as src, dest.session() as dst:
+        result = reconcile_model_items(FAQModel, src, dst)
+    assert result.digest_queries == 1
+
+    store(source, faqs)
+    with source.session() as src, dest.session() as dst:
+        assert reconcile_model_items(FAQModel, src, dst).inserted == faqs
+    assert dest.fetch_faqs() == faqs
+
+    with dest.session() as src, sqlite_database(tmp_path / "e.db").session() as dst:
+        assert reconcile_model_items(FAQModel, src, dst).extra == []
+
+
+def test_reconcile_unsupported(dbengine, tmp_path, monkeypatch):
+    """
+    Both databases must be the same supported kind, and the model must have a
+    single integer pkey.
+    """
+    sqlite_engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    match = "between postgresql and sqlite"
+    with (
+        Session(dbengine) as src,
+        Session(sqlite_engine) as dst,
+        pytest.raises(ValueError, match=match),
+    ):
+        reconcile_model_items(FAQModel, src, dst)
+
+    monkeypatch.setattr(sqlite_engine.dialect, "name", "unknowndb")
+    match = "Range digests aren't supported for unknowndb"
+    with Session(sqlite_engine) as session, pytest.raises(ValueError, match=match):
+        reconcile_model_items(FAQModel, session, session)
+
+    class NamedBase(DeclarativeBase):
+        pass
+
+    class Named(NamedBase):
+        __tablename__ = "named"
+        name: Mapped[str] = mapped_column(primary_key=True)
+
+    match = "named doesn't have a single integer pkey"
+    with Session(dbengine) as session, pytest.raises(ValueError, match=match):
+        reconcile_model_items(Named, session, session)  # type: ignore
+
+
+def test_reconcile_cli(tmp_path):
+    """
+    Tables can be reconciled from the command line.
+    """
+    source = sqlite_database(tmp_path / "source.db")
+    dest = sqlite_database(tmp_path / "dest.db")
+    faqs = FAQModel.from_json_many(synthetic_faqs(3, text_size=20))
+    store(source, faqs)
+    store(dest, faqs[:1])
+
+    opts = [
+        "reconcile",
+        *("--source-db-url", str(source.engine.url)),
+        *("--db-url", str(dest.engine.url)),
+        *("--table", "faqmatches"),
+    ]
+    result = CliRunner().invoke(main, opts)
+    print(result.output)
+    assert result.exit_code == 0
+    assert result.output.splitlines() == [
+        "Reconciling faqmatches ...",
+        (
+            "Reconciled faqmatches with 1 digest queries: 2 inserted, 0 updated,"
+            " 0 only in destination."
+        ),
+    ]
+    assert dest.fetch_faqs() == faqs
+
+
+def test_reconcile_cli_defaults():
+    """
+    The reconcile command's defaults match the reconcile module's, which it
+    doesn't import until it runs.
+    """
+    defaults = {p.name: p.default for p in reconcile.params}
+    assert defaults["fanout"] == RECONCILE_FANOUT
+    assert defaults["leaf_rows"] == RECONCILE_LEAF_ROWS
@@ -0,0 +1,99 @@
+import pytest
+
+from aaq_sync.scheduler import Scheduler
+
+
+class FakeTime:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps: list[float] = []
+
+    def clock(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture()
+def fake_time():
+    return FakeTime()
+
+
+def make_scheduler(fake_time, **kw) -> Scheduler:
+    kw.setdefault("jitter", 0)
+    return Scheduler(clock=fake_time.clock, sleep=fake_time.sleep, **kw)
+
+
+def test_run_jobs(fake_time):
+    """
+    Each job runs immediately and then every interval after it last finished,
+    until we're stopped.
+    """
+    scheduler = make_scheduler(fake_time, interval=10, poll_seconds=4)
+    runs = []
+
+    def job(name: str, duration: float):
+        def run():
+            runs.append((name, fake_time.now))
+            fake_time.now += duration
+            if len(runs) == 5:
+                scheduler.stop()
+
+        return run
+
+    scheduler.run({"a": job("a", 1), "b": job("b", 12)}, on_error=print)
+    # "a" is overdue by the time "b" finishes, so it runs straight away.
+    assert runs == [("a", 0), ("b", 1), ("a", 13), ("b", 23), ("a", 35)]
+    # Long sleeps are split up so we notice if we've been stopped.
+    assert fake_time.sleeps == [4, 4, 1]
+
+
+def test_run_errors(fake_time):
+    """
+    Failing jobs are reported and rescheduled.
+    """
+    scheduler = make_scheduler(fake_time, interval=10)
+    errors: list[tuple[str, str, float]] = []
+
+    def fail():
+        if len(errors) == 1:
+            scheduler.stop()
+        raise ValueError(f"Failure {len(errors)}")
+
+    def on_error(name: str, e: Exception):
+        errors.append((name, str(e), fake_time.now))
+
+    scheduler.run({"fail": fail}, on_error)
+    assert errors == [("fail", "Failure 0", 0), ("fail", "Failure 1", 10)]
+
+
+def test_stop_while_sleeping(fake_time):
+    """
+    If we're stopped while sleeping, no more jobs are run.
+    """
+    runs = []
+
+    def sleep(seconds: float):
+        fake_time.sleep(seconds)
+        scheduler.stop()
+
+    scheduler = Scheduler(interval=10, clock=fake_time.clock, sleep=sleep)
+    scheduler.run({"job": lambda: runs.append(fake_time.now)}, on_error=print)
+    assert runs == [0]
+
+    # Nothing happens if there are no jobs.
+    Scheduler(interval=10).run({}, on_error=print)
+
+
+def test_jitter():
+    """
+    The delay until a job's next run varies by up to the jitter fraction.
+    """
+    scheduler = Scheduler(interval=100, jitter=0.2)
+    delays = [scheduler.next_delay() for _ in range(100)]
+    assert all(80 <= d <= 120 for d in delays)
+    assert len(set(delays)) > 1
+
+    assert Scheduler(interval=100, jitter=0).next_delay() == 100
@@ -0,0 +1,86 @@
+import io
+from typing import Any
+
+import pytest
+
+from aaq_sync.benchmark import synthetic_faqs
+from aaq_sync.data_models import FAQModel
+from aaq_sync.snapshot import (
+    SNAPSHOT_MAGIC,
+    SnapshotReader,
+    SnapshotWriter,
+    write_snapshot,
+)
+
+
+def test_snapshot_roundtrip(tmp_path):
+    """
+    Items from several tables can be written to a snapshot and read back, a
+    frame at a time.
+    """
+    faqds = synthetic_faqs(5, text_size=20)
+    others: list[dict[str, Any]] = [
+        {"id": 1},
+        {"id": 2, "nested": {"list": [1.5, None, "ü"]}},
+    ]
+    path = tmp_path / "snap.aaqs"
+
+    with path.open("wb") as f:
+        writer = SnapshotWriter(f, frame_items=2)
+        assert writer.write_items("faqmatches", iter(faqds)) == 5
+        assert writer.write_items("empty", []) == 0
+        assert writer.write_items("others", others) == 2
+
+    with SnapshotReader(path) as reader:
+        assert reader.tables() == ["faqmatches", "empty", "others"]
+        assert reader.count_items("faqmatches") == 5
+        assert [len(p) for p in reader.iter_pages("faqmatches")] == [2, 2, 1]
+        assert list(reader.iter_items("faqmatches")) == faqds
+        assert list(reader.iter_items("empty")) == []
+        assert list(reader.iter_items("others")) == others
+        assert list(reader.iter_items("missing")) == []
+        faqs = list(reader.get_model_items(FAQModel))
+        assert faqs == FAQModel.from_json_many(faqds)
+
+
+def test_write_snapshot(tmp_path):
+    """
+    Snapshots are only written once they're complete.
+    """
+    path = tmp_path / "snap.aaqs"
+    assert write_snapshot(path, [("a", [{"x": 1}]), ("b", [])]) == {"a": 1, "b": 0}
+    with SnapshotReader(path) as reader:
+        assert reader.tables() == ["a", "b"]
+
+    def failing_items():
+        yield {"x": 2}
+        raise RuntimeError("Export failed")
+
+    with pytest.raises(RuntimeError, match="Export failed"):
+        write_snapshot(path, [("a", failing_items())])
+    with SnapshotReader(path) as reader:
+        assert list(reader.iter_items("a")) == [{"x": 1}]
+    assert [p.name for p in tmp_path.iterdir()] == ["snap.aaqs"]
+
+
+@pytest.mark.parametrize(
+    ("content", "error"),
+    [
+        (b"", "cannot mmap an empty file"),
+        (b"not a snapshot", "bad magic"),
+        (SNAPSHOT_MAGIC + b"\0\0", "unpack_from requires"),
+        ("truncated", "truncated frame"),
+    ],
+)
+def test_invalid_snapshot(tmp_path, content, error):
+    """
+    Invalid snapshots are rejected when they're opened.
+    """
+    if content == "truncated":
+        buf = io.BytesIO()
+        SnapshotWriter(buf).write_items("a", [{"x": 1}])
+        content = buf.getvalue()[:-1]
+    path = tmp_path / "bad.aaqs"
+    path.write_bytes(content)
+    with pytest.raises(ValueError, match=f"isn't a valid snapshot: {error}"):
+        SnapshotReader(path)
@@ -1,12 +1,38 @@
 import json
 from dataclasses import asdict
+from typing import Any
 
 import pytest
-from httpx import URL
+from httpx import URL, HTTPStatusError
+from sqlalchemy import create_engine, delete
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import DeclarativeBase, Mapped, Session, mapped_column
 
-from aaq_sync.data_export_client import ExportClient
-from aaq_sync.data_models import Base, FAQModel
-from aaq_sync.sync import fetch_existing, filter_existing, store_new, sync_model_items
+from aaq_sync.data_export_client import AsyncExportClient, ExportClient
+from aaq_sync.data_models import Base, FAQModel, ValidationError
+from aaq_sync.metrics import SyncMetrics
+from aaq_sync.sync import (
+    async_sync_model_items,
+    fetch_existing,
+    fetch_existing_by_pkey,
+    filter_existing,
+    filter_existing_ordered,
+    prune_missing,
+    store_new,
+    sync_model_items,
+    sync_model_items_fanout,
+)
+from aaq_sync.sync_state import (
+    RowDigest,
+    fetch_digests,
+    fetch_quarantined,
+    get_checkpoint,
+    get_watermark,
+    set_checkpoint,
+    store_digests,
+    table_exists,
+)
 
 from .fake_data_export import FakeDataExport
 from .helpers import Database, read_test_data
@@ -49,6 +75,56 @@ def test_filter_existing():
         list(filter_existing([faq2e], [faq1n, faq2n]))
 
 
+def test_filter_existing_ordered():
+    """
+    Existing items are filtered out when both existing and new items are
+    ordered by pkey. Existing items with different values throw an exception.
+    """
+    faq_dicts = json.loads(read_test_data("two_faqs.json"))["result"]
+    [faq1e, faq2e] = [FAQModel.from_json(faqd) for faqd in faq_dicts]
+    [faq1n, faq2n] = [FAQModel.from_json(faqd) for faqd in faq_dicts]
+
+    def filtered(olds, news):
+        return list(filter_existing_ordered(lambda: iter(olds), news))
+
+    # If either input list is empty, the output is always the value of new.
+    assert filtered([], []) == []
+    assert filtered([faq1e, faq2e], []) == []
+    assert filtered([], [faq1n, faq2n]) == [faq1n, faq2n]
+
+    # Any existing values that are equal to their new equivalents are excluded
+    # from the output.
+    assert filtered([faq1e], [faq1n, faq2n]) == [faq2n]
+    assert filtered([faq2e], [faq1n, faq2n]) == [faq1n]
+    assert filtered([faq1e, faq2e], [faq1n, faq2n]) == []
+
+    # If a new value isn't equal to an existing counterpart, we get an error.
+    faq2n.faq_title = "New title"
+    with pytest.raises(ValueError, match=r"already exists with different value"):
+        filtered([faq1e, faq2e], [faq1n, faq2n])
+
+
+def test_filter_existing_ordered_fallback():
+    """
+    If new items aren't ordered by pkey, we fall back to a fresh set of
+    existing items for the rest of the new items.
+    """
+    faq_dicts = json.loads(read_test_data("two_faqs.json"))["result"]
+    [faq1e, faq2e] = [FAQModel.from_json(faqd) for faqd in faq_dicts]
+    [faq1n, faq2n] = [FAQModel.from_json(faqd) for faqd in faq_dicts]
+    faq3n = FAQModel.from_json(faq_dicts[0] | {"faq_id": 3})
+
+    fetches = []
+
+    def fetch_olds():
+        fetches.append(True)
+        return iter([faq1e, faq2e])
+
+    news = [faq3n, faq2n, faq1n]
+    assert list(filter_existing_ordered(fetch_olds, news)) == [faq3n]
+    assert len(fetches) == 2
+
+
 def test_fetch_existing(db):
     """
     Existing items are fetched from the db.
@@ -60,6 +136,43 @@ def test_fetch_existing(db):
     assert [asdict(faq1), asdict(faq2)] == faqs
 
 
+def test_fetch_existing_by_pkey(db):
+    """
+    Only existing items with the given pkeys are fetched from the db.
+    """
+    [faq1, faq2] = db.faq_json_to_db("two_faqs.json")
+
+    with db.session() as session:
+        assert list(fetch_existing_by_pkey(FAQModel, session, [])) == []
+        [faq] = fetch_existing_by_pkey(FAQModel, session, [(2,), (7,)])
+        assert asdict(faq) == faq2
+        faqs = fetch_existing_by_pkey(FAQModel, session, [(1,), (2,)])
+        faqs = sorted(faqs, key=lambda faq: faq.pkey_value())
+        assert [asdict(faq) for faq in faqs] == [faq1, faq2]
+
+
+def test_fetch_existing_by_pkey_composite(dbengine):
+    """
+    Existing items with composite pkeys can be fetched by pkey.
+    """
+
+    class CompositeBase(DeclarativeBase):
+        pass
+
+    class Pair(CompositeBase):
+        __tablename__ = "pairs"
+        a: Mapped[int] = mapped_column(primary_key=True)
+        b: Mapped[int] = mapped_column(primary_key=True)
+
+    CompositeBase.metadata.create_all(dbengine)
+    with Session(dbengine) as session:
+        session.add_all([Pair(a=1, b=1), Pair(a=1, b=2), Pair(a=2, b=1)])
+        session.commit()
+        pkeys = [(1, 2), (2, 1), (2, 2)]
+        found = fetch_existing_by_pkey(Pair, session, pkeys)  # type: ignore
+        assert sorted((p.a, p.b) for p in found) == [(1, 2), (2, 1)]
+
+
 def test_store_new(db):
     """
     New items are stored in the db.
@@ -87,6 +200,320 @@ def test_store_new(db):
     assert db.fetch_faqs() == [faq1, faq2]
 
 
+@pytest.mark.parametrize("insert_method", ["executemany", "copy"])
+def test_store_new_bulk(db, insert_method):
+    """
+    New items can be stored in bulk, bypassing the ORM. Arrays and nulls are
+    stored correctly.
+    """
+    faq_dicts = json.loads(read_test_data("two_faqs.json"))["result"]
+    [faq1, faq2] = [FAQModel.from_json(faqd) for faqd in faq_dicts]
+    faq3 = FAQModel.from_json(
+        faq_dicts[0]
+        | {
+            "faq_id": 3,
+            "faq_tags": [],
+            "faq_questions": ['Quotes " and, commas', "Braces {}", "\\ and NULL"],
+            "faq_contexts": ["context"],
+            "faq_thresholds": None,
+        }
+    )
+    kw = {"insert_method": insert_method}
+
+    with db.session() as session:
+        assert store_new([], session, **kw) == []
+        assert store_new([faq2], session, **kw) == [faq2]
+        session.commit()
+    assert db.fetch_faqs() == [faq2]
+
+    with db.session() as session:
+        assert store_new([faq1, faq2, faq3], session, **kw) == [faq1, faq3]
+        session.commit()
+    assert db.fetch_faqs() == [faq1, faq2, faq3]
+
+
+def test_store_new_copy_merge_join(db):
+    """
+    Bulk COPY inserts can be used while streaming existing items.
+    """
+    faq_dicts = json.loads(read_test_data("two_faqs.json"))["result"]
+    [faq0, faq3, faq4] = [
+        FAQModel.from_json(faq_dicts[0] | {"faq_id": i}) for i in [0, 3, 4]
+    ]
+    [faq1, faq2] = [FAQModel.from_json(faqd) for faqd in faq_dicts]
+    db.faq_json_to_db("two_faqs.json")
+
+    with db.session() as session:
+        news = [faq0, faq1, faq2, faq3, faq4]
+        stored = store_new(news, session, merge_join=True, insert_method="copy")
+        assert stored == [faq0, faq3, faq4]
+        session.commit()
+    assert [faq.faq_id for faq in db.fetch_faqs()] == [0, 1, 2, 3, 4]
+
+
+def test_store_new_copy_requires_psycopg():
+    """
+    COPY inserts are only supported with PostgreSQL and psycopg.
+    """
+    faq_dicts = json.loads(read_test_data("two_faqs.json"))["result"]
+    faq1 = FAQModel.from_json(faq_dicts[0])
+    engine = create_engine("sqlite://")
+    match = r"COPY is only supported with postgresql\+psycopg"
+    with Session(engine) as session, pytest.raises(ValueError, match=match):
+        # There's no table, but we never get as far as fetching existing items.
+        store_new([faq1], session, batch_size=1, insert_method="copy")
+
+
+@pytest.fixture()
+def sqlite_db(tmp_path):
+    # Use a file so that all threads see the same db.
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}", echo=False)
+    Base.metadata.create_all(engine)
+    return Database(engine)
+
+
+@pytest.fixture(params=["postgresql", "sqlite"])
+def any_db(request):
+    return request.getfixturevalue(
+        {"postgresql": "db", "sqlite": "sqlite_db"}[request.param]
+    )
+
+
+def test_store_new_sqlite(sqlite_db):
+    """
+    New items can be stored in SQLite, which doesn't have arrays.
+    """
+    faq_dicts = json.loads(read_test_data("two_faqs.json"))["result"]
+    [faq1, faq2] = [FAQModel.from_json(faqd) for faqd in faq_dicts]
+
+    with sqlite_db.session() as session:
+        assert store_new([faq1], session) == [faq1]
+        session.commit()
+    with sqlite_db.session() as session:
+        assert store_new([faq1, faq2], session) == [faq2]
+        session.commit()
+    assert sqlite_db.fetch_faqs() == [faq1, faq2]
+
+
+def test_store_new_upsert(any_db):
+    """
+    When upserting, new items are inserted and changed items are updated, and
+    only those items are returned.
+    """
+    faq_dicts = json.loads(read_test_data("two_faqs.json"))["result"]
+    [faq1, faq2] = [FAQModel.from_json(faqd) for faqd in faq_dicts]
+    faq3 = FAQModel.from_json(faq_dicts[0] | {"faq_id": 3})
+    kw: dict[str, Any] = {"on_conflict": "update"}
+
+    with any_db.session() as session:
+        assert store_new([faq2], session, **kw) == [faq2]
+        session.commit()
+    assert any_db.fetch_faqs() == [faq2]
+
+    faq2c = FAQModel.from_json(faq_dicts[1] | {"faq_tags": ["changed"]})
+    with any_db.session() as session:
+        assert store_new([faq1, faq2c, faq3], session, **kw) == [faq1, faq2c, faq3]
+        session.commit()
+    assert any_db.fetch_faqs() == [faq1, faq2c, faq3]
+
+    # Nothing has changed, so nothing is returned.
+    with any_db.session() as session:
+        assert store_new([faq1, faq2c, faq3], session, **kw) == []
+        session.commit()
+    assert any_db.fetch_faqs() == [faq1, faq2c, faq3]
+
+    # If an item appears more than once, the last one wins.
+    faq3c = FAQModel.from_json(faq_dicts[0] | {"faq_id": 3, "faq_title": "New"})
+    with any_db.session() as session:
+        assert store_new([faq3c, faq3], session, **kw) == []
+        assert store_new([faq3, faq3c], session, **kw) == [faq3c]
+        session.commit()
+    assert any_db.fetch_faqs() == [faq1, faq2c, faq3c]
+
+
+def test_store_new_upsert_unsupported(monkeypatch):
+    """
+    Upserts are only supported for some databases.
+    """
+    faq_dicts = json.loads(read_test_data("two_faqs.json"))["result"]
+    faq1 = FAQModel.from_json(faq_dicts[0])
+    engine = create_engine("sqlite://")
+    monkeypatch.setattr(engine.dialect, "name", "unknowndb")
+    match = r"Upserts aren't supported for unknowndb"
+    with Session(engine) as session, pytest.raises(ValueError, match=match):
+        store_new([faq1], session, on_conflict="update")
+
+
+def test_store_new_digests(db):
+    """
+    New items can be compared against stored content digests. Existing items
+    without digests are compared against the db and get digests.
+    """
+    faq_dicts = json.loads(read_test_data("two_faqs.json"))["result"]
+    [faq1, faq2] = [FAQModel.from_json(faqd) for faqd in faq_dicts]
+    faq3 = FAQModel.from_json(faq_dicts[0] | {"faq_id": 3})
+    # This was stored without a digest.
+    db.faq_json_to_db("two_faqs.json")
+
+    with db.session() as session:
+        assert store_new([faq1, faq3], session, use_digests=True) == [faq3]
+        session.commit()
+    assert db.fetch_faqs() == [faq1, faq2, faq3]
+    with db.session() as session:
+        assert fetch_digests(session, FAQModel).keys() == {(1,), (3,)}
+
+    # Now we have digests for some items.
+    with db.session() as session:
+        news = [faq1, faq2, faq3, faq3]
+        assert store_new(news, session, use_digests=True) == []
+        session.commit()
+    with db.session() as session:
+        assert fetch_digests(session, FAQModel).keys() == {(1,), (2,), (3,)}
+
+    # A changed item is detected.
+    faq3c = FAQModel.from_json(faq_dicts[0] | {"faq_id": 3, "faq_title": "New"})
+    match = r"already exists with different value: FAQModel\(3,\)"
+    with db.session() as session, pytest.raises(ValueError, match=match):
+        store_new([faq1, faq3c], session, use_digests=True)
+
+
+def test_store_new_upsert_digests(any_db):
+    """
+    Upserting replaces or deletes the digests of inserted and updated items,
+    so later syncs compare against their new values.
+    """
+    faq_dicts = json.loads(read_test_data("two_faqs.json"))["result"]
+    [faq1, faq2] = [FAQModel.from_json(faqd) for faqd in faq_dicts]
+    faq1c = FAQModel.from_json(faq_dicts[0] | {"faq_title": "New"})
+    kw: dict[str, Any] = {"on_conflict": "update", "use_digests": True}
+
+    with any_db.session() as session:
+        assert store_new([faq1, faq2], session, use_digests=True) == [faq1, faq2]
+        session.commit()
+    with any_db.session() as session:
+        assert store_new([faq1c, faq2], session, **kw) == [faq1c]
+        session.commit()
+    with any_db.session() as session:
+        assert fetch_digests(session, FAQModel) == {
+            (1,): faq1c.content_digest(),
+            (2,): faq2.content_digest(),
+        }
+        assert store_new([faq1c, faq2], session, use_digests=True) == []
+
+    # Upserting without digests deletes the digests of changed items, so
+    # they're compared against the db next time.
+    with any_db.session() as session:
+        assert store_new([faq1, faq2], session, on_conflict="update") == [faq1]
+        session.commit()
+    with any_db.session() as session:
+        assert fetch_digests(session, FAQModel).keys() == {(2,)}
+        assert store_new([faq1, faq2], session, use_digests=True) == []
+
+
+def test_prune_missing(any_db):
+    """
+    Rows whose pkeys weren't seen are deleted, along with their digests.
+    """
+    faqd = json.loads(read_test_data("two_faqs.json"))["result"][0]
+    faqs = [FAQModel.from_json(faqd | {"faq_id": i}) for i in range(1, 6)]
+    with any_db.session() as session:
+        session.add_all(faqs)
+        store_digests(session, FAQModel, faqs)
+        session.commit()
+
+    with any_db.session() as session:
+        assert prune_missing(FAQModel, session, [5, 3, 1], batch_size=1) == 2
+        session.commit()
+    assert any_db.fetch_faqs() == [faqs[0], faqs[2], faqs[4]]
+    with any_db.session() as session:
+        assert fetch_digests(session, FAQModel).keys() == {(1,), (3,), (5,)}
+
+    with any_db.session() as session:
+        assert prune_missing(FAQModel, session, [3, 6]) == 2
+        assert prune_missing(FAQModel, session, [3]) == 0
+        session.commit()
+    assert any_db.fetch_faqs() == [faqs[2]]
+    with any_db.session() as session:
+        assert fetch_digests(session, FAQModel).keys() == {(3,)}
+
+
+def test_prune_missing_without_digests(any_db):
+    """
+    Pruning doesn't need the digest table to exist, and doesn't create it.
+    """
+    faqd = json.loads(read_test_data("two_faqs.json"))["result"][0]
+    with any_db.session() as session:
+        session.add(FAQModel.from_json(faqd))
+        session.commit()
+
+    with any_db.session() as session:
+        assert prune_missing(FAQModel, session, []) == 1
+        assert not table_exists(session, RowDigest)
+
+
+def test_store_new_merge_join(db):
+    """
+    New items are stored in the db when merge-joining against existing items,
+    whether they're ordered or not.
+    """
+    faq_dicts = json.loads(read_test_data("two_faqs.json"))["result"]
+    [faq1, faq2] = [FAQModel.from_json(faqd) for faqd in faq_dicts]
+    faq3 = FAQModel.from_json(faq_dicts[0] | {"faq_id": 3})
+
+    # Store a new item.
+    with db.session() as session:
+        assert store_new([faq2], session, merge_join=True) == [faq2]
+        session.commit()
+    assert db.fetch_faqs() == [faq2]
+
+    # Store an old item and new items in order.
+    with db.session() as session:
+        assert store_new([faq1, faq2, faq3], session, merge_join=True) == [faq1, faq3]
+        session.commit()
+    assert db.fetch_faqs() == [faq1, faq2, faq3]
+
+    # Store out-of-order items, some of which are old.
+    faq4 = FAQModel.from_json(faq_dicts[0] | {"faq_id": 4})
+    faq5 = FAQModel.from_json(faq_dicts[0] | {"faq_id": 5})
+    with db.session() as session:
+        news = [faq1, faq5, faq3, faq4, faq5]
+        assert store_new(news, session, merge_join=True) == [faq5, faq4]
+        session.commit()
+    assert db.fetch_faqs() == [faq1, faq2, faq3, faq4, faq5]
+
+
+def test_store_new_batched(db):
+    """
+    New items are stored in the db when looking up existing items a batch at a
+    time.
+    """
+    faq_dicts = json.loads(read_test_data("two_faqs.json"))["result"]
+    [faq1, faq2] = [FAQModel.from_json(faqd) for faqd in faq_dicts]
+    faq3 = FAQModel.from_json(faq_dicts[0] | {"faq_id": 3})
+
+    with db.session() as session:
+        assert store_new([faq2], session, batch_size=2) == [faq2]
+        session.commit()
+    assert db.fetch_faqs() == [faq2]
+
+    with db.session() as session:
+        news = [faq3, faq2, faq1]
+        assert store_new(news, session, batch_size=2) == [faq3, faq1]
+        session.commit()
+    assert db.fetch_faqs() == [faq1, faq2, faq3]
+
+    # A changed item is still detected.
+    faq2c = FAQModel.from_json(faq_dicts[1] | {"faq_title": "New title"})
+    match = r"already exists with different value"
+    with db.session() as session, pytest.raises(ValueError, match=match):
+        store_new([faq1, faq3, faq2c], session, batch_size=2)
+
+    # Only one lookup strategy may be used at a time.
+    match = r"can't be combined"
+    with db.session() as session, pytest.raises(ValueError, match=match):
+        store_new([faq1], session, merge_join=True, batch_size=2)
+
+
 def test_sync_model_items(fake_data_export, db):
     """
     New items from the export API are stored in the db.
@@ -112,3 +539,523 @@ def test_sync_model_items(fake_data_export, db):
         with db.session() as session:
             assert sync_model_items(FAQModel, ec, session) == [faq2]
         assert db.fetch_faqs() == [faq1, faq2]
+
+
+@pytest.mark.parametrize(
+    "kw", [{}, {"on_conflict": "update"}, {"commit_every": 1, "batch_size": 1}]
+)
+def test_sync_model_items_metrics(fake_data_export, db, kw):
+    """
+    Syncs record how many rows were stored and how long each stage took.
+    """
+    [faq1d, faq2d] = json.loads(read_test_data("two_faqs.json"))["result"]
+    fake_data_export.faqmatches.append(faq1d)
+    metrics = SyncMetrics()
+
+    with ExportClient(fake_data_export.base_url, "token", metrics=metrics) as ec:
+        with db.session() as session:
+            sync_model_items(FAQModel, ec, session, metrics=metrics, **kw)
+        fake_data_export.faqmatches.append(faq2d)
+        with db.session() as session:
+            sync_model_items(FAQModel, ec, session, metrics=metrics, **kw)
+
+    report = metrics.report()["tables"]["faqmatches"]
+    assert report["counters"]["rows_fetched"] == 3
+    assert report["counters"]["rows_inserted"] == 2
+    assert report["counters"]["rows_skipped"] == 1
+    expected_stages = {
+        *["http", "json_decode", "from_json", "store_new", "flush", "commit"]
+    }
+    if kw.get("on_conflict") != "update":
+        expected_stages |= {"filter_existing"}
+        assert report["stages"]["filter_existing"]["rows"] == 2
+    assert set(report["stages"]) == expected_stages
+    assert all(s["seconds"] > 0 for s in report["stages"].values())
+
+
+@pytest.mark.anyio()
+async def test_async_sync_model_items(fake_data_export, db, async_dbengine):
+    """
+    New items from the export API are stored in the db using asyncio.
+    """
+    [faq1d, faq2d] = json.loads(read_test_data("two_faqs.json"))["result"]
+
+    def new_session():
+        return AsyncSession(async_dbengine, expire_on_commit=False)
+
+    async with AsyncExportClient(fake_data_export.base_url, "token") as ec:
+        # Sync nothing.
+        async with new_session() as session:
+            assert await async_sync_model_items(FAQModel, ec, session) == []
+        assert db.fetch_faqs() == []
+
+        # Sync a new item.
+        fake_data_export.faqmatches.append(faq1d)
+        faq1 = FAQModel.from_json(faq1d)
+        async with new_session() as session:
+            assert await async_sync_model_items(FAQModel, ec, session) == [faq1]
+        assert db.fetch_faqs() == [faq1]
+
+        # Sync an old and a new item.
+        fake_data_export.faqmatches.append(faq2d)
+        faq2 = FAQModel.from_json(faq2d)
+        with db.session() as session:
+            set_checkpoint(session, FAQModel, 1)
+            session.commit()
+        async with new_session() as session:
+            assert await async_sync_model_items(FAQModel, ec, session) == [faq2]
+        assert db.fetch_faqs() == [faq1, faq2]
+        # A completed sync clears any checkpoint left by a failed one.
+        with db.session() as session:
+            assert get_checkpoint(session, FAQModel) is None
+
+    await async_dbengine.dispose()
+
+
+def test_sync_model_items_incremental(fake_data_export, db):
+    """
+    Incremental syncs only consider items with a watermark at least as high as
+    the one recorded by the previous incremental sync.
+    """
+    [faq1d, faq2d] = json.loads(read_test_data("two_faqs.json"))["result"]
+    [faq1, faq2] = [FAQModel.from_json(faqd) for faqd in [faq1d, faq2d]]
+    fake_data_export.faqmatches.extend([faq1d, faq2d])
+
+    with ExportClient(fake_data_export.base_url, "token") as ec:
+        with db.session() as session:
+            stored = sync_model_items(FAQModel, ec, session, incremental=True)
+            assert stored == [faq1, faq2]
+            assert get_watermark(session, FAQModel) == faq2d["faq_updated_utc"]
+        assert db.fetch_faqs() == [faq1, faq2]
+
+        # An item older than the watermark is ignored, even if it's changed.
+        # An item at the watermark is compared as usual. An item newer than
+        # the watermark is stored.
+        updated = faq2d["faq_updated_utc"]
+        faq1d_changed = faq1d | {"faq_title": "Changed"}
+        faq3d = faq1d | {"faq_id": 3, "faq_updated_utc": updated + 1}
+        fake_data_export.faqmatches[:] = [faq1d_changed, faq2d, faq3d]
+        faq3 = FAQModel.from_json(faq3d)
+        with db.session() as session:
+            stored = sync_model_items(FAQModel, ec, session, incremental=True)
+            assert stored == [faq3]
+            assert get_watermark(session, FAQModel) == updated + 1
+        assert db.fetch_faqs() == [faq1, faq2, faq3]
+
+        # If there's nothing new, the watermark stays where it is.
+        fake_data_export.faqmatches[:] = []
+        with db.session() as session:
+            assert sync_model_items(FAQModel, ec, session, incremental=True) == []
+            assert get_watermark(session, FAQModel) == updated + 1
+
+
+def test_sync_model_items_incremental_upsert(fake_data_export, db):
+    """
+    Incremental syncs can update items that have changed since the last sync.
+    """
+    [faq1d, faq2d] = json.loads(read_test_data("two_faqs.json"))["result"]
+    [faq1, faq2] = [FAQModel.from_json(faqd) for faqd in [faq1d, faq2d]]
+    fake_data_export.faqmatches.extend([faq1d, faq2d])
+    kw: dict[str, Any] = {"incremental": True, "on_conflict": "update"}
+
+    with ExportClient(fake_data_export.base_url, "token") as ec:
+        with db.session() as session:
+            assert sync_model_items(FAQModel, ec, session, **kw) == [faq1, faq2]
+
+        updated = faq2d["faq_updated_utc"] + 1
+        faq1d_changed = faq1d | {"faq_title": "Changed", "faq_updated_utc": updated}
+        fake_data_export.faqmatches[0] = faq1d_changed
+        faq1c = FAQModel.from_json(faq1d_changed)
+        with db.session() as session:
+            assert sync_model_items(FAQModel, ec, session, **kw) == [faq1c]
+        assert db.fetch_faqs() == [faq1c, faq2]
+
+
+def test_sync_model_items_incremental_server_filter(fake_data_export, db):
+    """
+    If we have a watermark param, incremental syncs send the previous
+    watermark to the export API so it can filter items.
+    """
+    [faq1d, faq2d] = json.loads(read_test_data("two_faqs.json"))["result"]
+    [faq1, faq2] = [FAQModel.from_json(faqd) for faqd in [faq1d, faq2d]]
+    fake_data_export.faqmatches.extend([faq1d, faq2d])
+    fake_data_export.watermark_param = "updated_since"
+    kw: dict[str, Any] = {"incremental": True, "watermark_param": "updated_since"}
+
+    with ExportClient(fake_data_export.base_url, "token") as ec:
+        with db.session() as session:
+            assert sync_model_items(FAQModel, ec, session, **kw) == [faq1, faq2]
+        [req] = fake_data_export.mock.get_requests()
+        assert "updated_since" not in req.url.params
+
+        with db.session() as session:
+            assert sync_model_items(FAQModel, ec, session, **kw) == []
+        [_, req] = fake_data_export.mock.get_requests()
+        assert req.url.params["updated_since"] == str(faq2d["faq_updated_utc"])
+
+
+def test_sync_model_items_prune(fake_data_export, db):
+    """
+    Syncs can delete items that are no longer in the export.
+    """
+    [faq1d, faq2d] = json.loads(read_test_data("two_faqs.json"))["result"]
+    [faq1, faq2] = [FAQModel.from_json(faqd) for faqd in [faq1d, faq2d]]
+    fake_data_export.faqmatches.extend([faq1d, faq2d])
+    metrics = SyncMetrics()
+
+    with ExportClient(fake_data_export.base_url, "token") as ec:
+        with db.session() as session:
+            assert sync_model_items(FAQModel, ec, session, prune=True) == [faq1, faq2]
+
+        del fake_data_export.faqmatches[0]
+        with db.session() as session:
+            stored = sync_model_items(
+                FAQModel, ec, session, prune=True, metrics=metrics
+            )
+            assert stored == []
+        assert db.fetch_faqs() == [faq2]
+        counters = metrics.report()["tables"]["faqmatches"]["counters"]
+        assert counters["rows_deleted"] == 1
+
+        # Nothing is deleted if the export fails partway through.
+        fake_data_export.faqmatches[:] = [faq1d, faq2d]
+        fake_data_export.token = "goodtoken"  # noqa: S105 (Not a real token.)
+        with db.session() as session, pytest.raises(HTTPStatusError):
+            sync_model_items(FAQModel, ec, session, prune=True)
+        assert db.fetch_faqs() == [faq2]
+
+        match = "prune can't be combined with incremental or commit_every"
+        with db.session() as session, pytest.raises(ValueError, match=match):
+            sync_model_items(FAQModel, ec, session, prune=True, incremental=True)
+
+
+def test_sync_model_items_prune_digests(fake_data_export, db):
+    """
+    Pruning deletes the digests of the deleted rows even if the sync doesn't
+    use digests, so a later sync that does use them restores the rows if they
+    come back.
+    """
+    [faq1d, faq2d] = json.loads(read_test_data("two_faqs.json"))["result"]
+    [faq1, faq2] = [FAQModel.from_json(faqd) for faqd in [faq1d, faq2d]]
+    fake_data_export.faqmatches.extend([faq1d, faq2d])
+
+    with ExportClient(fake_data_export.base_url, "token") as ec:
+        with db.session() as session:
+            sync_model_items(FAQModel, ec, session, use_digests=True)
+
+        del fake_data_export.faqmatches[0]
+        with db.session() as session:
+            sync_model_items(FAQModel, ec, session, prune=True)
+        assert db.fetch_faqs() == [faq2]
+
+        fake_data_export.faqmatches.insert(0, faq1d)
+        with db.session() as session:
+            assert sync_model_items(FAQModel, ec, session, use_digests=True) == [faq1]
+        assert db.fetch_faqs() == [faq1, faq2]
+
+
+@pytest.mark.parametrize("incremental", [False, True])
+def test_sync_model_items_quarantine(fake_data_export, db, incremental):
+    """
+    Syncs can quarantine invalid items instead of failing, and store the
+    valid ones.
+    """
+    [faq1d, faq2d] = json.loads(read_test_data("two_faqs.json"))["result"]
+    [faq1, faq2] = [FAQModel.from_json(faqd) for faqd in [faq1d, faq2d]]
+    bad = faq1d | {"faq_id": 3, "faq_title": None, "extra": 1}
+    fake_data_export.faqmatches.extend([faq1d, bad, faq2d])
+    metrics = SyncMetrics()
+
+    with ExportClient(fake_data_export.base_url, "token") as ec:
+        with db.session() as session, pytest.raises(ValidationError):
+            sync_model_items(FAQModel, ec, session, incremental=incremental)
+        assert db.fetch_faqs() == []
+
+        with db.session() as session:
+            stored = sync_model_items(
+                FAQModel,
+                ec,
+                session,
+                incremental=incremental,
+                quarantine=True,
+                metrics=metrics,
+            )
+            assert stored == [faq1, faq2]
+        assert db.fetch_faqs() == [faq1, faq2]
+        with db.session() as session:
+            [quarantined] = fetch_quarantined(session, FAQModel)
+        assert quarantined.item == bad
+        assert quarantined.errors == [
+            "faq_title has type NoneType, expected str",
+            "Extra keys in JSON for faqmatches: extra",
+        ]
+        assert (
+            metrics.report()["tables"]["faqmatches"]["counters"]["rows_inserted"] == 2
+        )
+
+        # Syncing the invalid item again doesn't quarantine it twice.
+        with db.session() as session:
+            assert sync_model_items(FAQModel, ec, session, quarantine=True) == []
+        with db.session() as session:
+            [requarantined] = fetch_quarantined(session, FAQModel)
+        assert requarantined.item == bad
+
+        match = "quarantine can't be combined with prune or commit_every"
+        with db.session() as session, pytest.raises(ValueError, match=match):
+            sync_model_items(FAQModel, ec, session, quarantine=True, prune=True)
+
+
+def test_sync_model_items_commit_every(fake_data_export, db):
+    """
+    Syncs can commit as they go, and resume from the last checkpoint after a
+    failure.
+    """
+    [faq1d, faq2d] = json.loads(read_test_data("two_faqs.json"))["result"]
+    faq3d = faq2d | {"faq_id": 3}
+    [faq1, faq2, faq3] = [FAQModel.from_json(d) for d in [faq1d, faq2d, faq3d]]
+    fake_data_export.faqmatches.extend([faq1d, faq2d, faq3d])
+    # A conflicting second item makes the sync fail partway through.
+    faq2_conflict = FAQModel.from_json(faq2d | {"faq_title": "Conflict"})
+    with db.session() as session:
+        session.add(faq2_conflict)
+        session.commit()
+
+    with ExportClient(fake_data_export.base_url, "token") as ec:
+        with db.session() as session, pytest.raises(ValueError, match="different"):
+            sync_model_items(FAQModel, ec, session, commit_every=1, batch_size=1)
+        assert db.fetch_faqs() == [faq1, faq2_conflict]
+        with db.session() as session:
+            checkpoint = get_checkpoint(session, FAQModel)
+            assert checkpoint is not None
+            assert (checkpoint.offset, checkpoint.last_pkey) == (1, "[1]")
+
+        with db.session() as session:
+            session.delete(session.merge(faq2_conflict))
+            session.commit()
+        with db.session() as session:
+            stored = sync_model_items(FAQModel, ec, session, commit_every=2)
+            assert stored == [faq2, faq3]
+            assert get_checkpoint(session, FAQModel) is None
+
+    assert db.fetch_faqs() == [faq1, faq2, faq3]
+    [_, req] = fake_data_export.mock.get_requests()
+    assert req.url.params["offset"] == "1"
+
+
+def test_sync_model_items_commit_every_incremental(fake_data_export, db):
+    """
+    A resumed incremental sync uses the same export filters as the sync it's
+    resuming, and only advances the watermark when it's complete.
+    """
+    [faq1d, faq2d] = json.loads(read_test_data("two_faqs.json"))["result"]
+    updated = faq2d["faq_updated_utc"]
+    faq3d = faq2d | {"faq_id": 3, "faq_updated_utc": updated + 1}
+    faq4d = faq2d | {"faq_id": 4, "faq_updated_utc": updated + 2}
+    fake_data_export.faqmatches.extend([faq1d, faq2d])
+    fake_data_export.watermark_param = "updated_since"
+    kw: dict[str, Any] = {
+        "incremental": True,
+        "watermark_param": "updated_since",
+        "commit_every": 1,
+    }
+
+    with ExportClient(fake_data_export.base_url, "token") as ec:
+        with db.session() as session:
+            assert len(sync_model_items(FAQModel, ec, session, **kw)) == 2
+            assert get_watermark(session, FAQModel) == updated
+
+        # The second new item conflicts with an existing one.
+        fake_data_export.faqmatches.extend([faq3d, faq4d])
+        faq4_conflict = FAQModel.from_json(faq4d | {"faq_title": "Conflict"})
+        with db.session() as session:
+            session.add(faq4_conflict)
+            session.commit()
+        with db.session() as session, pytest.raises(ValueError, match="different"):
+            sync_model_items(FAQModel, ec, session, **kw)
+        with db.session() as session:
+            assert get_watermark(session, FAQModel) == updated
+            checkpoint = get_checkpoint(session, FAQModel)
+            assert checkpoint is not None
+            assert checkpoint.filters == {"updated_since": updated}
+            assert checkpoint.watermark == updated + 1
+            # The item at the old watermark and the first new one are done.
+            assert checkpoint.offset == 2
+
+            session.delete(session.merge(faq4_conflict))
+            session.commit()
+        with db.session() as session:
+            stored = sync_model_items(FAQModel, ec, session, **kw)
+            assert stored == [FAQModel.from_json(faq4d)]
+            assert get_watermark(session, FAQModel) == updated + 2
+
+    req = fake_data_export.mock.get_requests()[-1]
+    assert req.url.params["updated_since"] == str(updated)
+    assert req.url.params["offset"] == "2"
+
+
+def test_sync_model_items_commit_every_stale_checkpoint(fake_data_export, db):
+    """
+    A completed sync clears any checkpoint left by a failed one, so a later
+    sync that commits as it goes doesn't skip items added upstream since.
+    """
+    [faq1d, faq2d] = json.loads(read_test_data("two_faqs.json"))["result"]
+    faq3d = faq2d | {"faq_id": 3}
+    fake_data_export.faqmatches.extend([faq1d, faq2d])
+    with db.session() as session:
+        session.add(FAQModel.from_json(faq2d | {"faq_title": "Conflict"}))
+        session.commit()
+
+    with ExportClient(fake_data_export.base_url, "token") as ec:
+        with db.session() as session, pytest.raises(ValueError, match="different"):
+            sync_model_items(FAQModel, ec, session, commit_every=1)
+        with db.session() as session:
+            session.execute(delete(FAQModel).where(FAQModel.faq_id == 2))
+            session.commit()
+        with db.session() as session:
+            sync_model_items(FAQModel, ec, session)
+            assert get_checkpoint(session, FAQModel) is None
+
+        # A new item at a low offset.
+        fake_data_export.faqmatches.insert(0, faq3d)
+        with db.session() as session:
+            stored = sync_model_items(FAQModel, ec, session, commit_every=1)
+            assert stored == [FAQModel.from_json(faq3d)]
+
+
+@pytest.mark.parametrize(
+    ("checkpoint_kw", "kw"),
+    [
+        ({"incremental": True}, {}),
+        ({}, {"incremental": True}),
+        ({"filters": {"updated_since": 0}}, {"incremental": True}),
+    ],
+)
+def test_sync_model_items_commit_every_mismatched_checkpoint(
+    fake_data_export, db, checkpoint_kw, kw
+):
+    """
+    A checkpoint left by a sync with a different mode or different export
+    filters is ignored, and the sync starts from the beginning.
+    """
+    [faq1d, faq2d] = json.loads(read_test_data("two_faqs.json"))["result"]
+    fake_data_export.faqmatches.extend([faq1d, faq2d])
+    with db.session() as session:
+        set_checkpoint(session, FAQModel, 1, **checkpoint_kw)
+        session.commit()
+
+    with ExportClient(fake_data_export.base_url, "token") as ec, db.session() as s:
+        stored = sync_model_items(FAQModel, ec, s, commit_every=1, **kw)
+        assert len(stored) == 2
+        assert get_checkpoint(s, FAQModel) is None
+    [req] = fake_data_export.mock.get_requests()
+    assert req.url.params["offset"] == "0"
+
+
+def test_sync_model_items_fanout(fake_data_export, db, sqlite_db):
+    """
+    New items from the export API are stored in several dbs at once.
+    """
+    [faq1d, faq2d] = json.loads(read_test_data("two_faqs.json"))["result"]
+    [faq1, faq2] = [FAQModel.from_json(faqd) for faqd in [faq1d, faq2d]]
+    fake_data_export.faqmatches.append(faq1d)
+
+    def sync(**kw):
+        with db.session() as s1, sqlite_db.session() as s2:
+            futures = sync_model_items_fanout(FAQModel, ec, [s1, s2], **kw)
+            return [f.result() for f in futures]
+
+    with ExportClient(fake_data_export.base_url, "token") as ec:
+        # The first db already has the first item.
+        with db.session() as session:
+            assert sync_model_items(FAQModel, ec, session) == [faq1]
+
+        fake_data_export.faqmatches.append(faq2d)
+        assert sync() == [[faq2], [faq1, faq2]]
+        assert db.fetch_faqs() == [faq1, faq2]
+        assert sqlite_db.fetch_faqs() == [faq1, faq2]
+        assert len(fake_data_export.mock.get_requests()) == 2
+
+        # Nothing to sync.
+        assert sync(insert_method="executemany") == [[], []]
+        assert sync_model_items_fanout(FAQModel, ec, []) == []
+
+
+def test_sync_model_items_fanout_incremental(fake_data_export, db, sqlite_db):
+    """
+    Each db in a fan-out sync has its own watermark, and only the lowest one is
+    sent to the export API.
+    """
+    [faq1d, faq2d] = json.loads(read_test_data("two_faqs.json"))["result"]
+    [faq1, faq2] = [FAQModel.from_json(faqd) for faqd in [faq1d, faq2d]]
+    fake_data_export.faqmatches.extend([faq1d, faq2d])
+    fake_data_export.watermark_param = "updated_since"
+    kw: dict[str, Any] = {"incremental": True, "watermark_param": "updated_since"}
+    faq3d = faq1d | {"faq_id": 3, "faq_updated_utc": faq2d["faq_updated_utc"] + 1}
+    faq3 = FAQModel.from_json(faq3d)
+
+    with ExportClient(fake_data_export.base_url, "token") as ec:
+        for database in [db, sqlite_db]:
+            with database.session() as session:
+                sync_model_items(FAQModel, ec, session, **kw)
+        # The sqlite db is further ahead than the postgres one.
+        fake_data_export.faqmatches.append(faq3d)
+        with sqlite_db.session() as session:
+            assert sync_model_items(FAQModel, ec, session, **kw) == [faq3]
+
+        with db.session() as s1, sqlite_db.session() as s2:
+            futures = sync_model_items_fanout(FAQModel, ec, [s1, s2], **kw)
+            assert [f.result() for f in futures] == [[faq3], []]
+            assert get_watermark(s1, FAQModel) == faq3d["faq_updated_utc"]
+            assert get_watermark(s2, FAQModel) == faq3d["faq_updated_utc"]
+        req = fake_data_export.mock.get_requests()[-1]
+        assert req.url.params["updated_since"] == str(faq2d["faq_updated_utc"])
+
+    assert db.fetch_faqs() == [faq1, faq2, faq3]
+    assert sqlite_db.fetch_faqs() == [faq1, faq2, faq3]
+
+
+def test_sync_model_items_fanout_db_failure(fake_data_export, db):
+    """
+    If one db in a fan-out sync fails, the others are still synced.
+    """
+    [faq1d, faq2d] = json.loads(read_test_data("two_faqs.json"))["result"]
+    fake_data_export.faqmatches.extend([faq1d, faq2d, faq2d | {"faq_id": 3}])
+    # This db doesn't have any tables.
+    empty_db = Database(create_engine("sqlite://", echo=False))
+
+    with (
+        ExportClient(fake_data_export.base_url, "token") as ec,
+        db.session() as s1,
+        empty_db.session() as s2,
+    ):
+        # Use small chunks so that the failed db has to drain its queue.
+        with pytest.MonkeyPatch.context() as mp:
+            mp.setattr("aaq_sync.sync.FANOUT_CHUNK_SIZE", 1)
+            mp.setattr("aaq_sync.sync.FANOUT_QUEUE_CHUNKS", 1)
+            [f1, f2] = sync_model_items_fanout(FAQModel, ec, [s1, s2])
+        assert len(f1.result()) == 3
+        with pytest.raises(OperationalError, match="no such table"):
+            f2.result()
+    assert len(db.fetch_faqs()) == 3
+
+
+def test_sync_model_items_fanout_export_failure(fake_data_export, db, sqlite_db):
+    """
+    If fetching from the export API fails partway through a fan-out sync,
+    nothing is stored in any db.
+    """
+    faqds = json.loads(read_test_data("two_faqs.json"))["result"]
+    fake_data_export.faqmatches.extend(faqds)
+    fake_data_export.max_limit = 1
+
+    with (
+        ExportClient(fake_data_export.base_url, "token") as ec,
+        db.session() as s1,
+        sqlite_db.session() as s2,
+        pytest.MonkeyPatch.context() as mp,
+    ):
+        mp.setattr("aaq_sync.sync.FANOUT_CHUNK_SIZE", 1)
+        with pytest.raises(HTTPStatusError):
+            sync_model_items_fanout(FAQModel, ec, [s1, s2], insert_method="executemany")
+    assert db.fetch_faqs() == []
+    assert sqlite_db.fetch_faqs() == []
@@ -0,0 +1,161 @@
+import json
+
+from sqlalchemy import inspect
+
+from aaq_sync.data_models import Base, FAQModel, InvalidItem
+from aaq_sync.sync_state import (
+    SyncState,
+    clear_checkpoint,
+    fetch_digests,
+    fetch_quarantined,
+    get_checkpoint,
+    get_sync_state,
+    get_watermark,
+    quarantine_items,
+    set_checkpoint,
+    set_watermark,
+    store_digests,
+)
+
+from .helpers import Database, read_test_data
+
+
+def test_state_table_created_on_demand(dbengine):
+    """
+    The sync state table is created the first time we look for state.
+    """
+    db = Database(dbengine)
+    assert not inspect(dbengine).has_table(SyncState.__tablename__)
+
+    with db.session() as session:
+        assert get_sync_state(session, FAQModel) is None
+        session.commit()
+
+    assert inspect(dbengine).has_table(SyncState.__tablename__)
+    # Our bookkeeping tables aren't AAQ models.
+    assert SyncState.__tablename__ not in Base.metadata.tables
+
+
+def test_watermark(dbengine):
+    """
+    Watermarks are stored per table and can be updated.
+    """
+    db = Database(dbengine)
+
+    with db.session() as session:
+        assert get_watermark(session, FAQModel) is None
+        set_watermark(session, FAQModel, 1663239625854)
+        session.commit()
+
+    with db.session() as session:
+        assert get_watermark(session, FAQModel) == 1663239625854
+        set_watermark(session, FAQModel, 1663838999026)
+        session.commit()
+
+    with db.session() as session:
+        assert get_watermark(session, FAQModel) == 1663838999026
+
+
+def test_digests(dbengine):
+    """
+    Content digests are stored per table and fetched by pkey.
+    """
+    db = Database(dbengine)
+    faq_dicts = json.loads(read_test_data("two_faqs.json"))["result"]
+    [faq1, faq2] = [FAQModel.from_json(faqd) for faqd in faq_dicts]
+
+    with db.session() as session:
+        assert fetch_digests(session, FAQModel) == {}
+        store_digests(session, FAQModel, [])
+        store_digests(session, FAQModel, [faq1])
+        session.commit()
+
+    with db.session() as session:
+        assert fetch_digests(session, FAQModel) == {(1,): faq1.content_digest()}
+        store_digests(session, FAQModel, [faq2])
+        session.commit()
+
+    with db.session() as session:
+        assert fetch_digests(session, FAQModel) == {
+            (1,): faq1.content_digest(),
+            (2,): faq2.content_digest(),
+        }
+
+
+def test_checkpoint(dbengine):
+    """
+    Checkpoints are stored per table and can be updated and cleared.
+    """
+    db = Database(dbengine)
+
+    with db.session() as session:
+        assert get_checkpoint(session, FAQModel) is None
+        set_checkpoint(session, FAQModel, 1000, last_pkey=(999,))
+        session.commit()
+
+    with db.session() as session:
+        checkpoint = get_checkpoint(session, FAQModel)
+        assert checkpoint is not None
+        assert (checkpoint.offset, checkpoint.last_pkey) == (1000, "[999]")
+        assert (checkpoint.filters, checkpoint.watermark) == (None, None)
+        assert not checkpoint.incremental
+        set_checkpoint(
+            session, FAQModel, 2000, {"since": 5}, 7, (1999,), incremental=True
+        )
+        session.commit()
+
+    with db.session() as session:
+        checkpoint = get_checkpoint(session, FAQModel)
+        assert checkpoint is not None
+        assert (checkpoint.offset, checkpoint.last_pkey) == (2000, "[1999]")
+        assert (checkpoint.filters, checkpoint.watermark) == ({"since": 5}, 7)
+        assert checkpoint.incremental
+        clear_checkpoint(session, FAQModel)
+        # Clearing a missing checkpoint does nothing.
+        clear_checkpoint(session, FAQModel)
+        session.commit()
+
+    with db.session() as session:
+        assert get_checkpoint(session, FAQModel) is None
+
+
+def test_quarantine(dbengine):
+    """
+    Invalid items are stored per table with their errors, and kept in the
+    order they were quarantined.
+    """
+    db = Database(dbengine)
+    bad1 = InvalidItem({"faq_id": "one"}, ["faq_id has type str, expected int"])
+    bad2 = InvalidItem({"faq_id": 2}, ["faq_title is missing", "faq_tags is missing"])
+
+    with db.session() as session:
+        assert fetch_quarantined(session, FAQModel) == []
+        quarantine_items(session, FAQModel, [])
+        quarantine_items(session, FAQModel, [bad1])
+        quarantine_items(session, FAQModel, [bad2])
+        session.commit()
+
+    with db.session() as session:
+        quarantined = fetch_quarantined(session, FAQModel)
+        assert [(q.item, q.errors) for q in quarantined] == [bad1, bad2]
+        assert {q.table_name for q in quarantined} == {"faqmatches"}
+
+
+def test_quarantine_replaces(dbengine):
+    """
+    Quarantining an item again replaces its entry, whether it's identified
+    by its pkey or (if that's missing) by its content.
+    """
+    db = Database(dbengine)
+    bad1 = InvalidItem({"faq_id": 1}, ["faq_title is missing"])
+    bad1_again = InvalidItem({"faq_id": 1, "faq_title": None}, ["faq_title is None"])
+    nokey = InvalidItem({"faq_title": "Title"}, ["faq_id is missing"])
+
+    with db.session() as session:
+        quarantine_items(session, FAQModel, [bad1, nokey, nokey])
+        quarantine_items(session, FAQModel, [bad1_again, nokey])
+        session.commit()
+
+    with db.session() as session:
+        quarantined = fetch_quarantined(session, FAQModel)
+        assert [(q.item, q.errors) for q in quarantined] == [bad1_again, nokey]
@@ -0,0 +1,235 @@
+from datetime import UTC, datetime, timedelta
+from email.utils import format_datetime
+
+import pytest
+from httpx import (
+    AsyncClient,
+    Client,
+    ConnectError,
+    HTTPTransport,
+    MockTransport,
+    Request,
+    Response,
+)
+
+from aaq_sync.transport import (
+    HTTPOptions,
+    RetryTransport,
+    http2_available,
+    supported_encodings,
+)
+
+
+class FlakyHandler:
+    """
+    A mock transport handler that fails with each of the given responses (or
+    exceptions) in turn, and then succeeds.
+    """
+
+    def __init__(self, *failures: Response | Exception):
+        self.failures = list(failures)
+        self.requests = 0
+
+    def __call__(self, request: Request) -> Response:
+        self.requests += 1
+        if self.failures:
+            failure = self.failures.pop(0)
+            if isinstance(failure, Exception):
+                raise failure
+            return failure
+        return Response(200, text="ok")
+
+
+def retry_client(handler: FlakyHandler, sleeps: list[float], **kw) -> Client:
+    transport = RetryTransport(MockTransport(handler), sleep=sleeps.append, **kw)
+    return Client(transport=transport)
+
+
+def test_retry_backoff():
+    """
+    Retryable statuses and connection errors are retried with exponential
+    backoff.
+    """
+    handler = FlakyHandler(
+        Response(503), ConnectError("nope"), Response(429), Response(502), Response(500)
+    )
+    sleeps: list[float] = []
+    with retry_client(handler, sleeps, retries=5, backoff=0.5) as client:
+        assert client.get("https://example.com/").text == "ok"
+    assert handler.requests == 6
+    assert sleeps == [0.5, 1.0, 2.0, 4.0, 8.0]
+
+
+def test_retry_max_backoff():
+    """
+    The backoff never grows beyond `max_backoff`.
+    """
+    handler = FlakyHandler(*[Response(503)] * 4)
+    sleeps: list[float] = []
+    with retry_client(handler, sleeps, retries=4, max_backoff=1.5) as client:
+        assert client.get("https://example.com/").text == "ok"
+    assert sleeps == [0.5, 1.0, 1.5, 1.5]
+
+
+def test_retry_gives_up():
+    """
+    After the given number of retries, the last failure is returned or raised.
+    """
+    handler = FlakyHandler(Response(503), Response(503), Response(503))
+    sleeps: list[float] = []
+    with retry_client(handler, sleeps, retries=2) as client:
+        assert client.get("https://example.com/").status_code == 503
+    assert handler.requests == 3
+
+    handler = FlakyHandler(ConnectError("nope"), ConnectError("still nope"))
+    with (
+        retry_client(handler, sleeps, retries=1) as client,
+        pytest.raises(ConnectError, match="still nope"),
+    ):
+        client.get("https://example.com/")
+    assert handler.requests == 2
+
+
+@pytest.mark.parametrize("status", [400, 401, 404, 501])
+def test_retry_not_retryable(status):
+    """
+    Statuses that won't change if we try again aren't retried.
+    """
+    handler = FlakyHandler(Response(status))
+    sleeps: list[float] = []
+    with retry_client(handler, sleeps) as client:
+        assert client.get("https://example.com/").status_code == status
+    assert handler.requests == 1
+    assert sleeps == []
+
+
+def test_retry_after_seconds():
+    """
+    We wait for at least as long as the server asks us to.
+    """
+    handler = FlakyHandler(
+        Response(429, headers={"Retry-After": "7"}),
+        Response(429, headers={"Retry-After": "0"}),
+        Response(429, headers={"Retry-After": "soon"}),
+    )
+    sleeps: list[float] = []
+    with retry_client(handler, sleeps) as client:
+        assert client.get("https://example.com/").text == "ok"
+    assert sleeps == [7.0, 1.0, 2.0]
+
+
+def test_retry_after_date():
+    """
+    The server can ask us to wait until a given date.
+    """
+    later = datetime.now(UTC) + timedelta(seconds=10)
+    handler = FlakyHandler(
+        Response(503, headers={"Retry-After": format_datetime(later, usegmt=True)}),
+        Response(503, headers={"Retry-After": "Thu, 01 Jan 1970 00:00:00"}),
+    )
+    sleeps: list[float] = []
+    with retry_client(handler, sleeps) as client:
+        assert client.get("https://example.com/").text == "ok"
+    [first, second] = sleeps
+    assert 8 < first <= 10
+    assert second == 1.0
+
+
+def test_retry_after_too_long():
+    """
+    If the server asks us to wait longer than `max_backoff`, we give up
+    instead.
+    """
+    handler = FlakyHandler(Response(429, headers={"Retry-After": "3600"}))
+    sleeps: list[float] = []
+    with retry_client(handler, sleeps) as client:
+        assert client.get("https://example.com/").status_code == 429
+    assert sleeps == []
+
+
+@pytest.mark.anyio()
+async def test_retry_async():
+    """
+    Async requests are retried the same way.
+    """
+    handler = FlakyHandler(
+        Response(503, headers={"Retry-After": "2"}), ConnectError("nope")
+    )
+    sleeps: list[float] = []
+
+    async def sleep(seconds: float):
+        sleeps.append(seconds)
+
+    transport = RetryTransport(MockTransport(handler), async_sleep=sleep)
+    async with AsyncClient(transport=transport) as client:
+        assert (await client.get("https://example.com/")).text == "ok"
+    assert sleeps == [2.0, 1.0]
+
+    handler = FlakyHandler(Response(503), ConnectError("nope"))
+    transport = RetryTransport(MockTransport(handler), retries=1, async_sleep=sleep)
+    async with AsyncClient(transport=transport) as client:
+        with pytest.raises(ConnectError):
+            await client.get("https://example.com/")
+
+
+def test_http_options_defaults():
+    """
+    By default we ask for every encoding we can decode, and don't retry.
+    """
+    opts = HTTPOptions()
+    assert opts.encodings == tuple(supported_encodings())
+    assert opts.headers() == {"Accept-Encoding": ", ".join(supported_encodings())}
+    assert isinstance(opts.transport(), HTTPTransport)
+    assert HTTPOptions(encodings=[]).headers() == {"Accept-Encoding": "identity"}
+
+
+def test_supported_encodings(monkeypatch):
+    """
+    Brotli and zstd are only supported if the packages that decode them are
+    installed, and httpx only decodes zstd from 0.27.
+    """
+    installed: set[str] = set()
+    monkeypatch.setattr(
+        "aaq_sync.transport.find_spec", lambda name: name if name in installed else None
+    )
+    assert supported_encodings() == ["gzip", "deflate"]
+    installed.add("brotlicffi")
+    assert supported_encodings() == ["br", "gzip", "deflate"]
+    installed.add("zstandard")
+    monkeypatch.setattr("aaq_sync.transport.httpx_version", "0.26.0")
+    assert supported_encodings() == ["br", "gzip", "deflate"]
+    monkeypatch.setattr("aaq_sync.transport.httpx_version", "0.27.2")
+    assert supported_encodings() == ["zstd", "br", "gzip", "deflate"]
+
+
+def test_http_options_http2():
+    """
+    HTTP/2 is only available if the optional h2 package is installed.
+    """
+    if http2_available():
+        assert isinstance(HTTPOptions(http2=True).transport(), HTTPTransport)
+    else:
+        with pytest.raises(ImportError, match="needs the h2 package"):
+            HTTPOptions(http2=True)
+
+
+def test_http_options_unsupported_encoding():
+    with pytest.raises(ValueError, match="Can't decode content encodings: nope"):
+        HTTPOptions(encodings=["gzip", "nope"])
+
+
+def test_http_options_transport():
+    """
+    The transport we build has the given limits, and retries if asked to.
+    """
+    opts = HTTPOptions(max_connections=3, max_keepalive_connections=2, retries=2)
+    limits = opts.limits()
+    assert (limits.max_connections, limits.max_keepalive_connections) == (3, 2)
+    assert opts.timeouts().read == 5.0
+
+    mock = MockTransport(FlakyHandler())
+    transport = opts.transport(mock)
+    assert isinstance(transport, RetryTransport)
+    assert transport.transport is mock
+    assert transport.retries == 2
+    assert isinstance(opts.async_transport(), RetryTransport)